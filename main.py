@@ -5,16 +5,26 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory, request, jsonify
 from flask_cors import CORS
-from src.models.user import db
+from werkzeug.middleware.proxy_fix import ProxyFix
 from src.models.job import Job
+from src.models.database import configure_database, create_schema
 from src.routes.user import user_bp
 from src.routes.conversion import conversion_bp
 from src.routes.health import health_bp
+from src.routes.upload import upload_bp
+from src.routes.batch import batch_bp
+from src.services.worker_pool import conversion_pool
+from src.services.disk_manager import disk_manager
 from src.utils.logging import log_request, log_response, health_monitor
+from src.utils.large_files import TRUSTED_PROXY_HOPS
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Take the client address from the X-Forwarded-For hop our own proxy appended
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
 # Enable CORS for frontend integration - restrict to production domain
 # In development, REPLIT_DEPLOYMENT will not be set, so we allow all origins for testing
 if os.environ.get('REPLIT_DEPLOYMENT'):
@@ -28,6 +38,8 @@ else:
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(conversion_bp, url_prefix='/api')
 app.register_blueprint(health_bp, url_prefix='/api')
+app.register_blueprint(upload_bp, url_prefix='/api')
+app.register_blueprint(batch_bp, url_prefix='/api')
 
 # Add request/response logging middleware
 @app.before_request
@@ -39,13 +51,20 @@ def before_request():
 def after_request(response):
     return log_response(response)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'src', 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'check_same_thread': False}}
-db.init_app(app)
-with app.app_context():
-    db.create_all()
+# Database configuration (DATABASE_URL, pooled engine, WAL for SQLite)
+configure_database(app)
+
+# Image pool processes started under `python main.py` import this script again as
+# __mp_main__; only the real app process may create the schema and start workers
+if __name__ != '__mp_main__':
+    with app.app_context():
+        create_schema()
+    
+    # Start the conversion workers (also picks up jobs orphaned by a previous run)
+    conversion_pool.init_app(app)
+    
+    # Start the disk janitor for the uploads and outputs directories
+    disk_manager.init_app(app)
 
 @app.errorhandler(500)
 def internal_error(error):
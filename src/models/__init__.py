@@ -1,4 +1,6 @@
 from .user import db
 from .job import Job
+from .job_group import JobGroup
+from .database import configure_database, create_schema, progress_batcher
 
-__all__ = ['db', 'Job']
+__all__ = ['db', 'Job', 'JobGroup', 'configure_database', 'create_schema', 'progress_batcher']
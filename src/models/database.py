@@ -0,0 +1,174 @@
+import os
+import time
+import atexit
+import threading
+import logging
+from sqlalchemy import event, update, bindparam, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from .user import db
+from src.utils.job_events import shared_job_versions
+from src.utils.large_files import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_BUSY_TIMEOUT_MS,
+    PROGRESS_FLUSH_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(PROJECT_ROOT, 'src', 'database', 'app.db')}"
+
+def get_database_url():
+    """Get the database URL from DATABASE_URL, resolving relative SQLite paths against the project root"""
+    url = make_url(os.environ.get('DATABASE_URL') or DEFAULT_DATABASE_URL)
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:' \
+            and not os.path.isabs(url.database):
+        url = url.set(database=os.path.join(PROJECT_ROOT, url.database))
+    return url.render_as_string(hide_password=False)
+
+def get_engine_options(url):
+    """Pooled engine settings for the configured database"""
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {
+            'connect_args': {'check_same_thread': False, 'timeout': DB_BUSY_TIMEOUT_MS / 1000},
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW
+        }
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL so readers don't block the writer, and wait on locks instead of failing"""
+    if type(dbapi_connection).__module__ != 'sqlite3':
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-20000')  # 20MB page cache
+    cursor.close()
+
+def configure_database(app):
+    """Configure the database URL and engine, and start the progress batcher"""
+    url = get_database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(url)
+    db.init_app(app)
+    progress_batcher.init_app(app)
+
+def create_schema():
+    """Create missing tables, columns and indexes (create_all skips those of existing tables)"""
+    db.create_all()
+    _add_missing_columns()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def _add_missing_columns():
+    """Add nullable columns introduced after a table was created"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+            except Exception:
+                # Another worker process may have added it first
+                if column.name not in {c['name'] for c in inspect(db.engine).get_columns(table.name)}:
+                    raise
+
+class ProgressBatcher:
+    """
+    Groups progress-only job updates into one write transaction.
+
+    Progress ticks are recorded in memory and flushed every
+    PROGRESS_FLUSH_INTERVAL seconds with a single executemany UPDATE, instead
+    of a commit per tick. Status changes are still committed immediately and
+    discard any pending progress for the job; the flush only touches jobs that
+    are still 'processing', so a late tick can never overwrite a final state.
+    """
+    def __init__(self, flush_interval=PROGRESS_FLUSH_INTERVAL):
+        self.app = None
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'queued_updates': 0, 'flushes': 0, 'flushed_rows': 0}
+
+    def init_app(self, app):
+        """Bind to a Flask app and start the flush thread"""
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="progress-batcher")
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.flush)
+
+    @property
+    def enabled(self):
+        return self.app is not None
+
+    def record(self, job_id, progress, updated_at):
+        """Queue a progress update for the next flush"""
+        with self._lock:
+            self._pending[job_id] = {'b_job_id': job_id, 'b_progress': progress, 'b_updated_at': updated_at}
+            self.stats['queued_updates'] += 1
+
+    def discard(self, job_id):
+        """Drop a pending progress update, e.g. because the job changed status"""
+        with self._lock:
+            self._pending.pop(job_id, None)
+
+    def flush(self):
+        """Write all pending progress updates in one transaction"""
+        with self._lock:
+            rows = list(self._pending.values())
+            self._pending.clear()
+        if not rows or not self.enabled:
+            return 0
+
+        from .job import Job
+        statement = (update(Job.__table__)
+                     .where(Job.__table__.c.job_id == bindparam('b_job_id'))
+                     .where(Job.__table__.c.status == 'processing')
+                     .values(progress=bindparam('b_progress'), updated_at=bindparam('b_updated_at')))
+
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(statement, rows)
+        for row in rows:
+            shared_job_versions.bump(row['b_job_id'])
+
+        self.stats['flushes'] += 1
+        self.stats['flushed_rows'] += len(rows)
+        return len(rows)
+
+    def get_stats(self):
+        """Get batching statistics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {'pending_updates': pending, **self.stats}
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush job progress: {str(e)}")
+
+# Global progress batcher instance
+progress_batcher = ProgressBatcher()
@@ -1,9 +1,23 @@
 from datetime import datetime
+import json
 import uuid
+from sqlalchemy.orm.attributes import set_committed_value
 from .user import db
+from .database import progress_batcher
+from src.utils.job_events import job_event_bus, shared_job_versions
+from src.utils.status_cache import job_status_cache
 
 class Job(db.Model):
     __tablename__ = 'jobs'
+    __table_args__ = (
+        # Status counts, queue claims (oldest queued first) and orphan recovery
+        db.Index('ix_jobs_status_created_at', 'status', 'created_at'),
+        db.Index('ix_jobs_status_updated_at', 'status', 'updated_at'),
+        # Time range queries in /api/status
+        db.Index('ix_jobs_created_at', 'created_at'),
+        # Batch progress and per-batch concurrency
+        db.Index('ix_jobs_group_id_status', 'group_id', 'status'),
+    )
     
     job_id = db.Column(db.String(255), primary_key=True, default=lambda: str(uuid.uuid4()))
     from_format = db.Column(db.String(10), nullable=False)
@@ -14,6 +28,11 @@ class Job(db.Model):
     converted_file_path = db.Column(db.String(255))
     source_url = db.Column(db.String(500))  # For YouTube URLs
     error_message = db.Column(db.Text)
+    group_id = db.Column(db.String(255))  # Batch the job belongs to, if any
+    source_name = db.Column(db.String(255))  # Original filename, names the result in batch downloads
+    conversion_path = db.Column(db.String(20))  # How the output was produced: remux, encode, segmented, youtube, cache, ...
+    encoding_mode = db.Column(db.String(10))  # Client's speed/balanced/quality choice for media jobs
+    encoding_profile = db.Column(db.Text)  # JSON of the planned encoder settings and the inputs they were chosen from
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -25,15 +44,58 @@ class Job(db.Model):
             'status': self.status,
             'progress': self.progress,
             'error_message': self.error_message,
+            'conversion_path': self.conversion_path,
+            'encoding_mode': self.encoding_mode,
+            'encoding_profile': json.loads(self.encoding_profile) if self.encoding_profile else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
+    def status_dict(self):
+        """Status fields reported by /status and the event stream"""
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'progress': self.progress,
+            'error_message': self.error_message,
+            'conversion_path': self.conversion_path
+        }
+    
+    @classmethod
+    def get_status(cls, job_id):
+        """Get a job's status dict from the status cache, falling back to the database"""
+        status = job_status_cache.get(job_id)
+        if status is not None:
+            return status
+        
+        job = db.session.get(cls, job_id)
+        if not job:
+            return None
+        
+        status = job.status_dict()
+        job_status_cache.put(job_id, status)
+        return status
+    
     def update_status(self, status, progress=None, error_message=None):
-        self.status = status
-        if progress is not None:
-            self.progress = progress
-        if error_message is not None:
-            self.error_message = error_message
-        self.updated_at = datetime.utcnow()
-        db.session.commit()
+        now = datetime.utcnow()
+        
+        if (progress_batcher.enabled and status == self.status == 'processing'
+                and progress is not None and error_message is None):
+            # Progress-only tick: batch the write instead of committing now
+            set_committed_value(self, 'progress', progress)
+            set_committed_value(self, 'updated_at', now)
+            progress_batcher.record(self.job_id, progress, now)
+        else:
+            progress_batcher.discard(self.job_id)
+            self.status = status
+            if progress is not None:
+                self.progress = progress
+            if error_message is not None:
+                self.error_message = error_message
+            self.updated_at = now
+            db.session.commit()
+            shared_job_versions.bump(self.job_id)
+        
+        status_dict = self.status_dict()
+        job_status_cache.put(self.job_id, status_dict, authoritative=True)
+        job_event_bus.publish(self.job_id, status_dict)
@@ -0,0 +1,54 @@
+from datetime import datetime
+import uuid
+from sqlalchemy import func
+from .user import db
+from .job import Job
+
+class JobGroup(db.Model):
+    """A batch of conversion jobs created in one request with a shared target format"""
+    __tablename__ = 'job_groups'
+    
+    group_id = db.Column(db.String(255), primary_key=True, default=lambda: str(uuid.uuid4()))
+    to_format = db.Column(db.String(10), nullable=False)
+    total_jobs = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def jobs_by_status(self):
+        """Job counts and summed progress per status, from one grouped query"""
+        rows = (db.session.query(Job.status, func.count(Job.job_id), func.coalesce(func.sum(Job.progress), 0))
+                .filter(Job.group_id == self.group_id)
+                .group_by(Job.status)
+                .all())
+        return {status: (count, progress) for status, count, progress in rows}
+    
+    def status_dict(self):
+        """Aggregate status and progress of the group's jobs"""
+        by_status = self.jobs_by_status()
+        counts = {status: 0 for status in ('queued', 'processing', 'completed', 'failed')}
+        progress_total = 0
+        for status, (count, progress) in by_status.items():
+            counts[status] = count
+            # Finished jobs count as done whatever progress they reached
+            progress_total += count * 100 if status in ('completed', 'failed') else progress
+        
+        total = sum(counts.values())
+        if counts['queued'] + counts['processing'] == 0:
+            status = 'completed' if counts['completed'] else 'failed'
+        elif counts['queued'] == total:
+            status = 'queued'
+        else:
+            status = 'processing'
+        
+        return {
+            'group_id': self.group_id,
+            'status': status,
+            'progress': progress_total // total if total else 0,
+            'total_jobs': total,
+            'jobs_by_status': counts,
+            'to_format': self.to_format,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    def jobs(self):
+        """The group's jobs ordered by filename"""
+        return Job.query.filter(Job.group_id == self.group_id).order_by(Job.source_name, Job.job_id).all()
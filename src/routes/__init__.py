@@ -1,5 +1,7 @@
+from .batch import batch_bp
 from .conversion import conversion_bp
 from .health import health_bp
+from .upload import upload_bp
 from .user import user_bp
 
-__all__ = ['conversion_bp', 'health_bp', 'user_bp']
+__all__ = ['batch_bp', 'conversion_bp', 'health_bp', 'upload_bp', 'user_bp']
@@ -0,0 +1,188 @@
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+import os
+import uuid
+from datetime import datetime
+from src.models.job import Job, db
+from src.models.job_group import JobGroup
+from src.services.worker_pool import conversion_pool
+from src.services.disk_manager import disk_manager, require_disk_space
+from src.utils.validators import validate_conversion, sanitize_filename
+from src.utils.zip_stream import stream_zip
+from src.utils.large_files import (
+    STREAMING_UPLOADS,
+    BATCH_MAX_FILES,
+    ENCODING_MODES,
+    DEFAULT_ENCODING_MODE,
+    RATE_LIMIT_WINDOW,
+    CONVERSION_RATE_LIMIT,
+    STATUS_RATE_LIMIT
+)
+from src.utils.security import rate_limit, upload_cost
+from src.routes.conversion import CONVERSION_MAP, large_file_handler
+from src.routes.upload import chunked_upload_manager
+
+batch_bp = Blueprint('batch', __name__)
+
+def _parse_batch_form():
+    """Get the form fields and the saved files ('files' parts) of a batch request"""
+    boundary = request.mimetype_params.get('boundary')
+    if STREAMING_UPLOADS and request.mimetype == 'multipart/form-data' and boundary:
+        return large_file_handler.save_streamed_uploads(request.stream, boundary, max_files=BATCH_MAX_FILES)
+
+    uploads = []
+    try:
+        for file in request.files.getlist('files')[:BATCH_MAX_FILES]:
+            if not file.filename:
+                continue
+            safe_filename = sanitize_filename(file.filename) or 'upload'
+            path = large_file_handler.save_large_file(file, f"{uuid.uuid4()}_{safe_filename}")
+            uploads.append({'filename': safe_filename, 'path': path})
+    except Exception:
+        for upload in uploads:
+            large_file_handler.cleanup_file(upload['path'])
+        raise
+    return request.form, uploads
+
+@batch_bp.route('/batch', methods=['POST'])
+@rate_limit(limit=CONVERSION_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='conversion',
+            cost=lambda req: upload_cost(req.content_length))
+@require_disk_space(size=lambda req: req.content_length)
+def create_batch():
+    """Start a batch of conversions sharing one target format"""
+    uploads = []
+    try:
+        form, uploads = _parse_batch_form()
+        response = _create_job_group(form, uploads)
+
+        # Only keep the files if a batch was created for them
+        if response[1] != 202:
+            for upload in uploads:
+                large_file_handler.cleanup_file(upload['path'])
+        return response
+
+    except ValueError as e:
+        for upload in uploads:
+            large_file_handler.cleanup_file(upload['path'])
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        for upload in uploads:
+            large_file_handler.cleanup_file(upload['path'])
+        return jsonify({'error': str(e)}), 500
+
+def _create_job_group(form, uploads):
+    """Validate a batch and queue one job per file in a single transaction"""
+    to_format = form.get('to')
+    if not to_format:
+        return jsonify({'error': 'Missing required parameters'}), 400
+
+    mode = form.get('mode') or DEFAULT_ENCODING_MODE
+    if mode not in ENCODING_MODES:
+        return jsonify({'error': f"mode must be one of {', '.join(ENCODING_MODES)}"}), 400
+
+    sources = [(upload['filename'], upload['path']) for upload in uploads]
+    upload_ids = [upload_id for upload_id in form.get('upload_ids', '').split(',') if upload_id]
+    if len(sources) + len(upload_ids) > BATCH_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_MAX_FILES} files per batch'}), 400
+
+    for upload_id in upload_ids:
+        try:
+            manifest = chunked_upload_manager.get_manifest(upload_id)
+            sources.append((manifest['filename'], chunked_upload_manager.complete_upload(upload_id)))
+        except KeyError:
+            return jsonify({'error': 'Upload not found', 'upload_id': upload_id}), 404
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+
+    if not sources:
+        return jsonify({'error': 'At least one file required'}), 400
+
+    # All jobs share the batch's creation time so the batch holds one place in the queue
+    group = JobGroup(group_id=str(uuid.uuid4()), to_format=to_format,
+                     total_jobs=len(sources), created_at=datetime.utcnow())
+    jobs = []
+    for filename, path in sources:
+        from_format = form.get('from') or os.path.splitext(filename)[1].lstrip('.').lower()
+        if from_format == 'youtube' or not validate_conversion(from_format, to_format, CONVERSION_MAP):
+            return jsonify({'error': 'Unsupported conversion', 'filename': filename}), 400
+        jobs.append(Job(from_format=from_format, to_format=to_format, source_file_path=path,
+                        source_name=filename, group_id=group.group_id, created_at=group.created_at,
+                        encoding_mode=mode))
+
+    db.session.add(group)
+    db.session.add_all(jobs)
+    db.session.commit()
+
+    for upload_id in upload_ids:
+        chunked_upload_manager.release_upload(upload_id)
+
+    conversion_pool.submit(group.group_id)
+
+    return jsonify({
+        'group_id': group.group_id,
+        'status': 'queued',
+        'total_jobs': len(jobs),
+        'job_ids': [job.job_id for job in jobs]
+    }), 202
+
+@batch_bp.route('/batch/<group_id>', methods=['GET'])
+@rate_limit(limit=STATUS_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='status')
+def get_batch_status(group_id):
+    """Get the aggregate progress of a batch and the status of each of its jobs"""
+    try:
+        group = db.session.get(JobGroup, group_id)
+        if not group:
+            return jsonify({'error': 'Batch not found'}), 404
+
+        status = group.status_dict()
+        status['jobs'] = [dict(job.status_dict(), filename=job.source_name) for job in group.jobs()]
+        return jsonify(status)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@batch_bp.route('/batch/<group_id>/download', methods=['GET'])
+@rate_limit(limit=STATUS_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='status')
+def download_batch(group_id):
+    """Download the converted files of a finished batch as a zip streamed while it is built"""
+    try:
+        group = db.session.get(JobGroup, group_id)
+        if not group:
+            return jsonify({'error': 'Batch not found'}), 404
+
+        jobs = group.jobs()
+        if any(job.status in ('queued', 'processing') for job in jobs):
+            return jsonify({'error': 'Batch not completed'}), 400
+
+        entries = _zip_entries(jobs)
+        if not entries:
+            return jsonify({'error': 'No converted files to download'}), 404
+
+        # Don't hold a pooled connection while the zip streams
+        db.session.remove()
+
+        response = Response(stream_with_context(stream_zip(entries)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="batch-{group_id[:8]}.zip"'
+        # Stream straight through nginx instead of spooling the archive to its temp files
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _zip_entries(jobs):
+    """(path, unique name in the archive) of every completed job's result"""
+    entries = []
+    used_names = set()
+    for job in jobs:
+        if job.status != 'completed' or not job.converted_file_path or not os.path.exists(job.converted_file_path):
+            continue
+        stem = os.path.splitext(job.source_name or job.job_id)[0]
+        name = f"{stem}.{job.to_format}"
+        counter = 2
+        while name.lower() in used_names:
+            name = f"{stem} ({counter}).{job.to_format}"
+            counter += 1
+        used_names.add(name.lower())
+        entries.append((job.converted_file_path, name))
+        disk_manager.touch(job.converted_file_path)
+    return entries
@@ -1,104 +1,284 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, make_response, Response, stream_with_context
 import os
+import json
+import time
 from src.models.job import Job, db
-from src.services.conversion_service import ConversionService
+from src.services.worker_pool import conversion_pool
+from src.services.disk_manager import disk_manager, require_disk_space
 from src.utils.validators import validate_conversion, sanitize_filename
 from src.utils.large_file_handler import LargeFileHandler
+from src.utils.job_events import job_event_bus, shared_job_versions
+from src.utils.status_cache import job_status_cache, FINISHED_STATUSES
+from src.utils.large_files import (
+    STREAMING_UPLOADS,
+    X_ACCEL_REDIRECT_ENABLED,
+    X_ACCEL_REDIRECT_PREFIX,
+    SSE_HEARTBEAT_INTERVAL,
+    SSE_CHANGE_CHECK_INTERVAL,
+    SSE_MAX_STREAM_DURATION,
+    SSE_MAX_JOBS_PER_STREAM,
+    RATE_LIMIT_WINDOW,
+    CONVERSION_RATE_LIMIT,
+    STATUS_RATE_LIMIT,
+    ENCODING_MODES,
+    DEFAULT_ENCODING_MODE
+)
+from src.utils.security import rate_limit, upload_cost
+from src.routes.upload import chunked_upload_manager
 
 conversion_bp = Blueprint('conversion', __name__)
 
 # Initialize large file handler
 upload_dir = os.path.join(os.path.dirname(__file__), '..', 'uploads')
 large_file_handler = LargeFileHandler(upload_dir)
+output_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'outputs'))
+
+# Supported conversions: source format -> target formats
+CONVERSION_MAP = {
+    'youtube': ['wav', 'mp3', 'aiff', 'mp4', 'flac'],
+    'mp3': ['flac', 'wav'],
+    'wav': ['mp3', 'flac', 'ogg', 'aiff'],
+    'flac': ['mp3', 'wav', 'ogg', 'aiff'],
+    'rar': ['iso', 'zip'],
+    'iso': ['rar', 'zip'],
+    'zip': ['rar', 'iso'],
+    'png': ['jpg'],
+    'jpg': ['png'],
+    'mp4': ['mov'],
+    'mov': ['mp4']
+}
+
+def _parse_convert_form():
+    """
+    Get the form fields and, in streaming mode, the already-saved upload.
+    Streaming mode parses the multipart body straight from request.stream so
+    the file is written once, instead of being spooled by Werkzeug and copied.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if STREAMING_UPLOADS and request.mimetype == 'multipart/form-data' and boundary:
+        return large_file_handler.save_streamed_upload(request.stream, boundary)
+    return request.form, None
 
 @conversion_bp.route('/convert', methods=['POST'])
+@rate_limit(limit=CONVERSION_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='conversion',
+            cost=lambda req: upload_cost(req.content_length))
+@require_disk_space(size=lambda req: req.content_length)
 def convert_file():
     """Start a file conversion job"""
+    streamed_upload = None
     try:
-        # Get conversion parameters
-        from_format = request.form.get('from')
-        to_format = request.form.get('to')
-        source = request.form.get('source')  # 'upload' or 'youtube'
-        
-        if not from_format or not to_format or not source:
-            return jsonify({'error': 'Missing required parameters'}), 400
-        
-        # Validate conversion
-        conversion_map = {
-            'youtube': ['wav', 'mp3', 'aiff', 'mp4', 'flac'],
-            'mp3': ['flac', 'wav'],
-            'wav': ['mp3', 'flac', 'ogg', 'aiff'],
-            'flac': ['mp3', 'wav', 'ogg', 'aiff'],
-            'rar': ['iso', 'zip'],
-            'iso': ['rar', 'zip'],
-            'png': ['jpg'],
-            'jpg': ['png'],
-            'mp4': ['mov'],
-            'mov': ['mp4']
-        }
-        
-        if not validate_conversion(from_format, to_format, conversion_map):
-            return jsonify({'error': 'Unsupported conversion'}), 400
-        
-        # Create job
-        job = Job(from_format=from_format, to_format=to_format)
-        
-        if source == 'youtube':
-            url = request.form.get('url')
-            if not url:
-                return jsonify({'error': 'YouTube URL required'}), 400
-            job.source_url = url
-        elif source == 'upload':
-            if 'file' not in request.files:
-                return jsonify({'error': 'File required'}), 400
-            
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'error': 'No file selected'}), 400
-            
-            # Sanitize filename
-            safe_filename = sanitize_filename(file.filename)
-            
-            # Save file
-            file_path = large_file_handler.save_large_file(file, safe_filename)
-            job.source_file_path = file_path
-        
-        # Save job to database
-        db.session.add(job)
-        db.session.commit()
-        
-        # Queue conversion job
-        from flask import current_app
-        conversion_service = ConversionService(current_app._get_current_object())
-        conversion_service.queue_conversion(job.job_id)
+        form, streamed_upload = _parse_convert_form()
+        response = _create_conversion_job(form, streamed_upload)
         
-        return jsonify({
-            'job_id': job.job_id,
-            'status': job.status
-        }), 202
+        # Only keep a streamed file if a job was created for it
+        if streamed_upload and response[1] != 202:
+            large_file_handler.cleanup_file(streamed_upload['path'])
+        return response
         
+    except ValueError as e:
+        if streamed_upload:
+            large_file_handler.cleanup_file(streamed_upload['path'])
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        if streamed_upload:
+            large_file_handler.cleanup_file(streamed_upload['path'])
         return jsonify({'error': str(e)}), 500
 
+def _create_conversion_job(form, streamed_upload):
+    """Validate the conversion request and queue a job for it"""
+    # Get conversion parameters
+    from_format = form.get('from')
+    to_format = form.get('to')
+    source = form.get('source')  # 'upload', 'chunked' or 'youtube'
+    
+    if not from_format or not to_format or not source:
+        return jsonify({'error': 'Missing required parameters'}), 400
+    
+    # Validate conversion
+    if not validate_conversion(from_format, to_format, CONVERSION_MAP):
+        return jsonify({'error': 'Unsupported conversion'}), 400
+    
+    # Media jobs can trade quality for speed
+    mode = form.get('mode') or DEFAULT_ENCODING_MODE
+    if mode not in ENCODING_MODES:
+        return jsonify({'error': f"mode must be one of {', '.join(ENCODING_MODES)}"}), 400
+    
+    # Create job
+    job = Job(from_format=from_format, to_format=to_format, encoding_mode=mode)
+    
+    if source == 'youtube':
+        url = form.get('url')
+        if not url:
+            return jsonify({'error': 'YouTube URL required'}), 400
+        job.source_url = url
+    elif source == 'upload' and streamed_upload:
+        job.source_file_path = streamed_upload['path']
+    elif source == 'upload':
+        if 'file' not in request.files:
+            return jsonify({'error': 'File required'}), 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        # Sanitize filename
+        safe_filename = sanitize_filename(file.filename)
+        
+        # Save file
+        file_path = large_file_handler.save_large_file(file, safe_filename)
+        job.source_file_path = file_path
+    elif source == 'chunked':
+        upload_id = form.get('upload_id')
+        if not upload_id:
+            return jsonify({'error': 'upload_id required'}), 400
+        
+        try:
+            job.source_file_path = chunked_upload_manager.complete_upload(upload_id)
+        except KeyError:
+            return jsonify({'error': 'Upload not found'}), 404
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+    else:
+        return jsonify({'error': 'Unsupported source'}), 400
+    
+    # Save job to database
+    db.session.add(job)
+    db.session.commit()
+    
+    if source == 'chunked':
+        chunked_upload_manager.release_upload(upload_id)
+    
+    # Hand the job to the conversion worker pool
+    conversion_pool.submit(job.job_id)
+    
+    return jsonify({
+        'job_id': job.job_id,
+        'status': job.status
+    }), 202
+
 @conversion_bp.route('/status/<job_id>', methods=['GET'])
+@rate_limit(limit=STATUS_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='status')
 def get_job_status(job_id):
     """Get the status of a conversion job"""
     try:
-        job = Job.query.get(job_id)
-        if not job:
+        status = Job.get_status(job_id)
+        if not status:
             return jsonify({'error': 'Job not found'}), 404
         
-        return jsonify({
-            'job_id': job.job_id,
-            'status': job.status,
-            'progress': job.progress,
-            'error_message': job.error_message
-        })
+        return jsonify(status)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@conversion_bp.route('/events/<job_id>', methods=['GET'])
+@rate_limit(limit=STATUS_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='status')
+def job_events(job_id):
+    """Stream status changes of one job as Server-Sent Events"""
+    return _job_event_stream([job_id])
+
+@conversion_bp.route('/events', methods=['GET'])
+@rate_limit(limit=STATUS_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='status')
+def job_group_events():
+    """Stream status changes of several jobs (?jobs=id1,id2,...) as Server-Sent Events"""
+    job_ids = [job_id for job_id in request.args.get('jobs', '').split(',') if job_id]
+    if not job_ids:
+        return jsonify({'error': 'jobs parameter required'}), 400
+    if len(job_ids) > SSE_MAX_JOBS_PER_STREAM:
+        return jsonify({'error': f'At most {SSE_MAX_JOBS_PER_STREAM} jobs per stream'}), 400
+    return _job_event_stream(job_ids)
+
+def _load_job_statuses(job_ids, fresh=False):
+    """
+    Read the current status of jobs from the status cache, then the database
+    fresh=True only trusts the cache for finished jobs
+    """
+    statuses = {}
+    for job_id in job_ids:
+        status = job_status_cache.get(job_id)
+        if status is not None and (not fresh or status['status'] in FINISHED_STATUSES):
+            statuses[job_id] = status
+    
+    missing = [job_id for job_id in job_ids if job_id not in statuses]
+    if missing:
+        for job in Job.query.filter(Job.job_id.in_(missing)).all():
+            statuses[job.job_id] = job.status_dict()
+            job_status_cache.put(job.job_id, statuses[job.job_id])
+        # Don't hold a pooled connection for the lifetime of the stream
+        db.session.remove()
+    return statuses
+
+def _job_event_stream(job_ids):
+    """
+    Push a 'status' event whenever a job changes. Changes made in this process
+    arrive through the job event bus right away. Every SSE_CHANGE_CHECK_INTERVAL
+    seconds the shared job versions are checked, and only jobs changed by other
+    processes are re-read from the database. The stream ends when every job has
+    finished, and is closed after SSE_MAX_STREAM_DURATION seconds so the
+    browser reconnects.
+    """
+    # Read the versions first so a change committed while loading is seen on the next check
+    versions = shared_job_versions.read(job_ids)
+    statuses = _load_job_statuses(job_ids, fresh=True)
+    missing = [job_id for job_id in job_ids if job_id not in statuses]
+    if missing:
+        return jsonify({'error': 'Job not found', 'job_ids': missing}), 404
+    
+    def generate():
+        sent = {}
+        current = statuses
+        version = job_event_bus.version
+        seen = versions
+        started = last_check = last_heartbeat = time.monotonic()
+        
+        yield 'retry: 3000\n\n'
+        
+        while True:
+            for job_id in job_ids:
+                if current.get(job_id) and current[job_id] != sent.get(job_id):
+                    sent[job_id] = current[job_id]
+                    yield f"event: status\ndata: {json.dumps(current[job_id])}\n\n"
+                    last_heartbeat = time.monotonic()
+            
+            if all(sent[job_id]['status'] in ('completed', 'failed') for job_id in job_ids):
+                yield 'event: done\ndata: {}\n\n'
+                return
+            
+            now = time.monotonic()
+            if now - started >= SSE_MAX_STREAM_DURATION:
+                return
+            if now - last_heartbeat >= SSE_HEARTBEAT_INTERVAL:
+                yield ': heartbeat\n\n'
+                last_heartbeat = now
+            
+            timeout = min(SSE_HEARTBEAT_INTERVAL - (now - last_heartbeat),
+                          SSE_CHANGE_CHECK_INTERVAL - (now - last_check))
+            new_version = job_event_bus.wait(job_ids, version, max(timeout, 0))
+            
+            current = dict(current)
+            for job_id in job_ids:
+                latest = job_event_bus.get_latest(job_id)
+                if latest and latest[0] > version:
+                    current[job_id] = latest[1]
+            version = new_version
+            
+            if time.monotonic() - last_check >= SSE_CHANGE_CHECK_INTERVAL:
+                latest_versions = shared_job_versions.read(job_ids)
+                changed = [job_id for job_id in job_ids
+                           if latest_versions[job_id] != seen[job_id]
+                           and shared_job_versions.changed_elsewhere(job_id, latest_versions[job_id])]
+                seen = latest_versions
+                if changed:
+                    current.update(_load_job_statuses(changed, fresh=True))
+                last_check = time.monotonic()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @conversion_bp.route('/download/<job_id>', methods=['GET'])
+@rate_limit(limit=STATUS_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='status')
 def download_file(job_id):
     """Download the converted file"""
     try:
@@ -112,11 +292,36 @@ def download_file(job_id):
         if not job.converted_file_path or not os.path.exists(job.converted_file_path):
             return jsonify({'error': 'Converted file not found'}), 404
         
+        download_name = f'converted.{job.to_format}'
+        disk_manager.touch(job.converted_file_path)
+        
+        # Let nginx serve the bytes so the worker is released immediately
+        if X_ACCEL_REDIRECT_ENABLED:
+            return _accel_redirect_response(job.converted_file_path, download_name)
+        
+        # conditional=True answers Range and If-None-Match/If-Modified-Since requests,
+        # so interrupted downloads can resume and revalidations get a 304
         return send_file(
             job.converted_file_path,
             as_attachment=True,
-            download_name=f'converted.{job.to_format}'
+            download_name=download_name,
+            conditional=True,
+            etag=True
         )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def _accel_redirect_response(file_path, download_name):
+    """Build an empty response telling nginx to serve the file from its internal location"""
+    real_path = os.path.realpath(file_path)
+    if os.path.commonpath([real_path, output_dir]) != output_dir:
+        raise ValueError('Converted file is outside the outputs directory')
+    
+    relative_path = os.path.relpath(real_path, output_dir)
+    response = make_response('')
+    response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + relative_path
+    response.headers['Content-Type'] = 'application/octet-stream'
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
@@ -1,12 +1,37 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request, Response
 import os
 # import psutil  # Removed for deployment compatibility
 from datetime import datetime
 from src.utils.logging import health_monitor
+from sqlalchemy import func, case
 from src.models.job import Job, db
+from src.models.database import progress_batcher
+from src.services.worker_pool import conversion_pool
+from src.services.result_cache import result_cache
+from src.services.youtube_cache import youtube_cache
+from src.services.disk_manager import disk_manager
+from src.utils.status_cache import job_status_cache
+from src.utils.log_writer import log_writer
+from src.utils.metrics import metrics
+from src.utils.security import rate_limiter
+from src.utils.log_reader import tail_log, parse_log_time, LOG_LEVELS
+from src.utils.large_files import LOG_QUERY_MAX_LINES
 
 health_bp = Blueprint('health', __name__)
 
+# Log files served by /logs: file name and, for the JSON event logs, the level they are written at
+LOG_FILES = {
+    'app': ('app.log', None),
+    'conversions': ('conversions.log', 'INFO'),
+    'errors': ('errors.log', 'ERROR'),
+    'security': ('security.log', 'WARNING')
+}
+
+def _job_status_counts():
+    """Count jobs per status with a single GROUP BY (served by the status index)"""
+    rows = db.session.query(Job.status, func.count()).group_by(Job.status).all()
+    return dict(rows)
+
 @health_bp.route('/health', methods=['GET'])
 def health_check():
     """Basic health check endpoint"""
@@ -33,12 +58,13 @@ def health_check():
 def get_metrics():
     """Get application metrics"""
     try:
-        # Get job statistics
-        total_jobs = Job.query.count()
-        completed_jobs = Job.query.filter_by(status='completed').count()
-        failed_jobs = Job.query.filter_by(status='failed').count()
-        processing_jobs = Job.query.filter_by(status='processing').count()
-        queued_jobs = Job.query.filter_by(status='queued').count()
+        # Get job statistics (one grouped count instead of a query per status)
+        status_counts = _job_status_counts()
+        total_jobs = sum(status_counts.values())
+        completed_jobs = status_counts.get('completed', 0)
+        failed_jobs = status_counts.get('failed', 0)
+        processing_jobs = status_counts.get('processing', 0)
+        queued_jobs = status_counts.get('queued', 0)
         
         # Get health monitor stats
         health_stats = health_monitor.get_health_status()
@@ -53,7 +79,16 @@ def get_metrics():
                 'queued': queued_jobs,
                 'success_rate_percent': round((completed_jobs / total_jobs * 100) if total_jobs > 0 else 0, 2)
             },
-            'application': health_stats
+            'application': health_stats,
+            'latency_seconds': health_monitor.get_latency_percentiles(),
+            'workers': conversion_pool.get_stats(),
+            'result_cache': result_cache.get_stats(),
+            'youtube_cache': youtube_cache.get_stats(),
+            'disk': disk_manager.get_stats(),
+            'status_cache': job_status_cache.get_stats(),
+            'progress_batcher': progress_batcher.get_stats(),
+            'log_writer': log_writer.get_stats(),
+            'rate_limiter': rate_limiter.get_stats()
         }
         
         return jsonify(metrics)
@@ -61,6 +96,14 @@ def get_metrics():
     except Exception as e:
         return jsonify({'error': f'Failed to get metrics: {str(e)}'}), 500
 
+@health_bp.route('/metrics/prometheus', methods=['GET'])
+def get_prometheus_metrics():
+    """Request/conversion counters and latency histograms of all workers in Prometheus text format"""
+    try:
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return Response(f'# Failed to collect metrics: {str(e)}\n', status=500, mimetype='text/plain')
+
 @health_bp.route('/status', methods=['GET'])
 def get_status():
     """Get detailed application status"""
@@ -69,22 +112,26 @@ def get_status():
         from datetime import timedelta
         yesterday = datetime.utcnow() - timedelta(days=1)
         
-        recent_jobs = Job.query.filter(Job.created_at >= yesterday).all()
-        recent_completed = len([j for j in recent_jobs if j.status == 'completed'])
-        recent_failed = len([j for j in recent_jobs if j.status == 'failed'])
+        # Aggregate per conversion type in the database instead of loading every job
+        rows = db.session.query(
+            Job.from_format,
+            Job.to_format,
+            func.count(),
+            func.sum(case((Job.status == 'completed', 1), else_=0)),
+            func.sum(case((Job.status == 'failed', 1), else_=0))
+        ).filter(Job.created_at >= yesterday).group_by(Job.from_format, Job.to_format).all()
         
-        # Format conversion statistics
         format_stats = {}
-        for job in recent_jobs:
-            conversion = f"{job.from_format} -> {job.to_format}"
-            if conversion not in format_stats:
-                format_stats[conversion] = {'total': 0, 'completed': 0, 'failed': 0}
-            
-            format_stats[conversion]['total'] += 1
-            if job.status == 'completed':
-                format_stats[conversion]['completed'] += 1
-            elif job.status == 'failed':
-                format_stats[conversion]['failed'] += 1
+        for from_format, to_format, total, completed, failed in rows:
+            format_stats[f"{from_format} -> {to_format}"] = {
+                'total': total,
+                'completed': completed or 0,
+                'failed': failed or 0
+            }
+        recent_total = sum(stats['total'] for stats in format_stats.values())
+        recent_completed = sum(stats['completed'] for stats in format_stats.values())
+        recent_failed = sum(stats['failed'] for stats in format_stats.values())
+        status_counts = _job_status_counts()
         
         status = {
             'timestamp': datetime.utcnow().isoformat(),
@@ -92,14 +139,14 @@ def get_status():
             'version': '1.0.0',
             'uptime_seconds': health_monitor.get_health_status()['uptime_seconds'],
             'recent_activity': {
-                'last_24h_jobs': len(recent_jobs),
+                'last_24h_jobs': recent_total,
                 'last_24h_completed': recent_completed,
                 'last_24h_failed': recent_failed,
-                'success_rate_percent': round((recent_completed / len(recent_jobs) * 100) if recent_jobs else 0, 2)
+                'success_rate_percent': round((recent_completed / recent_total * 100) if recent_total else 0, 2)
             },
             'popular_conversions': format_stats,
-            'current_queue_size': Job.query.filter_by(status='queued').count(),
-            'active_conversions': Job.query.filter_by(status='processing').count()
+            'current_queue_size': status_counts.get('queued', 0),
+            'active_conversions': status_counts.get('processing', 0)
         }
         
         return jsonify(status)
@@ -109,23 +156,63 @@ def get_status():
 
 @health_bp.route('/logs', methods=['GET'])
 def get_recent_logs():
-    """Get recent log entries (for debugging)"""
+    """
+    Get recent log entries (for debugging)
+    
+    Query parameters: file (app, conversions, errors, security), lines, before
+    (cursor from a previous response), level (minimum level), q (substring),
+    since/until (ISO timestamps) and event (JSON logs only)
+    """
     try:
-        log_file = os.path.join(os.path.dirname(__file__), '..', 'logs', 'app.log')
+        log_name = request.args.get('file', 'app')
+        if log_name not in LOG_FILES:
+            return jsonify({'error': f"Unknown log file, expected one of: {', '.join(LOG_FILES)}"}), 400
+        filename, file_level = LOG_FILES[log_name]
+        log_file = os.path.join(os.path.dirname(__file__), '..', 'logs', filename)
+        
+        lines = request.args.get('lines', 50, type=int)
+        if lines < 1 or lines > LOG_QUERY_MAX_LINES:
+            return jsonify({'error': f'lines must be between 1 and {LOG_QUERY_MAX_LINES}'}), 400
+        
+        level = request.args.get('level', '').upper() or None
+        if level and level not in LOG_LEVELS:
+            return jsonify({'error': f"level must be one of: {', '.join(LOG_LEVELS)}"}), 400
+        
+        since = request.args.get('since')
+        until = request.args.get('until')
+        try:
+            since = parse_log_time(since) if since else None
+            until = parse_log_time(until) if until else None
+        except ValueError:
+            return jsonify({'error': 'since and until must be ISO 8601 timestamps'}), 400
         
         if not os.path.exists(log_file):
             return jsonify({'logs': [], 'message': 'No log file found'})
         
-        # Read last 50 lines
-        with open(log_file, 'r') as f:
-            lines = f.readlines()
-            recent_lines = lines[-50:] if len(lines) > 50 else lines
+        # JSON event logs have a fixed level per file
+        if level and file_level and LOG_LEVELS[file_level] < LOG_LEVELS[level]:
+            result = {'lines': [], 'next_before': None}
+        else:
+            result = tail_log(
+                log_file,
+                lines=lines,
+                before=request.args.get('before'),
+                level=None if file_level else level,
+                contains=request.args.get('q'),
+                since=since,
+                until=until,
+                json_lines=file_level is not None,
+                event=request.args.get('event')
+            )
         
         return jsonify({
-            'logs': [line.strip() for line in recent_lines],
-            'total_lines': len(recent_lines),
+            'logs': result['lines'],
+            'total_lines': len(result['lines']),
+            'next_before': result['next_before'],
             'timestamp': datetime.utcnow().isoformat()
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to get logs: {str(e)}'}), 500
@@ -0,0 +1,123 @@
+from flask import Blueprint, request, jsonify
+import os
+from src.utils.validators import sanitize_filename
+from src.utils.large_file_handler import ChunkedUploadManager
+from src.utils.large_files import CHUNK_SIZE, RATE_LIMIT_WINDOW, CONVERSION_RATE_LIMIT
+from src.utils.security import rate_limit, upload_cost
+from src.services.disk_manager import require_disk_space
+
+upload_bp = Blueprint('upload', __name__)
+
+# Initialize chunked upload manager (shares the upload directory with regular uploads)
+upload_dir = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+chunked_upload_manager = ChunkedUploadManager(upload_dir)
+
+def _upload_status(upload_id, manifest, missing):
+    return {
+        'upload_id': upload_id,
+        'total_chunks': manifest['total_chunks'],
+        'chunk_size': manifest['chunk_size'],
+        'received_chunks': manifest['total_chunks'] - len(missing),
+        'missing_chunks': missing,
+        'complete': not missing
+    }
+
+def _declared_upload_size(req):
+    size = (req.get_json(silent=True) or {}).get('size')
+    return size if isinstance(size, int) else None
+
+def _declared_upload_cost(req):
+    # Chunked uploads are charged once, by their declared size, when they start
+    return upload_cost(_declared_upload_size(req))
+
+@upload_bp.route('/uploads', methods=['POST'])
+@rate_limit(limit=CONVERSION_RATE_LIMIT, window=RATE_LIMIT_WINDOW, scope='conversion', cost=_declared_upload_cost)
+@require_disk_space(size=_declared_upload_size)
+def init_upload():
+    """Start a resumable chunked upload"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename')
+        total_size = data.get('size')
+        chunk_size = data.get('chunk_size', CHUNK_SIZE)
+
+        if not filename or not isinstance(total_size, int) or not isinstance(chunk_size, int):
+            return jsonify({'error': 'filename, size and chunk_size must be provided'}), 400
+
+        manifest = chunked_upload_manager.init_upload(sanitize_filename(filename), total_size, chunk_size)
+
+        return jsonify({
+            'upload_id': manifest['upload_id'],
+            'chunk_size': manifest['chunk_size'],
+            'total_chunks': manifest['total_chunks']
+        }), 201
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    """Report which chunks of an upload are still missing, so clients can resume"""
+    try:
+        manifest = chunked_upload_manager.get_manifest(upload_id)
+        missing = chunked_upload_manager.missing_chunks(upload_id)
+        return jsonify(_upload_status(upload_id, manifest, missing))
+
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/uploads/<upload_id>/chunks/<int:chunk_number>', methods=['PUT'])
+def upload_chunk(upload_id, chunk_number):
+    """Receive one chunk; chunks may arrive in any order and in parallel"""
+    try:
+        manifest = chunked_upload_manager.get_manifest(upload_id)
+        missing = chunked_upload_manager.write_chunk(
+            upload_id,
+            chunk_number,
+            request.stream,
+            checksum=request.headers.get('X-Chunk-SHA256')
+        )
+        return jsonify(_upload_status(upload_id, manifest, missing))
+
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Finish an upload; start the conversion with /convert using source=chunked and this upload_id"""
+    try:
+        manifest = chunked_upload_manager.get_manifest(upload_id)
+        missing = chunked_upload_manager.missing_chunks(upload_id)
+        if missing and not manifest.get('completed_path'):
+            status = _upload_status(upload_id, manifest, missing)
+            status['error'] = 'Upload is missing chunks'
+            return jsonify(status), 409
+
+        chunked_upload_manager.complete_upload(upload_id)
+        return jsonify(_upload_status(upload_id, manifest, []))
+
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """Abandon an upload and free its disk space"""
+    try:
+        chunked_upload_manager.get_manifest(upload_id)
+        chunked_upload_manager.abort_upload(upload_id)
+        return jsonify({'message': 'Upload aborted'})
+
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -14,6 +14,7 @@ def get_formats():
         'flac': ['mp3', 'wav', 'ogg', 'aiff'],
         'rar': ['iso', 'zip'],
         'iso': ['rar', 'zip'],
+        'zip': ['rar', 'iso'],
         'png': ['jpg'],
         'jpg': ['png'],
         'mp4': ['mov'],
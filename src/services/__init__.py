@@ -1,3 +1,4 @@
 from .conversion_service import ConversionService
+from .worker_pool import ConversionWorkerPool, conversion_pool
 
-__all__ = ['ConversionService']
+__all__ = ['ConversionService', 'ConversionWorkerPool', 'conversion_pool']
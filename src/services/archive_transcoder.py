@@ -0,0 +1,309 @@
+import os
+import shutil
+import logging
+import subprocess
+import tempfile
+import time
+import zipfile
+from src.utils.iso9660 import IsoReader, IsoWriter
+from src.utils.parallel_zip import ParallelZipWriter
+from src.utils.process_limits import LimitedProcess, run_limited
+from src.utils.large_files import CHUNK_SIZE, ARCHIVE_RAR_STAGING_LIMIT
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = ['rar', 'zip', 'iso']
+
+class ArchiveEntry:
+    """One member of a source archive; read() yields its data and may only be iterated once"""
+    def __init__(self, name, is_dir, size, mtime, read=None):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.read = read
+
+def transcode_archive(source_file, output_file, from_format, to_format, progress_callback=None):
+    """
+    Copy every member of one archive into a new archive of another format,
+    entry by entry: each member's data is streamed from the reader into the
+    writer, so nothing is extracted to disk first.
+    """
+    if from_format not in ARCHIVE_FORMATS or to_format not in ARCHIVE_FORMATS:
+        raise Exception(f"Unsupported archive conversion: {from_format} to {to_format}")
+
+    started = time.monotonic()
+    reader = _READERS[from_format](source_file)
+    try:
+        entries = reader.entries()
+        total_bytes = sum(entry.size for entry in entries if not entry.is_dir)
+        copied = 0
+
+        writer = _WRITERS[to_format](output_file)
+        try:
+            for entry in entries:
+                name = _clean_name(entry.name)
+                if not name:
+                    # Still read it: rar members come from one stream in order
+                    for data in ([] if entry.is_dir else entry.read()):
+                        pass
+                    continue
+                if entry.is_dir:
+                    writer.add_directory(name, entry.mtime)
+                    continue
+                chunks = _count_progress(entry.read(), copied, total_bytes, progress_callback)
+                writer.add_file(name, entry.size, entry.mtime, chunks)
+                copied += entry.size
+            reader.finish()
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
+    finally:
+        reader.close()
+
+    if progress_callback:
+        progress_callback(100)
+    logger.info(f"Transcoded {from_format} to {to_format}: {len(entries)} entries, "
+                f"{total_bytes} bytes in {time.monotonic() - started:.1f}s")
+    return output_file
+
+def _count_progress(chunks, copied, total_bytes, progress_callback):
+    for data in chunks:
+        copied += len(data)
+        if progress_callback and total_bytes:
+            progress_callback(copied / total_bytes * 100)
+        yield data
+
+def _clean_name(name):
+    """Archive-relative path with no absolute, '.' or '..' components"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part and part not in ('.', '..')]
+    return '/'.join(parts)
+
+class _ArchiveReader:
+    def finish(self):
+        """Check the source was read completely and cleanly"""
+
+    def close(self):
+        pass
+
+class _ZipReader(_ArchiveReader):
+    def __init__(self, path):
+        self._archive = zipfile.ZipFile(path)
+
+    def entries(self):
+        entries = []
+        for info in self._archive.infolist():
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            read = lambda info=info: self._read(info)
+            entries.append(ArchiveEntry(info.filename, info.is_dir(), info.file_size, mtime, read))
+        return entries
+
+    def _read(self, info):
+        with self._archive.open(info) as member:
+            while True:
+                data = member.read(CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+
+    def close(self):
+        self._archive.close()
+
+class _RarReader(_ArchiveReader):
+    """
+    Lists the archive with 'unrar lt', then streams all members in archive
+    order from a single 'unrar p' and splits its output by member size.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._process = None
+
+    def entries(self):
+        result = run_limited(['unrar', 'lt', '-p-', '--', self.path])
+        if result.returncode != 0:
+            raise Exception(f"RAR listing failed: {result.stderr.strip() or result.stdout.strip()}")
+
+        entries = []
+        for block in _listing_blocks(result.stdout):
+            entry_type = block.get('Type')
+            if entry_type not in ('File', 'Directory'):
+                raise Exception(f"Unsupported RAR entry {block.get('Name')!r} ({entry_type})")
+            is_dir = entry_type == 'Directory'
+            size = 0 if is_dir else int(block.get('Size', 0))
+            entries.append(ArchiveEntry(block['Name'], is_dir, size, _listing_mtime(block.get('mtime')),
+                                        None if is_dir else lambda size=size, name=block['Name']: self._read(name, size)))
+        return entries
+
+    def _read(self, name, size):
+        if self._process is None:
+            # Files come out of 'unrar p' in archive order, so one pass serves every entry
+            self._process = LimitedProcess(['unrar', 'p', '-inul', '-p-', '--', self.path],
+                                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        remaining = size
+        while remaining > 0:
+            data = self._process.stdout.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                self._process.wait()
+                self._process.check()
+                raise Exception(f"RAR extraction ended early in {name}")
+            remaining -= len(data)
+            yield data
+
+    def finish(self):
+        if self._process is None:
+            return
+        leftover = self._process.stdout.read(1)
+        returncode = self._process.wait() if not leftover else None
+        if not leftover:
+            self._process.check()
+        if leftover or returncode != 0:
+            raise Exception(f"RAR extraction failed (exit code {returncode})")
+
+    def close(self):
+        if self._process is None:
+            return
+        self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+        self._process = None
+
+def _listing_blocks(listing):
+    """Parse 'unrar lt' output into one dict per entry"""
+    block = None
+    for line in listing.splitlines():
+        key, separator, value = line.strip().partition(': ')
+        if not separator:
+            continue
+        if key == 'Name':
+            if block:
+                yield block
+            block = {}
+        if block is not None:
+            block[key] = value
+    if block:
+        yield block
+
+def _listing_mtime(value):
+    try:
+        return time.mktime(time.strptime(value[:19], '%Y-%m-%d %H:%M:%S'))
+    except (TypeError, ValueError):
+        return None
+
+class _IsoReader(_ArchiveReader):
+    def __init__(self, path):
+        self._image = IsoReader(path)
+
+    def entries(self):
+        return [ArchiveEntry(entry.path, entry.is_dir, entry.size, entry.mtime,
+                             lambda entry=entry: self._image.read_chunks(entry, CHUNK_SIZE))
+                for entry in self._image.entries()]
+
+    def close(self):
+        self._image.close()
+
+class _RarWriter:
+    """
+    Adds members with the 'rar' command, which only reads files from disk or
+    a single file from stdin. Members over ARCHIVE_RAR_STAGING_LIMIT are piped
+    in one at a time; smaller ones are staged next to the output and added
+    together once the staging limit is reached, so the archive isn't rewritten
+    for every small file and staging never holds more than the limit.
+    """
+    def __init__(self, path, staging_limit=ARCHIVE_RAR_STAGING_LIMIT):
+        self.path = os.path.abspath(path)
+        self.staging_limit = staging_limit
+        self._staging = tempfile.mkdtemp(prefix='rar-staging-', dir=os.path.dirname(self.path))
+        self._staged_bytes = 0
+        self._staged_entries = 0
+
+    def add_directory(self, name, mtime):
+        os.makedirs(os.path.join(self._staging, name), exist_ok=True)
+        self._staged_entries += 1
+
+    def add_file(self, name, size, mtime, chunks):
+        if size > self.staging_limit:
+            self._pipe_member(name, chunks)
+            return
+
+        if self._staged_bytes + size > self.staging_limit:
+            self._flush()
+        staged_path = os.path.join(self._staging, name)
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        with open(staged_path, 'wb') as f:
+            for data in chunks:
+                f.write(data)
+        if mtime:
+            os.utime(staged_path, (mtime, mtime))
+        self._staged_bytes += size
+        self._staged_entries += 1
+
+    def close(self):
+        try:
+            self._flush()
+        finally:
+            shutil.rmtree(self._staging, ignore_errors=True)
+        if not os.path.exists(self.path):
+            raise Exception("RAR creation failed: the archive is empty")
+
+    def abort(self):
+        shutil.rmtree(self._staging, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _pipe_member(self, name, chunks):
+        process = LimitedProcess(['rar', 'a', '-idq', '-y', f'-si{name}', '--', self.path],
+                                 stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for data in chunks:
+                process.stdin.write(data)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+        stderr = process.stderr.read().decode(errors='replace')
+        returncode = process.wait()
+        process.check(stderr)
+        if returncode != 0:
+            raise Exception(f"RAR creation failed: {stderr.strip()}")
+
+    def _flush(self):
+        if not self._staged_entries:
+            return
+        result = run_limited(['rar', 'a', '-idq', '-y', '-r', '--', self.path, '*'], cwd=self._staging)
+        if result.returncode != 0:
+            raise Exception(f"RAR creation failed: {result.stderr.strip()}")
+        for name in os.listdir(self._staging):
+            path = os.path.join(self._staging, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        self._staged_bytes = 0
+        self._staged_entries = 0
+
+class _IsoWriter:
+    def __init__(self, path):
+        self.path = path
+        self._image = IsoWriter(path)
+
+    def add_directory(self, name, mtime):
+        self._image.add_directory(name, mtime)
+
+    def add_file(self, name, size, mtime, chunks):
+        self._image.add_file(name, chunks, mtime)
+
+    def close(self):
+        self._image.close()
+
+    def abort(self):
+        try:
+            self._image.close()
+        finally:
+            os.remove(self.path)
+
+_READERS = {'zip': _ZipReader, 'rar': _RarReader, 'iso': _IsoReader}
+_WRITERS = {'zip': ParallelZipWriter, 'rar': _RarWriter, 'iso': _IsoWriter}
@@ -1,9 +1,32 @@
 import os
-import subprocess
-import threading
+import json
 import time
+import tempfile
+import subprocess
 from src.models.job import Job, db
-from src.utils.validators import validate_youtube_url
+from src.services.result_cache import result_cache
+from src.services.youtube_cache import youtube_cache
+from src.services.image_pool import image_pool, encoder_settings, IMAGE_FORMATS
+from src.services.archive_transcoder import transcode_archive, ARCHIVE_FORMATS
+from src.services.segmented_video import SegmentedVideoEncoder
+from src.services.media_planner import plan_remux, plan_profile, record_media_path
+from src.utils.validators import validate_youtube_url, extract_youtube_video_id
+from src.utils.logging import health_monitor
+from src.utils.large_file_handler import LargeFileHandler, link_or_copy
+from src.utils.ffmpeg import run_ffmpeg, probe_duration
+from src.utils.process_limits import LimitedProcess, run_limited
+from src.utils.large_files import (
+    PROGRESS_UPDATE_INTERVAL,
+    CHUNK_SIZE,
+    ENABLE_RESULT_CACHE,
+    YOUTUBE_DOWNLOAD_TIMEOUT,
+    YOUTUBE_INFO_TIMEOUT,
+    ZIP_COMPRESSION_LEVEL,
+    DEFAULT_ENCODING_MODE
+)
+
+# YouTube targets that only need the audio stream
+YOUTUBE_AUDIO_FORMATS = ['mp3', 'wav', 'flac', 'aiff']
 
 class ConversionService:
     def __init__(self, app):
@@ -12,122 +35,273 @@ class ConversionService:
         self.app = app
         self.output_dir = os.path.join(os.path.dirname(__file__), '..', 'outputs')
         os.makedirs(self.output_dir, exist_ok=True)
+        self.file_handler = LargeFileHandler(self.output_dir, chunk_size=CHUNK_SIZE)
+        self.segmented_encoder = SegmentedVideoEncoder(os.path.join(self.output_dir, 'segments'))
     
     def queue_conversion(self, job_id):
         """Queue a conversion job for background processing"""
-        # For now, we'll use threading. In production, use Celery or similar
-        thread = threading.Thread(target=self._process_conversion, args=(job_id,))
-        thread.daemon = True
-        thread.start()
+        # The job is already stored as 'queued' - the worker pool claims it from the jobs table
+        from src.services.worker_pool import conversion_pool
+        conversion_pool.submit(job_id)
     
     def _process_conversion(self, job_id):
         """Process a conversion job"""
         # Run within Flask application context
         with self.app.app_context():
+            started = time.monotonic()
             try:
                 job = Job.query.get(job_id)
                 if not job:
                     return
                 
                 job.update_status('processing', 10)
-                
-                # Handle different source types
-                if job.from_format == 'youtube':
-                    source_file = self._download_youtube(job)
-                else:
-                    source_file = job.source_file_path
-                
-                if not source_file:
-                    job.update_status('failed', error_message='Failed to prepare source file')
-                    return
-                
-                job.update_status('processing', 30)
-                
-                # Perform conversion
-                output_file = self._convert_file(source_file, job.from_format, job.to_format, job_id)
+                details = {}
+                try:
+                    if job.from_format == 'youtube':
+                        # Downloaded and encoded in one pass, straight into the output
+                        output_file = self._convert_youtube(job, self._job_progress_reporter(job, start=10, end=95),
+                                                            details=details)
+                    else:
+                        output_file = self._convert_upload(job, details)
+                finally:
+                    # Record how the output was produced (remux, encode, ...) even if it failed
+                    job.conversion_path = details.get('path')
                 
                 if output_file:
                     job.converted_file_path = output_file
                     job.update_status('completed', 100)
                 else:
                     job.update_status('failed', error_message='Conversion failed')
+                health_monitor.record_conversion(job.from_format, job.to_format,
+                                                 time.monotonic() - started, success=bool(output_file))
                     
             except Exception as e:
                 job = Job.query.get(job_id)
                 if job:
                     job.update_status('failed', error_message=str(e))
+                    health_monitor.record_conversion(job.from_format, job.to_format,
+                                                     time.monotonic() - started, success=False)
+    
+    def _convert_upload(self, job, details):
+        """Convert an uploaded source file"""
+        source_file = job.source_file_path
+        if not source_file:
+            raise Exception('Failed to prepare source file')
+        
+        job.update_status('processing', 30)
+        
+        # Plan media encoder settings once: a retried job keeps them, so its finished video segments still fit
+        profile = None
+        if self._is_media_conversion(job.from_format, job.to_format):
+            profile = self._job_profile(job, lambda: self._plan_profile(source_file, job.encoding_mode
+                                                                        or DEFAULT_ENCODING_MODE))
+        
+        return self._convert_file(source_file, job.from_format, job.to_format, job.job_id,
+                                  progress_callback=self._job_progress_reporter(job, start=30, end=95),
+                                  details=details, profile=profile)
     
-    def _download_youtube(self, job):
-        """Download video/audio from YouTube"""
+    def _job_profile(self, job, plan):
+        """The job's stored encoding profile, or a new one from plan() saved on the job"""
+        if job.encoding_profile:
+            return json.loads(job.encoding_profile)
+        profile = plan()
+        job.encoding_profile = json.dumps(profile)
+        db.session.commit()
+        return profile
+    
+    def _job_progress_reporter(self, job, start, end):
+        """
+        Build a callback that maps a 0-100 conversion percentage onto the job's
+        start..end progress range, writing to the database at most once every
+        PROGRESS_UPDATE_INTERVAL seconds
+        """
+        state = {'last_write': 0.0, 'last_progress': start}
+        
+        def report(percent):
+            progress = start + int((end - start) * min(max(percent, 0), 100) / 100)
+            now = time.monotonic()
+            if progress <= state['last_progress'] or now - state['last_write'] < PROGRESS_UPDATE_INTERVAL:
+                return
+            state['last_write'] = now
+            state['last_progress'] = progress
+            job.update_status('processing', progress)
+        
+        return report
+    
+    def _convert_youtube(self, job, progress_callback=None, details=None):
+        """
+        Download a YouTube video and encode it to the job's format in one pass:
+        yt-dlp writes the media to a pipe FFmpeg reads from. Jobs asking for the
+        same video, format and encoding mode share one result; the profile is only
+        planned (which asks YouTube for the video's size) when it has to be made.
+        """
+        details = details if details is not None else {}
         try:
             if not validate_youtube_url(job.source_url):
                 raise ValueError('Invalid YouTube URL')
             
-            output_path = os.path.join(self.output_dir, f"{job.job_id}_youtube.%(ext)s")
-            
-            # Use yt-dlp to download
-            cmd = ['yt-dlp']
+            video_id = extract_youtube_video_id(job.source_url)
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+            audio_only = job.to_format in YOUTUBE_AUDIO_FORMATS
+            formats = 'ba/b' if audio_only else 'bv*+ba/b'
             
-            # Add audio extraction options for audio formats
-            if job.to_format in ['mp3', 'wav', 'flac', 'aiff']:
-                cmd.extend(['--extract-audio', '--audio-format', job.to_format])
+            mode = job.encoding_mode or DEFAULT_ENCODING_MODE
+            # Not keyed on the planned settings: they change with the queue, and the
+            # video id already fixes the size they start from
+            cache_key = f"{video_id}_{job.to_format}_{mode}"
             
-            # Add output path and URL
-            cmd.extend(['--output', output_path, job.source_url])
+            details['path'] = 'cache'
             
-            # Log the command for debugging
-            print(f"Running yt-dlp command: {' '.join(cmd)}")
+            def download(output_prefix):
+                details['path'] = 'youtube'
+                profile = self._job_profile(job, lambda: self._plan_youtube_profile(video_url, formats, mode))
+                return self._stream_youtube(video_url, formats, audio_only,
+                                            self._ffmpeg_output_args(job.to_format, profile), profile,
+                                            f"{output_prefix}.{job.to_format}", progress_callback)
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=3600)
+            cached_file = youtube_cache.get_or_download(cache_key, download)
             
-            # Log output for debugging
-            print(f"yt-dlp stdout: {result.stdout}")
-            print(f"yt-dlp stderr: {result.stderr}")
+            # Give the job its own link so cache expiry can't remove its output
+            output_file = os.path.join(self.output_dir, f"{job.job_id}_converted.{job.to_format}")
+            link_or_copy(cached_file, output_file)
+            record_media_path(details['path'])
+            return output_file
             
-            if result.returncode != 0:
-                error_msg = result.stderr or result.stdout or "Unknown yt-dlp error"
-                raise Exception(f"yt-dlp failed with code {result.returncode}: {error_msg}")
-            
-            # Find the downloaded file
-            downloaded_files = []
-            for file in os.listdir(self.output_dir):
-                if file.startswith(f"{job.job_id}_youtube"):
-                    downloaded_files.append(file)
-            
-            if not downloaded_files:
-                raise Exception(f"Downloaded file not found. Output directory contents: {os.listdir(self.output_dir)}")
-            
-            # Return the first matching file
-            return os.path.join(self.output_dir, downloaded_files[0])
-            
-        except subprocess.TimeoutExpired:
-            raise Exception("YouTube download timed out after 1 hour")
         except Exception as e:
-            raise Exception(f"YouTube download failed: {str(e)}")
+            raise Exception(f"YouTube conversion failed: {str(e)}")
     
-    def _convert_file(self, source_file, from_format, to_format, job_id):
-        """Convert file using appropriate tool"""
+    def _plan_youtube_profile(self, url, formats, mode):
+        """Encoding profile for a YouTube job, from the size and duration yt-dlp reports for the video"""
+        result = run_limited(['yt-dlp', '--skip-download', '--no-warnings', '--no-playlist', '-f', formats,
+                              '--print', '%(filesize,filesize_approx)s %(duration)s', url],
+                             timeout=YOUTUBE_INFO_TIMEOUT)
+        if result.returncode != 0:
+            error_msg = result.stderr or result.stdout or "Unknown yt-dlp error"
+            raise Exception(f"yt-dlp failed with code {result.returncode}: {error_msg}")
+        
+        size, _, duration = result.stdout.strip().partition(' ')
+        return self._plan_profile_for(int(_number(size) or 0), _number(duration), mode)
+    
+    def _stream_youtube(self, url, formats, audio_only, output_args, profile, output_file, progress_callback=None):
+        """Pipe yt-dlp's download into FFmpeg, which encodes it straight into output_file"""
+        cmd = ['ffmpeg', '-y', '-i', 'pipe:0']
+        if audio_only:
+            cmd.append('-vn')
+        cmd.extend(output_args)
+        cmd.extend(['-threads', str(profile['threads']), output_file])
+        
+        with tempfile.TemporaryFile(mode='w+') as stderr_file:
+            download = LimitedProcess(['yt-dlp', '--quiet', '--no-warnings', '--no-playlist', '-f', formats,
+                                       '-o', '-', url],
+                                      YOUTUBE_DOWNLOAD_TIMEOUT, stdout=subprocess.PIPE, stderr=stderr_file)
+            encode_error = None
+            try:
+                run_ffmpeg(cmd, on_time=self._time_reporter(progress_callback, profile['duration']),
+                           stdin=download.stdout)
+            except Exception as e:
+                encode_error = e
+            finally:
+                # Already handed to FFmpeg unless it couldn't start; yt-dlp stops once the pipe is closed
+                download.stdout.close()
+            download.wait()
+            stderr_file.seek(0)
+            error_msg = stderr_file.read().strip()
+        
+        try:
+            download.check(error_msg)
+            if download.returncode != 0:
+                raise Exception(f"yt-dlp failed with code {download.returncode}: {error_msg or 'Unknown yt-dlp error'}")
+            if encode_error:
+                raise encode_error
+        except Exception:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
+        return output_file
+    
+    def _convert_file(self, source_file, from_format, to_format, job_id, progress_callback=None, details=None,
+                      profile=None):
+        """Convert file using appropriate tool. details receives the path the conversion took"""
+        details = details if details is not None else {}
         try:
             output_file = os.path.join(self.output_dir, f"{job_id}_converted.{to_format}")
             
+            # Media encoder settings, planned from the file's size and duration and the queue;
+            # container-only changes copy the streams instead of re-encoding them
+            remux_args = None
+            if self._is_media_conversion(from_format, to_format):
+                if profile is None:
+                    profile = self._plan_profile(source_file, DEFAULT_ENCODING_MODE)
+                remux_args = plan_remux(source_file, from_format, to_format)
+            
+            # Reuse an earlier conversion of the same content with the same settings
+            cache_key = self._result_cache_key(source_file, from_format, to_format, profile, remux_args)
+            if cache_key and result_cache.fetch(cache_key, output_file):
+                details['path'] = 'cache'
+                return output_file
+            
             # Audio/Video conversions using FFmpeg
             if self._is_media_conversion(from_format, to_format):
-                return self._convert_with_ffmpeg(source_file, output_file, from_format, to_format)
+                result = self._convert_with_ffmpeg(source_file, output_file, from_format, to_format, profile,
+                                                   remux_args, progress_callback=progress_callback,
+                                                   details=details)
             
             # Image conversions using Pillow
             elif self._is_image_conversion(from_format, to_format):
-                return self._convert_image(source_file, output_file, from_format, to_format)
+                details['path'] = 'image'
+                result = self._convert_image(source_file, output_file, from_format, to_format)
             
             # Archive conversions
             elif self._is_archive_conversion(from_format, to_format):
-                return self._convert_archive(source_file, output_file, from_format, to_format)
+                details['path'] = 'archive'
+                result = self._convert_archive(source_file, output_file, from_format, to_format,
+                                               progress_callback=progress_callback)
             
             else:
                 raise Exception(f"Unsupported conversion: {from_format} to {to_format}")
+            
+            if result and cache_key:
+                result_cache.store(cache_key, result)
+            return result
                 
         except Exception as e:
             raise Exception(f"Conversion failed: {str(e)}")
     
+    def _plan_profile(self, source_file, mode):
+        """Encoding profile for a media job given the current load of the conversion lane"""
+        return self._plan_profile_for(os.path.getsize(source_file), probe_duration(source_file), mode)
+    
+    def _plan_profile_for(self, file_size, duration, mode):
+        from src.services.worker_pool import conversion_pool
+        queued_jobs, active_jobs = conversion_pool.lane_load()
+        return plan_profile(file_size, duration, queued_jobs=queued_jobs, active_jobs=active_jobs, mode=mode)
+    
+    def _result_cache_key(self, source_file, from_format, to_format, profile=None, remux_args=None):
+        """Build the result cache key from the source content hash and the encoding parameters"""
+        if not ENABLE_RESULT_CACHE:
+            return None
+        
+        source_hash = self.file_handler.get_file_hash(source_file)
+        if not source_hash:
+            return None
+        
+        return result_cache.make_key(source_hash, to_format,
+                                     self._encoding_params(from_format, to_format, profile, remux_args))
+    
+    def _encoding_params(self, from_format, to_format, profile=None, remux_args=None):
+        """Describe the settings that determine the output bytes, for cache keying"""
+        if remux_args:
+            # A stream copy comes out the same whatever the profile
+            return {'remux': remux_args}
+        if self._is_media_conversion(from_format, to_format):
+            # Only the codec options reach the output; threads and the load inputs don't
+            return {'ffmpeg': self._ffmpeg_output_args(to_format, profile)}
+        if self._is_image_conversion(from_format, to_format):
+            return {'from': from_format, 'encoder': encoder_settings(to_format)}
+        if to_format == 'zip':
+            return {'from': from_format, 'zip_level': ZIP_COMPRESSION_LEVEL}
+        return {'from': from_format}
+    
     def _is_media_conversion(self, from_format, to_format):
         """Check if this is a media (audio/video) conversion"""
         media_formats = ['mp3', 'wav', 'flac', 'ogg', 'aiff', 'mp4', 'mov']
@@ -135,129 +309,94 @@ class ConversionService:
     
     def _is_image_conversion(self, from_format, to_format):
         """Check if this is an image conversion"""
-        image_formats = ['png', 'jpg', 'jpeg']
-        return from_format in image_formats and to_format in image_formats
+        return from_format in IMAGE_FORMATS and to_format in IMAGE_FORMATS
     
     def _is_archive_conversion(self, from_format, to_format):
         """Check if this is an archive conversion"""
-        archive_formats = ['rar', 'zip', 'iso']
-        return from_format in archive_formats and to_format in archive_formats
+        return from_format in ARCHIVE_FORMATS and to_format in ARCHIVE_FORMATS
     
-    def _convert_with_ffmpeg(self, source_file, output_file, from_format, to_format):
-        """Convert media files using FFmpeg with optimizations for large files"""
+    def _convert_with_ffmpeg(self, source_file, output_file, from_format, to_format, profile,
+                             remux_args=None, progress_callback=None, details=None):
+        """Convert media files using FFmpeg with optimizations for large files; remux_args from plan_remux"""
+        details = details if details is not None else {}
         try:
-            cmd = ['ffmpeg', '-i', source_file, '-y']
-            
-            # Add specific options for different formats
-            if to_format == 'mp3':
-                cmd.extend(['-acodec', 'libmp3lame', '-b:a', '192k'])
-            elif to_format == 'flac':
-                cmd.extend(['-acodec', 'flac', '-compression_level', '5'])
-            elif to_format == 'wav':
-                cmd.extend(['-acodec', 'pcm_s16le'])
-            elif to_format == 'mp4':
-                cmd.extend(['-c:v', 'libx264', '-preset', 'medium', '-crf', '23'])
-            elif to_format == 'mov':
-                cmd.extend(['-c:v', 'libx264', '-preset', 'medium', '-crf', '23'])
-            
-            # Add progress reporting and optimization flags for large files
-            cmd.extend([
-                '-progress', 'pipe:1',  # Progress to stdout
-                '-nostats',  # Reduce output
-                '-loglevel', 'error',  # Only show errors
-                '-threads', '0',  # Use all available CPU cores
-                output_file
-            ])
+            # Long videos are cut at keyframes and their segments encoded in parallel
+            if not remux_args and self.segmented_encoder.should_segment(source_file, from_format, to_format):
+                details['path'] = 'segmented'
+                result = self.segmented_encoder.encode(source_file, output_file,
+                                                       self._ffmpeg_output_args(to_format, profile),
+                                                       progress_callback=progress_callback)
+                if result:
+                    record_media_path('segmented')
+                    return result
             
-            # Use Popen for better control over long-running processes
-            process = subprocess.Popen(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE, 
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
+            details['path'] = 'remux' if remux_args else 'encode'
+            duration = profile['duration']
             
-            # Monitor progress (simplified - in production you'd parse FFmpeg progress)
-            stdout, stderr = process.communicate()
+            cmd = ['ffmpeg', '-i', source_file, '-y']
+            if remux_args:
+                cmd.extend(remux_args)
+            else:
+                cmd.extend(self._ffmpeg_output_args(to_format, profile))
+                cmd.extend(['-threads', str(profile['threads'])])
+            cmd.append(output_file)
             
-            if process.returncode != 0:
-                raise Exception(f"FFmpeg failed: {stderr}")
+            run_ffmpeg(cmd, on_time=self._time_reporter(progress_callback, duration))
+            record_media_path(details['path'])
             
             return output_file if os.path.exists(output_file) else None
             
-        except subprocess.TimeoutExpired:
-            process.kill()
-            raise Exception("FFmpeg conversion timed out")
         except Exception as e:
             raise Exception(f"FFmpeg conversion failed: {str(e)}")
     
+    def _time_reporter(self, progress_callback, duration):
+        """Turn FFmpeg's seconds of output into percentages for progress_callback"""
+        if not progress_callback:
+            return None
+        
+        def report(seconds):
+            if seconds is None:
+                progress_callback(100)
+            elif duration:
+                progress_callback(seconds / duration * 100)
+        
+        return report
+    
+    def _ffmpeg_output_args(self, to_format, profile):
+        """Get the codec options for the target format from the job's encoding profile"""
+        # Add specific options for different formats
+        if to_format == 'mp3':
+            return ['-acodec', 'libmp3lame', '-b:a', profile['audio_bitrate']]
+        elif to_format == 'flac':
+            return ['-acodec', 'flac', '-compression_level', '5']
+        elif to_format == 'wav':
+            return ['-acodec', 'pcm_s16le']
+        elif to_format in ('mp4', 'mov'):
+            return ['-c:v', 'libx264', '-preset', profile['preset'], '-crf', str(profile['crf']),
+                    '-c:a', 'aac', '-b:a', profile['audio_bitrate']]
+        return []
+    
     def _convert_image(self, source_file, output_file, from_format, to_format):
-        """Convert image files using Pillow"""
+        """Convert image files using Pillow in the image process pool"""
         try:
-            from PIL import Image
-            
-            with Image.open(source_file) as img:
-                # Convert RGBA to RGB for JPEG
-                if to_format.lower() in ['jpg', 'jpeg'] and img.mode in ['RGBA', 'LA']:
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                
-                img.save(output_file, format=to_format.upper())
-            
+            image_pool.convert(source_file, output_file, from_format, to_format)
             return output_file if os.path.exists(output_file) else None
             
         except Exception as e:
             raise Exception(f"Image conversion failed: {str(e)}")
     
-    def _convert_archive(self, source_file, output_file, from_format, to_format):
-        """Convert archive files"""
+    def _convert_archive(self, source_file, output_file, from_format, to_format, progress_callback=None):
+        """Convert archive files member by member, without extracting them first"""
         try:
-            # This is a simplified implementation
-            # In production, you'd use proper archive libraries
-            
-            if from_format == 'zip' and to_format == 'rar':
-                # Extract zip and create rar
-                import zipfile
-                import tempfile
-                
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    with zipfile.ZipFile(source_file, 'r') as zip_ref:
-                        zip_ref.extractall(temp_dir)
-                    
-                    # Use rar command to create archive
-                    cmd = ['rar', 'a', output_file, f"{temp_dir}/*"]
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    
-                    if result.returncode != 0:
-                        raise Exception("RAR creation failed")
-            
-            elif from_format == 'rar' and to_format == 'zip':
-                # Extract rar and create zip
-                import tempfile
-                
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    cmd = ['unrar', 'x', source_file, temp_dir]
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    
-                    if result.returncode != 0:
-                        raise Exception("RAR extraction failed")
-                    
-                    # Create zip
-                    import zipfile
-                    with zipfile.ZipFile(output_file, 'w') as zip_ref:
-                        for root, dirs, files in os.walk(temp_dir):
-                            for file in files:
-                                file_path = os.path.join(root, file)
-                                arc_path = os.path.relpath(file_path, temp_dir)
-                                zip_ref.write(file_path, arc_path)
-            
-            else:
-                raise Exception(f"Unsupported archive conversion: {from_format} to {to_format}")
-            
+            transcode_archive(source_file, output_file, from_format, to_format,
+                              progress_callback=progress_callback)
             return output_file if os.path.exists(output_file) else None
             
         except Exception as e:
             raise Exception(f"Archive conversion failed: {str(e)}")
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,446 @@
+import os
+import re
+import json
+import math
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from functools import wraps
+from flask import request, jsonify
+from src.models.job import Job, db
+from src.services.result_cache import result_cache
+from src.services.youtube_cache import youtube_cache
+from src.utils.large_file_handler import LargeFileHandler, ChunkedUploadManager, HASH_SUFFIX
+from src.utils.metrics import metrics
+from src.utils.large_files import (
+    MIN_FREE_DISK_SPACE,
+    MIN_FREE_DISK_SHARE,
+    DISK_SPACE_CHECK_INTERVAL,
+    CLEANUP_INTERVAL,
+    UPLOAD_RETENTION,
+    OUTPUT_RETENTION,
+    OUTPUT_EVICTION_GRACE,
+    DISK_OUTPUT_FACTOR,
+    DISK_ADMISSION_RETRY_AFTER,
+    LARGE_FILE_CONVERSION_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# Files and work directories named after the job they belong to
+JOB_FILE_PATTERN = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})_(converted|youtube)')
+
+metrics.counter('gigovert_disk_evictions_total', 'Files removed by the disk janitor, by directory and reason (expired, pressure)')
+metrics.counter('gigovert_disk_freed_bytes_total', 'Bytes freed by the disk janitor, by directory')
+metrics.counter('gigovert_disk_admissions_total', 'Uploads checked against free disk space, by result (admitted, deferred, rejected)')
+
+class _Entry:
+    """A file or work directory the janitor may remove"""
+    def __init__(self, directory, kind, path, size, last_used, job_id=None, downloaded=False):
+        self.directory = directory
+        self.kind = kind
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+        self.job_id = job_id
+        self.downloaded = downloaded
+
+class DiskSpaceManager:
+    """
+    Keeps the uploads and outputs directories within the disk.
+
+    A janitor thread measures free space and the bytes in each directory
+    every DISK_SPACE_CHECK_INTERVAL seconds. Every CLEANUP_INTERVAL seconds
+    it removes what has expired: sources no queued or running job needs
+    after UPLOAD_RETENTION, outputs OUTPUT_RETENTION after their last
+    download, stale chunked uploads, segment directories of finished jobs,
+    abandoned RAR staging directories and expired YouTube conversions. When
+    free space is below the minimum (MIN_FREE_DISK_SPACE, or
+    MIN_FREE_DISK_SHARE of a smaller disk) it sweeps right away and then
+    removes cached results and outputs that were downloaded and not used
+    for OUTPUT_EVICTION_GRACE, least recently used first, until there is
+    enough. One process sweeps at a time; the results are shared with the
+    others through a state file.
+
+    Uploads are admitted (require_disk_space) only if free space stays above
+    the minimum after the upload, its expected output and the outputs still
+    to be written by queued and running jobs.
+    """
+    def __init__(self, upload_dir, output_dir, min_free=None,
+                 check_interval=DISK_SPACE_CHECK_INTERVAL, cleanup_interval=CLEANUP_INTERVAL):
+        self.app = None
+        self.upload_dir = os.path.realpath(upload_dir)
+        self.output_dir = os.path.realpath(output_dir)
+        self.check_interval = check_interval
+        self.cleanup_interval = cleanup_interval
+        self.file_handler = LargeFileHandler(self.upload_dir)
+        self.chunked_uploads = ChunkedUploadManager(self.upload_dir)
+        os.makedirs(self.output_dir, exist_ok=True)
+        if min_free is None:
+            # A fixed 50GB would keep a small disk permanently "full"
+            min_free = min(MIN_FREE_DISK_SPACE, int(shutil.disk_usage(self.output_dir).total * MIN_FREE_DISK_SHARE))
+        self.min_free = min_free
+        self._state_path = os.path.join(self.output_dir, '.disk-usage.json')
+        self._lock_path = os.path.join(self.output_dir, '.janitor.lock')
+        self._lock = threading.Lock()
+        self._reserved_bytes = 0
+        self._admitted_outputs = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """Bind the manager to a Flask app and start the janitor"""
+        self.app = app
+        self.start()
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._janitor_loop, name='disk-janitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def admit(self, need):
+        """
+        Reserve need bytes for an upload and its output. Returns (admitted,
+        retry_after): retry_after is None if the upload can never fit
+        """
+        usage = shutil.disk_usage(self.output_dir)
+        if need > usage.total - self.min_free:
+            metrics.inc('gigovert_disk_admissions_total', {'result': 'rejected'})
+            return False, None
+
+        state = self._read_state()
+        with self._lock:
+            # Outputs admitted since the last check aren't part of its pending bytes yet
+            checked_at = state.get('checked_at', 0)
+            self._admitted_outputs = [(at, size) for at, size in self._admitted_outputs if at > checked_at]
+            projected = (usage.free - need - self._reserved_bytes - state.get('pending_output_bytes', 0)
+                         - sum(size for _, size in self._admitted_outputs))
+            if projected < self.min_free:
+                admitted = False
+            else:
+                admitted = True
+                self._reserved_bytes += need
+
+        if not admitted:
+            metrics.inc('gigovert_disk_admissions_total', {'result': 'deferred'})
+            logger.warning(f"Deferring an upload of {need} bytes: {usage.free} bytes free, "
+                           f"{self.min_free} must stay free")
+            # Free space now rather than at the next check
+            self._wakeup.set()
+            return False, DISK_ADMISSION_RETRY_AFTER
+        metrics.inc('gigovert_disk_admissions_total', {'result': 'admitted'})
+        return True, None
+
+    def release(self, need, output_bytes=0):
+        """Drop a reservation once its request is done; output_bytes are still to be written by the new job(s)"""
+        with self._lock:
+            self._reserved_bytes -= need
+            if output_bytes:
+                self._admitted_outputs.append((time.time(), output_bytes))
+
+    def touch(self, path):
+        """Record a download of an output for least recently used eviction (the mtime is kept for ETags)"""
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def check(self):
+        """Measure the directories and sweep them if a cleanup is due or space is short"""
+        with open(self._lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another process is at it
+            try:
+                self._check_locked()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_stats(self):
+        """Free space, directory sizes and janitor totals (shared by all processes)"""
+        usage = shutil.disk_usage(self.output_dir)
+        state = self._read_state()
+        with self._lock:
+            reserved = self._reserved_bytes
+        return {
+            'free_bytes': usage.free,
+            'total_bytes': usage.total,
+            'min_free_bytes': self.min_free,
+            'directory_bytes': state.get('directory_bytes', {}),
+            'pending_output_bytes': state.get('pending_output_bytes', 0),
+            'reserved_bytes': reserved,
+            'evicted_files': state.get('evicted_files', 0),
+            'freed_bytes': state.get('freed_bytes', 0),
+            'checked_at': state.get('checked_at'),
+            'swept_at': state.get('swept_at')
+        }
+
+    def _janitor_loop(self):
+        while not self._stopping.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Disk janitor failed: {str(e)}")
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+
+    def _check_locked(self):
+        state = self._read_state()
+        now = time.time()
+        with self.app.app_context():
+            try:
+                active_jobs, active_sources, pending = self._active_jobs()
+            finally:
+                db.session.remove()
+
+        entries = self._scan(active_jobs)
+        free = shutil.disk_usage(self.output_dir).free
+        swept = now - state.get('swept_at', 0) >= self.cleanup_interval or free < self.min_free
+
+        if swept:
+            youtube_cache.purge_expired()
+            for entry in entries:
+                if self._expired(entry, active_jobs, active_sources, now):
+                    self._evict(entry, 'expired', state)
+            free = shutil.disk_usage(self.output_dir).free
+            if free < self.min_free:
+                self._evict_for_space(entries, active_jobs, state, now)
+                free = shutil.disk_usage(self.output_dir).free
+                if free < self.min_free:
+                    logger.warning(f"Only {free} bytes free after evicting every output that may go "
+                                   f"(want {self.min_free})")
+            state['swept_at'] = now
+
+        state['checked_at'] = now
+        state['free_bytes'] = free
+        state['pending_output_bytes'] = pending
+        state['directory_bytes'] = self._directory_bytes()
+        self._write_state(state)
+
+    def _active_jobs(self):
+        """Ids and source paths of queued and running jobs, and the output bytes they have yet to write"""
+        rows = (Job.query.with_entities(Job.job_id, Job.source_file_path)
+                .filter(Job.status.in_(['queued', 'processing'])).all())
+        active_jobs = {job_id for job_id, _ in rows}
+        active_sources = set()
+        pending = 0
+        for _, source in rows:
+            if not source:
+                continue
+            active_sources.add(os.path.realpath(source))
+            try:
+                pending += int(os.path.getsize(source) * DISK_OUTPUT_FACTOR)
+            except OSError:
+                pass
+        return active_jobs, active_sources, pending
+
+    def _scan(self, active_jobs):
+        """Every file and work directory the janitor looks after"""
+        entries = []
+        for item in _scandir(self.upload_dir):
+            if item.name == 'chunks' or item.name.endswith(HASH_SUFFIX):
+                continue
+            if item.is_file(follow_symlinks=False):
+                entries.append(_file_entry('uploads', 'upload', item))
+
+        for item in _scandir(os.path.join(self.upload_dir, 'chunks')):
+            if item.is_dir(follow_symlinks=False):
+                entries.append(_dir_entry('uploads', 'chunk_state', item.path))
+
+        for item in _scandir(self.output_dir):
+            match = JOB_FILE_PATTERN.match(item.name)
+            if item.is_file(follow_symlinks=False) and match:
+                kind = 'output' if match.group(2) == 'converted' else 'source'
+                entries.append(_file_entry('outputs', kind, item, match.group(1)))
+            elif item.is_dir(follow_symlinks=False) and item.name.startswith('rar-staging-'):
+                entries.append(_dir_entry('outputs', 'staging', item.path))
+
+        for item in _scandir(os.path.join(self.output_dir, 'segments')):
+            match = JOB_FILE_PATTERN.match(item.name)
+            if item.is_dir(follow_symlinks=False) and item.name.endswith('.segments') and match:
+                entries.append(_dir_entry('outputs', 'segments', item.path, match.group(1)))
+
+        for item in _scandir(result_cache.cache_dir):
+            if item.is_file(follow_symlinks=False) and not item.name.endswith('.tmp'):
+                # The cache records each use in the mtime
+                entry = _file_entry('outputs', 'cache', item)
+                entry.last_used = item.stat(follow_symlinks=False).st_mtime
+                entries.append(entry)
+        return entries
+
+    def _expired(self, entry, active_jobs, active_sources, now):
+        age = now - entry.last_used
+        if entry.kind == 'upload':
+            return entry.path not in active_sources and age > UPLOAD_RETENTION
+        if entry.kind == 'chunk_state':
+            return age > UPLOAD_RETENTION and not self._chunked_upload_has_file(entry.path)
+        if entry.kind in ('source', 'segments'):
+            return entry.job_id not in active_jobs and age > UPLOAD_RETENTION
+        if entry.kind == 'output':
+            return entry.job_id not in active_jobs and age > OUTPUT_RETENTION
+        if entry.kind == 'staging':
+            # Only a conversion that outlived its rar processes could still be using it
+            return age > LARGE_FILE_CONVERSION_TIMEOUT
+        return False  # The result cache keeps to its own budget
+
+    def _evict_for_space(self, entries, active_jobs, state, now):
+        """Remove cached results and idle downloaded outputs, least recently used first, until enough space is free"""
+        candidates = [entry for entry in entries
+                      if (entry.kind == 'cache' or self._evictable_output(entry, active_jobs, now))
+                      and os.path.lexists(entry.path)]
+        candidates.sort(key=lambda entry: entry.last_used)
+        for entry in candidates:
+            if shutil.disk_usage(self.output_dir).free >= self.min_free:
+                break
+            self._evict(entry, 'pressure', state)
+        # Let the result cache recount what is left of it
+        result_cache.evict()
+
+    def _evictable_output(self, entry, active_jobs, now):
+        """
+        Whether an output may go before it expires: a user who was told the job
+        completed must still be able to download it, so only outputs already
+        downloaded and then left alone for OUTPUT_EVICTION_GRACE qualify
+        """
+        return (entry.kind == 'output' and entry.job_id not in active_jobs and entry.downloaded
+                and now - entry.last_used > OUTPUT_EVICTION_GRACE)
+
+    def _evict(self, entry, reason, state):
+        try:
+            links = os.lstat(entry.path).st_nlink
+        except FileNotFoundError:
+            return
+        # An output hard linked into the result cache (or a job) frees nothing on its own
+        freeable = entry.kind in ('chunk_state', 'segments', 'staging') or links <= 1
+
+        if entry.kind == 'chunk_state':
+            self.chunked_uploads.abort_upload(os.path.basename(entry.path))
+        elif entry.kind == 'upload' and entry.path.endswith('.part'):
+            # Drop the chunked upload's state along with its data
+            self.chunked_uploads.abort_upload(os.path.basename(entry.path)[:-len('.part')])
+        elif entry.kind in ('segments', 'staging'):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            self.file_handler.cleanup_file(entry.path)
+
+        if os.path.lexists(entry.path):
+            return
+        freed = entry.size if freeable else 0
+        metrics.inc('gigovert_disk_evictions_total', {'directory': entry.directory, 'reason': reason})
+        metrics.inc('gigovert_disk_freed_bytes_total', {'directory': entry.directory}, freed)
+        state['evicted_files'] = state.get('evicted_files', 0) + 1
+        state['freed_bytes'] = state.get('freed_bytes', 0) + freed
+        logger.info(f"Evicted {entry.kind} {entry.path} ({reason}, {entry.size} bytes)")
+
+    def _chunked_upload_has_file(self, state_dir):
+        """Whether a chunked upload still has its data (in progress) or its completed file (not yet converted)"""
+        upload_id = os.path.basename(state_dir)
+        try:
+            manifest = self.chunked_uploads.get_manifest(upload_id)
+        except (KeyError, ValueError):
+            return False
+        path = manifest.get('completed_path') or os.path.join(self.upload_dir, f"{upload_id}.part")
+        return os.path.exists(path)
+
+    def _directory_bytes(self):
+        """Bytes in each directory, counting hard linked files once"""
+        totals = {}
+        for name, path in (('uploads', self.upload_dir), ('outputs', self.output_dir)):
+            seen = set()
+            total = 0
+            for root, _, files in os.walk(path):
+                for file_name in files:
+                    try:
+                        stat = os.lstat(os.path.join(root, file_name))
+                    except FileNotFoundError:
+                        continue
+                    if (stat.st_dev, stat.st_ino) not in seen:
+                        seen.add((stat.st_dev, stat.st_ino))
+                        total += stat.st_blocks * 512
+            totals[name] = total
+        return totals
+
+    def _read_state(self):
+        try:
+            with open(self._state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, state):
+        temp_path = f"{self._state_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self._state_path)
+
+def _scandir(path):
+    try:
+        return list(os.scandir(path))
+    except FileNotFoundError:
+        return []
+
+def _file_entry(directory, kind, item, job_id=None):
+    stat = item.stat(follow_symlinks=False)
+    # Downloads set the access time, so it tells when an output was last used and whether it ever was
+    return _Entry(directory, kind, os.path.realpath(item.path), stat.st_blocks * 512,
+                  max(stat.st_atime, stat.st_mtime), job_id, downloaded=stat.st_atime > stat.st_mtime)
+
+def _dir_entry(directory, kind, path, job_id=None):
+    """A work directory, sized and dated by everything inside it"""
+    size = 0
+    last_used = os.lstat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                stat = os.lstat(os.path.join(root, file_name))
+            except FileNotFoundError:
+                continue
+            size += stat.st_blocks * 512
+            last_used = max(last_used, stat.st_mtime)
+    return _Entry(directory, kind, os.path.realpath(path), size, last_used, job_id)
+
+def require_disk_space(size):
+    """
+    Admission control decorator: size is a function of the request returning
+    the bytes it uploads (or None). The request is turned away with 507 if
+    the upload and its expected output would leave less than
+    MIN_FREE_DISK_SPACE free; with a Retry-After if space may be freed by then
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            upload_bytes = size(request) or 0
+            output_bytes = int(upload_bytes * DISK_OUTPUT_FACTOR)
+            need = upload_bytes + output_bytes
+            admitted, retry_after = disk_manager.admit(need)
+            if not admitted:
+                if retry_after is None:
+                    return jsonify({'error': 'File is too large for the available storage'}), 507
+                response = jsonify({'error': 'Not enough free disk space right now. Please try again later.'})
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response, 507
+
+            accepted = False
+            try:
+                result = f(*args, **kwargs)
+                accepted = isinstance(result, tuple) and result[1] in (201, 202)
+                return result
+            finally:
+                # The upload is on disk now; its output is counted until the next check sees the job
+                disk_manager.release(need, output_bytes if accepted else 0)
+        return decorated_function
+    return decorator
+
+# Global disk space manager instance
+disk_manager = DiskSpaceManager(os.path.join(os.path.dirname(__file__), '..', 'uploads'),
+                                os.path.join(os.path.dirname(__file__), '..', 'outputs'))
@@ -0,0 +1,301 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from src.utils.metrics import metrics, IMAGE_TIMING_BUCKETS
+from src.services.image_strips import strip_conversion_supported, convert_in_strips
+from src.utils.large_files import (
+    IMAGE_POOL_PROCESSES,
+    IMAGE_BATCH_MAX_BYTES,
+    IMAGE_BATCH_SIZE,
+    IMAGE_BATCH_WINDOW,
+    IMAGE_CONVERSION_TIMEOUT,
+    IMAGE_ENCODER_SETTINGS,
+    IMAGE_MAX_PIXELS,
+    IMAGE_STRIP_PIXEL_THRESHOLD,
+    IMAGE_MEMORY_LIMIT
+)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = ['png', 'jpg', 'jpeg']
+
+# Pillow format names for our file extensions
+PILLOW_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG'}
+
+metrics.histogram('gigovert_image_decode_seconds', 'Image decode time by source format', IMAGE_TIMING_BUCKETS)
+metrics.histogram('gigovert_image_encode_seconds', 'Image encode time by target format', IMAGE_TIMING_BUCKETS)
+
+def pillow_format(extension):
+    """Pillow format name for a file extension"""
+    return PILLOW_FORMATS.get(extension.lower(), extension.upper())
+
+def encoder_settings(to_format):
+    """Pillow save() options for a target format"""
+    return dict(IMAGE_ENCODER_SETTINGS.get(pillow_format(to_format).lower(), {}))
+
+def convert_image(source_file, output_file, to_format, settings):
+    """Decode and re-encode one image (runs in a pool process). Returns its timings"""
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    target_format = pillow_format(to_format)
+
+    started = time.perf_counter()
+    with Image.open(source_file) as img:
+        width, height = img.size
+        if width * height > IMAGE_MAX_PIXELS:
+            raise Exception(f"Image too large: {width}x{height} exceeds {IMAGE_MAX_PIXELS} pixels")
+
+        # Very large images would need several full-size bitmaps: convert them in strips
+        if width * height >= IMAGE_STRIP_PIXEL_THRESHOLD or _full_decode_memory(img, target_format) > IMAGE_MEMORY_LIMIT:
+            if strip_conversion_supported(source_file):
+                timings = convert_in_strips(source_file, output_file, target_format, settings, img)
+                timings['output_bytes'] = os.path.getsize(output_file)
+                return timings
+            if _full_decode_memory(img, target_format) > IMAGE_MEMORY_LIMIT:
+                raise Exception(f"Image too large to convert within the memory limit: {width}x{height} "
+                                f"(only non-interlaced 8-bit PNGs can be converted in strips)")
+
+        img.load()
+        decoded = time.perf_counter()
+
+        if target_format == 'JPEG':
+            img = flatten_for_jpeg(img)
+        img.save(output_file, format=target_format, **settings)
+    encoded = time.perf_counter()
+
+    return {
+        'decode_seconds': decoded - started,
+        'encode_seconds': encoded - decoded,
+        'width': width,
+        'height': height,
+        'output_bytes': os.path.getsize(output_file)
+    }
+
+def _convert_batch(items):
+    """Convert several small images in one pool task; one failure doesn't fail the others"""
+    results = []
+    for item in items:
+        try:
+            results.append((True, convert_image(*item)))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {str(e)}"))
+    return results
+
+def flatten_for_jpeg(img):
+    """JPEG has no alpha channel: put transparent images on a white background"""
+    from PIL import Image
+
+    if img.mode in ('RGB', 'L', 'CMYK'):
+        return img
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    return img.convert('RGB')
+
+def _full_decode_memory(img, target_format):
+    # Pillow keeps most modes at 4 bytes per pixel; flattening for JPEG adds an RGBA copy and a background
+    return img.size[0] * img.size[1] * 4 * (3 if target_format == 'JPEG' else 1)
+
+def _default_processes():
+    # Every gunicorn worker gets its own pool, so share the cores between them
+    web_concurrency = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+    return max(1, (os.cpu_count() or 1) // web_concurrency)
+
+class ImageConversionPool:
+    """
+    Runs Pillow decode/encode in a process pool so image jobs use every core
+    instead of contending for the GIL in the web process.
+
+    Images up to IMAGE_BATCH_MAX_BYTES are collected for IMAGE_BATCH_WINDOW
+    seconds (or until IMAGE_BATCH_SIZE are waiting) and sent to a pool process
+    as one task, so a flood of small conversions doesn't pay a round trip per
+    image. Larger images are sent on their own. Decode and encode times of
+    every image are recorded in the shared metrics.
+    """
+    def __init__(self, processes=IMAGE_POOL_PROCESSES, batch_size=IMAGE_BATCH_SIZE,
+                 batch_max_bytes=IMAGE_BATCH_MAX_BYTES, batch_window=IMAGE_BATCH_WINDOW):
+        self.processes = processes or _default_processes()
+        self.batch_size = batch_size
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_window = batch_window
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._batch_ready = threading.Condition()
+        self._pending = []
+        self._batcher = None
+        self._batcher_pid = None
+        self.stats = {
+            'images': 0,
+            'failed_images': 0,
+            'batches': 0,
+            'batched_images': 0,
+            'strip_images': 0,
+            'decode_seconds_total': 0.0,
+            'encode_seconds_total': 0.0
+        }
+
+    def convert(self, source_file, output_file, from_format, to_format, timeout=IMAGE_CONVERSION_TIMEOUT):
+        """Convert one image in the pool and return its timings; raises on failure"""
+        item = (source_file, output_file, to_format, encoder_settings(to_format))
+
+        if os.path.getsize(source_file) <= self.batch_max_bytes:
+            future = self._enqueue(item)
+        else:
+            future = self._submit(convert_image, *item)
+
+        try:
+            timings = future.result(timeout=timeout)
+        except Exception:
+            self.stats['failed_images'] += 1
+            raise
+
+        self._record(from_format, to_format, timings)
+        strips = f", {timings['strips']} strips" if timings.get('strips') else ''
+        logger.info(f"Image {os.path.basename(source_file)} ({timings['width']}x{timings['height']}{strips}): "
+                    f"decode {timings['decode_seconds'] * 1000:.1f}ms, "
+                    f"encode {timings['encode_seconds'] * 1000:.1f}ms")
+        return timings
+
+    def get_stats(self):
+        """Get pool statistics"""
+        with self._batch_ready:
+            pending = len(self._pending)
+        images = self.stats['images']
+        return {
+            'processes': self.processes,
+            'pending_batch_images': pending,
+            'avg_decode_ms': round(self.stats['decode_seconds_total'] / images * 1000, 2) if images else 0,
+            'avg_encode_ms': round(self.stats['encode_seconds_total'] / images * 1000, 2) if images else 0,
+            **self.stats
+        }
+
+    def shutdown(self):
+        """Stop the pool processes"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _record(self, from_format, to_format, timings):
+        self.stats['images'] += 1
+        if timings.get('strips'):
+            self.stats['strip_images'] += 1
+        self.stats['decode_seconds_total'] += timings['decode_seconds']
+        self.stats['encode_seconds_total'] += timings['encode_seconds']
+        metrics.observe('gigovert_image_decode_seconds', timings['decode_seconds'], {'format': from_format})
+        metrics.observe('gigovert_image_encode_seconds', timings['encode_seconds'], {'format': to_format})
+
+    def _enqueue(self, item):
+        future = Future()
+        with self._batch_ready:
+            self._ensure_batcher()
+            self._pending.append((item, future))
+            self._batch_ready.notify()
+        return future
+
+    def _ensure_batcher(self):
+        if self._batcher is None or self._batcher_pid != os.getpid():
+            self._batcher = threading.Thread(target=self._batch_loop, name="image-batcher")
+            self._batcher.daemon = True
+            self._batcher.start()
+            self._batcher_pid = os.getpid()
+
+    def _batch_loop(self):
+        while True:
+            with self._batch_ready:
+                while not self._pending:
+                    self._batch_ready.wait()
+                # Give other jobs a moment to add their images to this batch
+                deadline = time.monotonic() + self.batch_window
+                while len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._batch_ready.wait(remaining)
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        futures = [future for item, future in batch]
+        try:
+            task = self._submit(_convert_batch, [item for item, future in batch])
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        self.stats['batches'] += 1
+        self.stats['batched_images'] += len(batch)
+
+        def resolve(task):
+            try:
+                results = task.result()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(self._wrap_error(e))
+                return
+            for future, (ok, value) in zip(futures, results):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(Exception(value))
+
+        task.add_done_callback(resolve)
+
+    def _submit(self, function, *args):
+        executor = self._get_executor()
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool as e:
+            self._reset_executor(executor)
+            raise self._wrap_error(e)
+
+        result = Future()
+
+        def relay(task):
+            try:
+                result.set_result(task.result())
+            except BrokenProcessPool as e:
+                self._reset_executor(executor)
+                result.set_exception(self._wrap_error(e))
+            except Exception as e:
+                result.set_exception(e)
+
+        future.add_done_callback(relay)
+        return result
+
+    def _wrap_error(self, error):
+        if isinstance(error, BrokenProcessPool):
+            return Exception("Image worker process died (the image may be too large or corrupt)")
+        return error
+
+    def _get_executor(self):
+        # Created lazily so every gunicorn worker starts its own pool after the fork
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+                self._pid = os.getpid()
+                logger.info(f"Started image conversion pool with {self.processes} processes")
+            return self._executor
+
+    def _reset_executor(self, executor):
+        # A crashed pool can't run anything else; the next image starts a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Global image conversion pool instance
+image_pool = ImageConversionPool()
@@ -0,0 +1,329 @@
+import io
+import math
+import time
+import zlib
+import struct
+from src.utils.large_files import IMAGE_MEMORY_LIMIT, IMAGE_STRIP_MAX_ROWS
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Pillow mode (also the raw mode) and bytes per pixel of 8-bit PNG color types
+PNG_COLOR_TYPES = {0: ('L', 1), 2: ('RGB', 3), 3: ('P', 1), 4: ('LA', 2), 6: ('RGBA', 4)}
+PNG_MODE_COLOR_TYPES = {mode: color_type for color_type, (mode, channels) in PNG_COLOR_TYPES.items()}
+
+# Chunks describing pixel values that are copied to a PNG written in strips
+PNG_PIXEL_CHUNKS = (b'PLTE', b'tRNS')
+
+# Conservative memory per pixel of a strip while it is inflated, decoded,
+# flattened and encoded (several copies exist at once)
+STRIP_BYTES_PER_PIXEL = 24
+
+# Strip heights are a multiple of the largest JPEG MCU height
+STRIP_ROW_MULTIPLE = 16
+
+# Largest JPEG restart interval, in MCUs
+MAX_RESTART_INTERVAL = 65535
+
+JPEG_SUBSAMPLING = {'4:4:4': 0, '4:2:2': 1, '4:2:0': 2}
+
+READ_SIZE = 1024 * 1024
+
+def strip_conversion_supported(source_file):
+    """Whether an image can be converted in strips (non-interlaced 8-bit PNGs)"""
+    header = _read_png_header(source_file)
+    return (header is not None
+            and header['bit_depth'] == 8
+            and header['interlace'] == 0
+            and header['color_type'] in PNG_COLOR_TYPES
+            and b'acTL' not in header['chunks'])
+
+def strip_rows(width, target_format, memory_limit=IMAGE_MEMORY_LIMIT):
+    """Rows per strip so that one strip stays within memory_limit"""
+    rows = min(memory_limit // (width * STRIP_BYTES_PER_PIXEL), IMAGE_STRIP_MAX_ROWS)
+    if target_format == 'JPEG':
+        # A strip becomes one restart interval, worst case with 8x8 MCUs
+        rows = min(rows, MAX_RESTART_INTERVAL // math.ceil(width / 8) * 8)
+    rows -= rows % STRIP_ROW_MULTIPLE
+    if rows < STRIP_ROW_MULTIPLE:
+        raise Exception(f"Image is too wide ({width}px) to convert within the memory limit")
+    return rows
+
+def convert_in_strips(source_file, output_file, target_format, settings, img, memory_limit=IMAGE_MEMORY_LIMIT):
+    """
+    Convert a PNG strip by strip so memory stays bounded whatever its size.
+
+    The IDAT stream is inflated incrementally and each strip of filtered rows
+    is decoded by Pillow on its own, prefixed with the previous strip's last
+    row so the PNG filters see the right neighbour. Strips are flattened and
+    encoded one at a time: JPEG strips are joined into one baseline image with
+    restart markers between them, PNG strips are filtered by Pillow and
+    deflated into a single stream. img is the opened (not loaded) source.
+    Returns timings like convert_image().
+    """
+    from src.services.image_pool import flatten_for_jpeg
+
+    header = _read_png_header(source_file)
+    width, height = header['width'], header['height']
+    rows = strip_rows(width, target_format, memory_limit)
+    decode_seconds = encode_seconds = 0.0
+    count = 0
+
+    with open(source_file, 'rb') as source, open(output_file, 'wb') as output:
+        if target_format == 'JPEG':
+            writer = _JpegStripWriter(output, width, height, rows, settings)
+        else:
+            writer = _PngStripWriter(output, header, settings)
+
+        strips = _decode_strips(source, header, rows, img)
+        while True:
+            started = time.perf_counter()
+            strip = next(strips, None)
+            decoded = time.perf_counter()
+            decode_seconds += decoded - started
+            if strip is None:
+                break
+            if target_format == 'JPEG':
+                strip = flatten_for_jpeg(strip)
+            writer.write(strip)
+            encode_seconds += time.perf_counter() - decoded
+            count += 1
+
+        started = time.perf_counter()
+        writer.close()
+        encode_seconds += time.perf_counter() - started
+
+    return {
+        'decode_seconds': decode_seconds,
+        'encode_seconds': encode_seconds,
+        'width': width,
+        'height': height,
+        'strips': count
+    }
+
+def _decode_strips(source, header, rows, img):
+    """Yield the image as Pillow images of up to rows rows, top to bottom"""
+    mode, channels = PNG_COLOR_TYPES[header['color_type']]
+    width, height = header['width'], header['height']
+    row_size = 1 + width * channels
+    strip_size = rows * row_size
+    palette = header['chunks'].get(b'PLTE')
+    transparency = img.info.get('transparency')
+
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    previous = None
+    rows_left = height
+    for data in _iter_idat(source):
+        output = b''
+        # Bounded output: a tiny, highly compressed chunk may inflate to gigabytes,
+        # so keep inflating until the input is used up and no output is held back
+        while rows_left and (data or len(output) == strip_size):
+            output = inflater.decompress(data, strip_size)
+            pending += output
+            data = inflater.unconsumed_tail
+            while rows_left and len(pending) >= min(rows, rows_left) * row_size:
+                strip_rows_count = min(rows, rows_left)
+                filtered = bytes(pending[:strip_rows_count * row_size])
+                del pending[:strip_rows_count * row_size]
+                rows_left -= strip_rows_count
+
+                strip, previous = _decode_strip(filtered, previous, mode, width, strip_rows_count)
+                if palette is not None:
+                    strip.putpalette(palette)
+                if transparency is not None:
+                    strip.info['transparency'] = transparency
+                yield strip
+        if not rows_left:
+            return
+    raise Exception("Truncated PNG image data")
+
+def _decode_strip(filtered, previous, mode, width, rows):
+    """Decode filtered rows; returns the strip and its last row as raw bytes"""
+    from PIL import Image
+
+    if previous is None:
+        strip = Image.frombytes(mode, (width, rows), zlib.compress(filtered, 0), 'zip', mode)
+    else:
+        # The previous row goes first, unfiltered, so Up/Average/Paeth rows decode correctly
+        data = zlib.compress(b'\x00' + previous + filtered, 0)
+        decoded = Image.frombytes(mode, (width, rows + 1), data, 'zip', mode)
+        strip = decoded.crop((0, 1, width, rows + 1))
+    return strip, strip.crop((0, rows - 1, width, rows)).tobytes('raw', mode)
+
+class _JpegStripWriter:
+    """
+    Encodes strips as separate baseline JPEGs and joins their scans into one image.
+
+    Every strip but the last is a whole number of MCU rows, so each strip's
+    scan is exactly one restart interval: the header of the first strip
+    (with the full height and a DRI segment) is followed by the strips'
+    entropy-coded data separated by RST markers. Progressive mode and
+    optimized Huffman tables are per-image, so strips use standard tables.
+    """
+    def __init__(self, output, width, height, rows, settings):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.rows = rows
+        self.settings = {key: value for key, value in settings.items()
+                         if key not in ('progressive', 'progression', 'optimize')}
+        subsampling = self.settings.get('subsampling', -1)
+        subsampling = JPEG_SUBSAMPLING.get(subsampling, subsampling)
+        self.settings['subsampling'] = 2 if subsampling == -1 else subsampling
+        self.count = 0
+
+    def write(self, strip):
+        buffer = io.BytesIO()
+        strip.save(buffer, format='JPEG', **self.settings)
+        data = buffer.getbuffer()
+        sos, scan_start = _jpeg_scan_start(data)
+        if data[-2:] != b'\xff\xd9':
+            raise Exception("Unexpected JPEG strip trailer")
+
+        if self.count == 0:
+            self.output.write(self._header(data[:sos], strip.mode))
+            self.output.write(data[sos:scan_start])
+        else:
+            self.output.write(bytes((0xFF, 0xD0 + (self.count - 1) % 8)))
+        self.output.write(data[scan_start:-2])
+        self.count += 1
+
+    def close(self):
+        self.output.write(b'\xff\xd9')
+
+    def _header(self, header, mode):
+        header = bytearray(header)
+        position = 2
+        while position < len(header):
+            marker = header[position + 1]
+            length = struct.unpack_from('>H', header, position + 2)[0]
+            if marker in (0xC0, 0xC1):
+                struct.pack_into('>H', header, position + 5, self.height)
+            position += 2 + length
+
+        if mode == 'L':
+            mcu_width, mcu_height = 8, 8
+        else:
+            subsampling = self.settings['subsampling']
+            mcu_width = 8 if subsampling == 0 else 16
+            mcu_height = 16 if subsampling == 2 else 8
+        interval = math.ceil(self.width / mcu_width) * (self.rows // mcu_height)
+        return bytes(header) + struct.pack('>HHH', 0xFFDD, 4, interval)
+
+class _PngStripWriter:
+    """Writes strips as one PNG with a single zlib stream across all of them"""
+    def __init__(self, output, header, settings):
+        self.output = output
+        self.header = header
+        mode, channels = PNG_COLOR_TYPES[header['color_type']]
+        self.row_size = 1 + header['width'] * channels
+        self.compressor = zlib.compressobj(settings.get('compress_level', 6))
+        self.previous = None
+
+        output.write(PNG_SIGNATURE)
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', header['width'], header['height'],
+                                               8, header['color_type'], 0, 0, 0))
+        for chunk_type in PNG_PIXEL_CHUNKS:
+            if chunk_type in header['chunks']:
+                self._write_chunk(chunk_type, header['chunks'][chunk_type])
+
+    def write(self, strip):
+        from PIL import Image
+
+        # Let Pillow pick the row filters, with the previous row on top so the
+        # first row is filtered against its real neighbour, then drop that row
+        image = strip
+        if self.previous is not None:
+            image = Image.new(strip.mode, (strip.width, strip.height + 1))
+            image.paste(self.previous, (0, 0))
+            image.paste(strip, (0, 1))
+            if strip.mode == 'P':
+                image.putpalette(strip.getpalette())
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=0, bits=8)
+        buffer.seek(0)
+        filtered = zlib.decompress(b''.join(_iter_idat(buffer)))
+        if self.previous is not None:
+            filtered = filtered[self.row_size:]
+
+        self._write_idat(self.compressor.compress(filtered))
+        self.previous = strip.crop((0, strip.height - 1, strip.width, strip.height))
+
+    def close(self):
+        self._write_idat(self.compressor.flush())
+        self._write_chunk(b'IEND', b'')
+
+    def _write_idat(self, data):
+        if data:
+            self._write_chunk(b'IDAT', data)
+
+    def _write_chunk(self, chunk_type, data):
+        self.output.write(struct.pack('>I', len(data)))
+        self.output.write(chunk_type)
+        self.output.write(data)
+        self.output.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+def _read_png_header(source_file):
+    """IHDR fields and the chunks before the image data of a PNG, or None if it isn't one"""
+    with open(source_file, 'rb') as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            return None
+        chunks = {}
+        for chunk_type, length in _iter_chunks(f):
+            if chunk_type == b'IDAT':
+                break
+            chunks[chunk_type] = f.read(length)
+
+    ihdr = chunks.get(b'IHDR')
+    if ihdr is None or len(ihdr) != 13:
+        return None
+    width, height, bit_depth, color_type, compression, filter_method, interlace = struct.unpack('>IIBBBBB', ihdr)
+    return {
+        'width': width,
+        'height': height,
+        'bit_depth': bit_depth,
+        'color_type': color_type,
+        'interlace': interlace,
+        'chunks': chunks
+    }
+
+def _iter_chunks(f):
+    """Yield (type, length) of each PNG chunk with f positioned at its data"""
+    f.seek(len(PNG_SIGNATURE))
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        data_start = f.tell()
+        yield chunk_type, length
+        if chunk_type == b'IEND':
+            return
+        f.seek(data_start + length + 4)
+
+def _iter_idat(f):
+    """Yield the compressed image data of a PNG in pieces of at most READ_SIZE"""
+    for chunk_type, length in _iter_chunks(f):
+        if chunk_type != b'IDAT':
+            continue
+        remaining = length
+        while remaining:
+            data = f.read(min(remaining, READ_SIZE))
+            if not data:
+                raise Exception("Truncated PNG image data")
+            remaining -= len(data)
+            yield data
+
+def _jpeg_scan_start(data):
+    """Offsets of the SOS marker and of the entropy-coded data after it"""
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            break
+        marker = data[position + 1]
+        length = struct.unpack_from('>H', data, position + 2)[0]
+        if marker == 0xDA:
+            return position, position + 2 + length
+        position += 2 + length
+    raise Exception("JPEG strip has no scan")
@@ -0,0 +1,106 @@
+import os
+import logging
+from src.utils.ffmpeg import probe_streams, job_core_share
+from src.utils.metrics import metrics
+from src.utils.large_files import (
+    get_quality_preset,
+    FFMPEG_THREAD_COUNT,
+    X264_PRESETS,
+    AUDIO_BITRATES,
+    PROFILE_QUEUE_STEP,
+    PROFILE_MAX_QUEUE_STEPS,
+    PROFILE_LONG_DURATION
+)
+
+logger = logging.getLogger(__name__)
+
+# Codecs each container can hold as they are
+CONTAINER_CODECS = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'mpeg4', 'av1', 'vp9'},
+        'audio': {'aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus', 'flac'}
+    },
+    'mov': {
+        'video': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+        'audio': {'aac', 'mp3', 'alac', 'ac3', 'eac3', 'pcm_s16le', 'pcm_s24le', 'pcm_s16be', 'pcm_s24be'}
+    }
+}
+
+metrics.counter('gigovert_media_conversions_total', 'Media conversions by path (remux, encode, segmented)')
+
+def plan_remux(source_file, from_format, to_format):
+    """
+    FFmpeg output options that copy the source's streams into the target
+    container unchanged, or None if they have to be re-encoded
+    """
+    codecs = CONTAINER_CODECS.get(to_format)
+    if from_format not in CONTAINER_CODECS or not codecs:
+        return None
+
+    streams = probe_streams(source_file)
+    if not streams:
+        return None
+    video = [stream for stream in streams if stream.get('codec_type') == 'video']
+    audio = [stream for stream in streams if stream.get('codec_type') == 'audio']
+
+    # The first video stream and every audio stream are kept, as when encoding
+    if not video or video[0].get('codec_name') not in codecs['video']:
+        return None
+    if any(stream.get('codec_name') not in codecs['audio'] for stream in audio):
+        return None
+
+    args = ['-map', '0:v:0', '-map', '0:a?', '-c', 'copy', '-movflags', '+faststart']
+    if video[0]['codec_name'] == 'hevc':
+        # QuickTime only plays HEVC tagged hvc1
+        args.extend(['-tag:v', 'hvc1'])
+    logger.info(f"Remuxing {video[0]['codec_name']}/{','.join(s['codec_name'] for s in audio) or 'no audio'} "
+                f"from {from_format} to {to_format} without re-encoding")
+    return args
+
+def plan_profile(file_size, duration=None, queued_jobs=0, active_jobs=1, mode='balanced'):
+    """
+    Choose the encoder settings of a media job. The size preset from
+    get_quality_preset() is the starting point; speed mode and a backed-up
+    queue move to faster x264 presets (and long videos one more), quality
+    mode to a slower preset, lower CRF and higher audio bitrate. A job that
+    runs alone gets every core. The inputs are returned with the choice.
+    """
+    base = get_quality_preset(file_size)
+    preset_step, crf, bitrate_step = 0, base['video_crf'], 0
+
+    if mode == 'speed':
+        preset_step, crf = -2, crf + 2
+    elif mode == 'quality':
+        preset_step, crf, bitrate_step = 1, crf - 2, 1
+
+    if mode != 'quality':
+        preset_step -= min(queued_jobs // PROFILE_QUEUE_STEP, PROFILE_MAX_QUEUE_STEPS)
+        if duration and duration > PROFILE_LONG_DURATION:
+            preset_step -= 1
+
+    if FFMPEG_THREAD_COUNT:
+        threads = FFMPEG_THREAD_COUNT
+    elif queued_jobs == 0 and active_jobs <= 1:
+        threads = os.cpu_count() or 1
+    else:
+        threads = job_core_share()
+
+    return {
+        'mode': mode,
+        'preset': _step(X264_PRESETS, base['preset'], preset_step),
+        'crf': min(max(crf, 16), 32),
+        'audio_bitrate': _step(AUDIO_BITRATES, base['audio_bitrate'], bitrate_step),
+        'threads': threads,
+        'file_size': file_size,
+        'duration': duration,
+        'queued_jobs': queued_jobs,
+        'active_jobs': active_jobs
+    }
+
+def _step(ladder, value, steps):
+    index = ladder.index(value) if value in ladder else len(ladder) // 2
+    return ladder[min(max(index + steps, 0), len(ladder) - 1)]
+
+def record_media_path(path):
+    """Count which path a media conversion took"""
+    metrics.inc('gigovert_media_conversions_total', {'path': path})
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from src.utils.large_file_handler import link_or_copy
+from src.utils.large_files import RESULT_CACHE_SIZE_LIMIT, RESULT_CACHE_VERSION
+
+logger = logging.getLogger(__name__)
+
+class ConversionResultCache:
+    """
+    Content-addressed cache of conversion outputs.
+
+    Entries are keyed by the source content hash, the target format and the
+    encoding parameters, and are stored as hard links so a cache hit costs no
+    extra disk space or copy. The cache lives inside the outputs directory so
+    links never cross a filesystem boundary. Least recently used entries are
+    evicted once the cache grows past its byte budget; the file mtime records
+    the last use so every gunicorn process sees the same LRU order.
+    """
+    def __init__(self, cache_dir, max_bytes=RESULT_CACHE_SIZE_LIMIT):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = self._scan_total_bytes()
+
+    def make_key(self, source_hash, to_format, params=None):
+        """Build the cache key for a source/target/encoding-parameters combination"""
+        key_data = json.dumps({
+            'version': RESULT_CACHE_VERSION,
+            'source': source_hash,
+            'to': to_format,
+            'params': params or {}
+        }, sort_keys=True)
+        return hashlib.sha256(key_data.encode()).hexdigest()
+
+    def fetch(self, key, dest_path):
+        """Link a cached result to dest_path. Returns dest_path on a hit, None on a miss"""
+        cached_path = self._entry_path(key)
+        try:
+            link_or_copy(cached_path, dest_path)
+            # Record the use for LRU ordering
+            os.utime(cached_path)
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        except OSError as e:
+            logger.error(f"Failed to fetch cached result {key}: {str(e)}")
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        logger.info(f"Conversion cache hit: {key}")
+        return dest_path
+
+    def store(self, key, output_path):
+        """Add a finished conversion output to the cache and enforce the size budget"""
+        cached_path = self._entry_path(key)
+        if os.path.exists(cached_path):
+            return
+
+        temp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            link_or_copy(output_path, temp_path)
+            os.replace(temp_path, cached_path)
+            size = os.path.getsize(cached_path)
+        except OSError as e:
+            logger.error(f"Failed to cache conversion result {key}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return
+
+        with self._lock:
+            self._total_bytes += size
+            self.stats['stores'] += 1
+            over_budget = self._total_bytes > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its byte budget"""
+        with self._lock:
+            # Rescan so entries added by other processes are accounted for
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                    self.stats['evictions'] += 1
+                except FileNotFoundError:
+                    total -= size
+
+            self._total_bytes = total
+
+    def get_stats(self):
+        """Get cache statistics"""
+        return {
+            'size_bytes': self._total_bytes,
+            'max_bytes': self.max_bytes,
+            **self.stats
+        }
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _scan_total_bytes(self):
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                total += entry.stat().st_size
+        return total
+
+# Global result cache instance, kept inside the outputs directory so hard links stay on one filesystem
+result_cache = ConversionResultCache(os.path.join(os.path.dirname(__file__), '..', 'outputs', '.cache'))
@@ -0,0 +1,203 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from src.utils.ffmpeg import run_ffmpeg, probe_format, probe_keyframes, has_stream, job_core_share
+from src.utils.metrics import metrics
+from src.utils.large_files import (
+    SEGMENTED_ENCODING,
+    SEGMENT_MIN_FILE_SIZE,
+    SEGMENT_DURATION,
+    SEGMENT_FFMPEG_THREADS,
+    SEGMENT_PARALLELISM,
+    SEGMENT_MAX_ATTEMPTS
+)
+
+logger = logging.getLogger(__name__)
+
+VIDEO_FORMATS = ['mp4', 'mov']
+
+# Share of the job's progress for encoding; joining the segments takes the rest
+ENCODE_PROGRESS_SHARE = 95
+
+metrics.counter('gigovert_video_segments_total', 'Video segments by result (encoded, reused, failed)')
+
+class SegmentedVideoEncoder:
+    """
+    Encodes long videos as keyframe-aligned segments in parallel instead of
+    in one x264 process, which stops scaling beyond a few cores.
+
+    The video stream is cut at the first keyframe after every SEGMENT_DURATION
+    seconds, each segment is encoded on its own by an ffmpeg process (video
+    only), the audio is encoded once alongside them, and the parts are joined
+    with the concat demuxer without re-encoding. Finished segments are kept
+    in a per-job directory with the cut plan, so a retried job only encodes
+    the segments that are missing.
+    """
+    def __init__(self, work_root, segment_duration=SEGMENT_DURATION, threads=SEGMENT_FFMPEG_THREADS,
+                 parallelism=SEGMENT_PARALLELISM, max_attempts=SEGMENT_MAX_ATTEMPTS):
+        self.work_root = work_root
+        self.segment_duration = segment_duration
+        self.threads = threads
+        self.parallelism = parallelism or max(1, job_core_share() // threads)
+        self.max_attempts = max_attempts
+
+    def should_segment(self, source_file, from_format, to_format):
+        """Whether a conversion is worth splitting"""
+        return (SEGMENTED_ENCODING and from_format in VIDEO_FORMATS and to_format in VIDEO_FORMATS
+                and os.path.getsize(source_file) >= SEGMENT_MIN_FILE_SIZE)
+
+    def encode(self, source_file, output_file, output_args, progress_callback=None):
+        """Encode in segments; returns the output file, or None if the video is too short to split"""
+        work_dir = os.path.join(self.work_root, f"{os.path.basename(output_file)}.segments")
+        plan = self._load_plan(work_dir, source_file, output_args)
+        if plan is None:
+            plan = self._make_plan(source_file, output_args)
+            if plan is None:
+                return None
+            shutil.rmtree(work_dir, ignore_errors=True)
+            os.makedirs(work_dir)
+            self._save_plan(work_dir, plan)
+
+        self._encode_parts(work_dir, plan, progress_callback)
+        self._concat(work_dir, plan, output_file)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        if progress_callback:
+            progress_callback(100)
+        return output_file if os.path.exists(output_file) else None
+
+    def _make_plan(self, source_file, output_args):
+        duration, start_time = probe_format(source_file)
+        if not duration:
+            return None
+
+        # Seeks are relative to the file's start time
+        keyframes = [time - start_time for time in probe_keyframes(source_file)]
+        cuts = [0.0]
+        for time in keyframes:
+            # Don't leave a tiny last segment
+            if time - cuts[-1] >= self.segment_duration and duration - time >= self.segment_duration / 2:
+                cuts.append(time)
+        if len(cuts) < 2:
+            return None
+
+        stat = os.stat(source_file)
+        return {
+            'source': os.path.abspath(source_file),
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'output_args': output_args,
+            'duration': duration,
+            'segments': [[start, end - start] for start, end in zip(cuts, cuts[1:] + [duration])],
+            'audio': has_stream(source_file, 'a')
+        }
+
+    def _load_plan(self, work_dir, source_file, output_args):
+        """The saved plan of an earlier attempt at the same conversion, if there is one"""
+        try:
+            with open(os.path.join(work_dir, 'plan.json')) as f:
+                plan = json.load(f)
+        except (OSError, ValueError):
+            return None
+        stat = os.stat(source_file)
+        if (plan.get('source') != os.path.abspath(source_file) or plan.get('source_size') != stat.st_size
+                or plan.get('source_mtime') != stat.st_mtime or plan.get('output_args') != output_args):
+            return None
+        return plan
+
+    def _save_plan(self, work_dir, plan):
+        temp_path = os.path.join(work_dir, 'plan.json.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(plan, f)
+        os.replace(temp_path, os.path.join(work_dir, 'plan.json'))
+
+    def _encode_parts(self, work_dir, plan, progress_callback):
+        segments = plan['segments']
+        done_seconds = [0.0] * len(segments)
+        lock = threading.Lock()
+
+        def encode_segment(index):
+            start, length = segments[index]
+            path = _segment_path(work_dir, index)
+            is_last = index == len(segments) - 1
+            cmd = ['ffmpeg', '-y', '-ss', f"{start:.6f}", '-i', plan['source']]
+            if not is_last:
+                cmd.extend(['-t', f"{length:.6f}"])
+            cmd.extend(['-map', '0:v:0', '-an', '-sn', '-dn'])
+            cmd.extend(plan['output_args'])
+            cmd.extend(['-threads', str(self.threads), '-f', 'mp4', f"{path}.part"])
+
+            def on_time(seconds):
+                with lock:
+                    done_seconds[index] = length if seconds is None else min(seconds, length)
+
+            self._run_with_retries(cmd, f"{path}.part", path, on_time, f"segment {index + 1}/{len(segments)}")
+            metrics.inc('gigovert_video_segments_total', {'result': 'encoded'})
+
+        def encode_audio():
+            path = os.path.join(work_dir, 'audio.m4a')
+            cmd = ['ffmpeg', '-y', '-i', plan['source'], '-map', '0:a:0', '-vn', '-sn', '-dn']
+            cmd.extend(plan['output_args'])
+            cmd.extend(['-f', 'mp4', f"{path}.part"])
+            self._run_with_retries(cmd, f"{path}.part", path, None, 'audio')
+
+        tasks = []
+        for index in range(len(segments)):
+            if os.path.exists(_segment_path(work_dir, index)):
+                done_seconds[index] = segments[index][1]
+                metrics.inc('gigovert_video_segments_total', {'result': 'reused'})
+            else:
+                tasks.append((encode_segment, index))
+        if plan['audio'] and not os.path.exists(os.path.join(work_dir, 'audio.m4a')):
+            tasks.append((encode_audio,))
+        logger.info(f"Encoding {len(tasks)} parts of {os.path.basename(plan['source'])} "
+                    f"({len(segments)} segments, {self.parallelism} at once)")
+
+        executor = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix='video-segment')
+        try:
+            pending = {executor.submit(*task) for task in tasks}
+            # Progress is reported from this thread: the callback writes to the job's database session
+            while pending:
+                finished, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    future.result()
+                if progress_callback:
+                    with lock:
+                        encoded = sum(done_seconds)
+                    progress_callback(encoded / plan['duration'] * ENCODE_PROGRESS_SHARE)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run_with_retries(self, cmd, part_path, final_path, on_time, label):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                run_ffmpeg(cmd, on_time=on_time)
+                # Only complete parts get their final name, so they can be trusted on a retry
+                os.replace(part_path, final_path)
+                return
+            except Exception as e:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                if attempt == self.max_attempts:
+                    metrics.inc('gigovert_video_segments_total', {'result': 'failed'})
+                    raise Exception(f"Encoding {label} failed: {str(e)}")
+                logger.warning(f"Encoding {label} failed (attempt {attempt}), retrying: {str(e)}")
+
+    def _concat(self, work_dir, plan, output_file):
+        list_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            for index in range(len(plan['segments'])):
+                path = os.path.abspath(_segment_path(work_dir, index)).replace("'", "'\\''")
+                f.write(f"file '{path}'\n")
+
+        cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if plan['audio']:
+            cmd.extend(['-i', os.path.join(work_dir, 'audio.m4a'), '-map', '0:v:0', '-map', '1:a:0'])
+        cmd.extend(['-c', 'copy', '-movflags', '+faststart', output_file])
+        run_ffmpeg(cmd)
+
+def _segment_path(work_dir, index):
+    return os.path.join(work_dir, f"segment_{index:05d}.mp4")
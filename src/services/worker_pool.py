@@ -0,0 +1,257 @@
+import threading
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_, or_, not_
+from src.models.job import Job, db
+from src.utils.status_cache import job_status_cache
+from src.utils.job_events import shared_job_versions
+from src.services.conversion_service import ConversionService
+from src.services.image_pool import image_pool, IMAGE_FORMATS
+from src.utils.large_files import (
+    CONCURRENT_CONVERSIONS_LIMIT,
+    IMAGE_CONVERSION_WORKERS,
+    IMAGE_CONCURRENT_CONVERSIONS_LIMIT,
+    BATCH_MAX_LANE_SHARE,
+    JOB_POLL_INTERVAL,
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_STALE_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+class ConversionWorkerPool:
+    """
+    Fixed-size pool of conversion workers fed from the jobs table.
+
+    The jobs table is the queue: workers claim the oldest 'queued' job with a
+    conditional UPDATE, so several gunicorn processes can share one queue and the
+    number of 'processing' jobs never exceeds the concurrency limit.
+
+    Image jobs have their own lane: separate workers and a separate, higher
+    limit, since the actual work runs in the image process pool. A flood of
+    small images therefore neither waits behind nor blocks large media jobs.
+
+    The jobs of a batch share the batch's creation time, so the batch takes one
+    position in the queue and runs as a unit, but it never holds more than
+    BATCH_MAX_LANE_SHARE of a lane's slots while other jobs are waiting.
+    """
+    def __init__(self, size=CONCURRENT_CONVERSIONS_LIMIT, poll_interval=JOB_POLL_INTERVAL,
+                 image_workers=IMAGE_CONVERSION_WORKERS):
+        self.app = None
+        self.service = None
+        self.size = size
+        self.image_workers = image_workers
+        self.lanes = {
+            'default': {'workers': size, 'limit': CONCURRENT_CONVERSIONS_LIMIT, 'image_jobs': False},
+            'image': {'workers': image_workers, 'limit': IMAGE_CONCURRENT_CONVERSIONS_LIMIT, 'image_jobs': True}
+        }
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Condition()
+        self._active_jobs = set()
+        self._active_lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+        self.stats = {
+            'claimed_jobs': 0,
+            'finished_jobs': 0,
+            'recovered_jobs': 0
+        }
+
+    def init_app(self, app):
+        """Bind the pool to a Flask app and start the workers"""
+        self.app = app
+        self.service = ConversionService(app)
+        self.start()
+
+    def start(self):
+        """Recover orphaned jobs and start the worker and heartbeat threads"""
+        if self._threads:
+            return
+
+        with self.app.app_context():
+            self.recover_orphaned_jobs()
+
+        for lane_name, lane in self.lanes.items():
+            for i in range(lane['workers']):
+                thread = threading.Thread(target=self._worker_loop, args=(lane,),
+                                          name=f"conversion-worker-{lane_name}-{i}")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="conversion-heartbeat")
+        heartbeat.daemon = True
+        heartbeat.start()
+        self._threads.append(heartbeat)
+
+        logger.info(f"Started conversion worker pool with {self.size} workers "
+                    f"and {self.image_workers} image workers")
+
+    def stop(self):
+        """Ask the workers to exit after their current job"""
+        self._stopping.set()
+        self.notify()
+
+    def submit(self, job_id):
+        """Wake a worker for a job that has just been queued in the database"""
+        self.notify()
+
+    def notify(self):
+        """Wake idle workers so they check the queue immediately"""
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def get_stats(self):
+        """Get pool statistics"""
+        with self._active_lock:
+            active = len(self._active_jobs)
+
+        return {
+            'workers': self.size,
+            'image_workers': self.image_workers,
+            'active_jobs': active,
+            'idle_workers': self.size + self.image_workers - active,
+            'image_pool': image_pool.get_stats(),
+            **self.stats
+        }
+
+    def lane_load(self, image_jobs=False):
+        """(queued, processing) job counts of the image lane or of the default lane"""
+        lane_filter = _image_job_filter() if image_jobs else not_(_image_job_filter())
+        rows = (db.session.query(Job.status, func.count(Job.job_id))
+                .filter(lane_filter, Job.status.in_(['queued', 'processing']))
+                .group_by(Job.status).all())
+        counts = dict(rows)
+        return counts.get('queued', 0), counts.get('processing', 0)
+
+    def recover_orphaned_jobs(self):
+        """
+        Requeue 'processing' jobs whose worker stopped sending heartbeats
+        (e.g. the process was restarted mid-conversion). 'queued' jobs need no
+        recovery since they are still in the table and get claimed normally.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_TIMEOUT)
+
+        with self._active_lock:
+            active = list(self._active_jobs)
+
+        query = Job.query.filter(Job.status == 'processing', Job.updated_at < cutoff)
+        if active:
+            query = query.filter(Job.job_id.notin_(active))
+
+        orphaned = [job_id for (job_id,) in query.with_entities(Job.job_id).all()]
+        recovered = 0
+        if orphaned:
+            recovered = query.filter(Job.job_id.in_(orphaned)).update(
+                {'status': 'queued', 'progress': 0, 'updated_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+            for job_id in orphaned:
+                shared_job_versions.bump(job_id)
+
+        if recovered:
+            self.stats['recovered_jobs'] += recovered
+            logger.warning(f"Requeued {recovered} orphaned conversion job(s)")
+        return recovered
+
+    def _claim_next_job(self, lane):
+        """Atomically move the lane's oldest queued job to 'processing', respecting its concurrency limits"""
+        lane_filter = _image_job_filter() if lane['image_jobs'] else not_(_image_job_filter())
+        group_limit = max(1, int(lane['limit'] * BATCH_MAX_LANE_SHARE))
+
+        busy_groups = (db.session.query(Job.group_id)
+                       .filter(Job.status == 'processing', Job.group_id.isnot(None), lane_filter)
+                       .group_by(Job.group_id)
+                       .having(func.count(Job.job_id) >= group_limit))
+        queued = (Job.query
+                  .with_entities(Job.job_id, Job.group_id)
+                  .filter(Job.status == 'queued', lane_filter)
+                  .order_by(Job.created_at))
+        candidates = (queued
+                      .filter(or_(Job.group_id.is_(None), Job.group_id.notin_(busy_groups)))
+                      .limit(lane['workers'])
+                      .all())
+        limit_groups = bool(candidates)
+        if not candidates:
+            # Only batches at their share are waiting: let them use the free slots
+            candidates = queued.limit(lane['workers']).all()
+
+        processing_count = (db.session.query(func.count(Job.job_id))
+                            .filter(Job.status == 'processing', lane_filter)
+                            .scalar_subquery())
+
+        for job_id, group_id in candidates:
+            conditions = [Job.job_id == job_id, Job.status == 'queued', processing_count < lane['limit']]
+            if group_id is not None and limit_groups:
+                group_processing_count = (db.session.query(func.count(Job.job_id))
+                                          .filter(Job.status == 'processing', Job.group_id == group_id)
+                                          .scalar_subquery())
+                conditions.append(group_processing_count < group_limit)
+
+            claimed = (Job.query
+                       .filter(*conditions)
+                       .update({'status': 'processing', 'updated_at': datetime.utcnow()},
+                               synchronize_session=False))
+            db.session.commit()
+
+            if claimed:
+                self.stats['claimed_jobs'] += 1
+                job_status_cache.invalidate(job_id)
+                shared_job_versions.bump(job_id)
+                return job_id
+
+        return None
+
+    def _worker_loop(self, lane):
+        """Claim and process jobs of one lane until the pool is stopped"""
+        while not self._stopping.is_set():
+            job_id = None
+            try:
+                with self.app.app_context():
+                    job_id = self._claim_next_job(lane)
+            except Exception as e:
+                logger.error(f"Failed to claim conversion job: {str(e)}")
+
+            if not job_id:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            with self._active_lock:
+                self._active_jobs.add(job_id)
+            try:
+                self.service._process_conversion(job_id)
+            except Exception as e:
+                logger.error(f"Conversion worker crashed on job {job_id}: {str(e)}")
+            finally:
+                with self._active_lock:
+                    self._active_jobs.discard(job_id)
+                self.stats['finished_jobs'] += 1
+                # A slot has been freed up - let idle workers claim the next job
+                self.notify()
+
+    def _heartbeat_loop(self):
+        """Touch active jobs so other processes don't treat them as orphaned"""
+        while not self._stopping.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self.app.app_context():
+                    with self._active_lock:
+                        active = list(self._active_jobs)
+
+                    if active:
+                        Job.query.filter(Job.job_id.in_(active), Job.status == 'processing').update(
+                            {'updated_at': datetime.utcnow()},
+                            synchronize_session=False
+                        )
+                        db.session.commit()
+
+                    self.recover_orphaned_jobs()
+            except Exception as e:
+                logger.error(f"Conversion heartbeat failed: {str(e)}")
+
+def _image_job_filter():
+    return and_(Job.from_format.in_(IMAGE_FORMATS), Job.to_format.in_(IMAGE_FORMATS))
+
+# Global worker pool instance
+conversion_pool = ConversionWorkerPool()
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import logging
+from src.utils.large_files import YOUTUBE_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+class _InFlightDownload:
+    def __init__(self):
+        self.done = threading.Event()
+        self.path = None
+        self.error = None
+
+class YouTubeDownloadCache:
+    """
+    Coalesces concurrent YouTube conversions and keeps finished ones for a TTL.
+
+    Jobs asking for the same video, format and encoding mode share a single
+    download and encode: within a process the first caller converts while the
+    others wait on it,
+    and across gunicorn processes a per-key file lock makes the later process
+    wait and then pick the result up from the cache.
+    """
+    def __init__(self, cache_dir, ttl=YOUTUBE_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_or_download(self, key, download):
+        """
+        Return the cached file for key, downloading it at most once.
+
+        download(output_prefix) must fetch the media to a path starting with
+        output_prefix and return that path.
+        """
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = _InFlightDownload()
+                self._in_flight[key] = in_flight
+
+        if not leader:
+            self.stats['coalesced'] += 1
+            in_flight.done.wait()
+            if in_flight.error:
+                raise in_flight.error
+            return in_flight.path
+
+        try:
+            in_flight.path = self._get_or_download_locked(key, download)
+            return in_flight.path
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    def lookup(self, key):
+        """Get the cached file for key if it is still fresh"""
+        manifest_path = self._manifest_path(key)
+        try:
+            with open(manifest_path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        path = os.path.join(self.cache_dir, entry['filename'])
+        if time.time() - entry['downloaded_at'] > self.ttl or not os.path.exists(path):
+            self._remove(key, entry)
+            return None
+        return path
+
+    def purge_expired(self):
+        """Remove all cache entries older than the TTL"""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                self.lookup(name[:-len('.json')])
+
+    def get_stats(self):
+        """Get cache statistics"""
+        return dict(self.stats)
+
+    def _get_or_download_locked(self, key, download):
+        # Serialize downloads of the same key across processes
+        with open(os.path.join(self.cache_dir, f"{key}.lock"), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                cached = self.lookup(key)
+                if cached:
+                    self.stats['hits'] += 1
+                    return cached
+
+                self.stats['misses'] += 1
+                path = download(os.path.join(self.cache_dir, key))
+                self._write_manifest(key, path)
+                return path
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_manifest(self, key, path):
+        manifest_path = self._manifest_path(key)
+        temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'filename': os.path.basename(path), 'downloaded_at': time.time()}, f)
+        os.replace(temp_path, manifest_path)
+
+    def _remove(self, key, entry):
+        for path in (self._manifest_path(key), os.path.join(self.cache_dir, entry['filename'])):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _manifest_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+# Global YouTube download cache, kept inside the outputs directory so jobs can hard link from it
+youtube_cache = YouTubeDownloadCache(os.path.join(os.path.dirname(__file__), '..', 'outputs', '.youtube'))
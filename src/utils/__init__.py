@@ -1,5 +1,5 @@
 from .logging import health_monitor
-from .validators import validate_conversion, validate_file_type, validate_youtube_url, sanitize_filename
+from .validators import validate_conversion, validate_file_type, validate_youtube_url, extract_youtube_video_id, sanitize_filename
 from .large_file_handler import LargeFileHandler
 
-__all__ = ['health_monitor', 'validate_conversion', 'validate_file_type', 'validate_youtube_url', 'sanitize_filename', 'LargeFileHandler']
+__all__ = ['health_monitor', 'validate_conversion', 'validate_file_type', 'validate_youtube_url', 'extract_youtube_video_id', 'sanitize_filename', 'LargeFileHandler']
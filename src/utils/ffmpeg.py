@@ -0,0 +1,120 @@
+import os
+import json
+import subprocess
+import tempfile
+from src.utils.process_limits import LimitedProcess, run_limited
+from src.utils.large_files import CONCURRENT_CONVERSIONS_LIMIT, LARGE_FILE_CONVERSION_TIMEOUT, FFPROBE_TIMEOUT
+
+def job_core_share():
+    """Cores available to one conversion when every worker is busy"""
+    return max(1, (os.cpu_count() or 1) // CONCURRENT_CONVERSIONS_LIMIT)
+
+def run_ffmpeg(cmd, on_time=None, timeout=LARGE_FILE_CONVERSION_TIMEOUT, stdin=None):
+    """
+    Run an ffmpeg command under the subprocess limits, calling on_time with
+    the seconds of output written so far (and None once ffmpeg reports the
+    end). Raises with ffmpeg's error output if it fails.
+
+    stdin is a pipe for an input named pipe:0; it is handed over to ffmpeg
+    and closed here, so the process writing to it notices if ffmpeg exits.
+    """
+    threads = _thread_count(cmd)
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats', '-loglevel', 'error'] + cmd[1:]
+
+    # stderr goes to a temp file so it can't fill up a pipe while we are reading progress from stdout
+    with tempfile.TemporaryFile(mode='w+') as stderr_file:
+        process = LimitedProcess(cmd, timeout, threads=threads, stdin=stdin, stdout=subprocess.PIPE,
+                                 stderr=stderr_file, text=True, bufsize=1)
+        if stdin is not None:
+            stdin.close()
+        try:
+            # Stream the key=value progress blocks as FFmpeg writes them
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'out_time_us' and on_time:
+                    try:
+                        on_time(int(value) / 1_000_000)
+                    except ValueError:
+                        pass  # FFmpeg reports N/A before the first frame is written
+                elif key == 'progress' and value == 'end' and on_time:
+                    on_time(None)
+            process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            process.stdout.close()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+
+    process.check(stderr)
+    if process.returncode != 0:
+        raise Exception(f"FFmpeg failed: {stderr}")
+
+def probe_format(source_file):
+    """(duration, start time) of a media file in seconds using ffprobe; duration is None if unknown"""
+    try:
+        result = run_limited(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration,start_time',
+             '-of', 'default=noprint_wrappers=1', source_file],
+            timeout=FFPROBE_TIMEOUT
+        )
+    except Exception:
+        return None, 0.0
+    values = dict(line.partition('=')[::2] for line in result.stdout.splitlines())
+    return _positive_float(values.get('duration')), _positive_float(values.get('start_time')) or 0.0
+
+def probe_duration(source_file):
+    """Get the media duration in seconds using ffprobe, or None if it can't be determined"""
+    return probe_format(source_file)[0]
+
+def probe_keyframes(source_file):
+    """Timestamps (seconds) of the first video stream's keyframes, read from packet flags without decoding"""
+    result = run_limited(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+         '-of', 'csv=p=0', source_file]
+    )
+    if result.returncode != 0:
+        raise Exception(f"ffprobe failed: {result.stderr.strip()}")
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+def probe_streams(source_file):
+    """ffprobe's description (codec_type, codec_name, ...) of every stream, or None if the file can't be read"""
+    try:
+        result = run_limited(
+            ['ffprobe', '-v', 'error', '-show_entries', 'stream=index,codec_type,codec_name',
+             '-of', 'json', source_file],
+            timeout=FFPROBE_TIMEOUT
+        )
+        return json.loads(result.stdout)['streams'] if result.returncode == 0 else None
+    except Exception:
+        return None
+
+def has_stream(source_file, selector):
+    """Whether ffprobe finds a stream matching the selector ('a', 'v', ...)"""
+    result = run_limited(
+        ['ffprobe', '-v', 'error', '-select_streams', selector, '-show_entries', 'stream=index',
+         '-of', 'csv=p=0', source_file],
+        timeout=FFPROBE_TIMEOUT
+    )
+    return result.returncode == 0 and bool(result.stdout.strip())
+
+def _thread_count(cmd):
+    """Threads an ffmpeg command may run: -threads sets the encoder's, decoders start one per core on their own"""
+    for index, arg in enumerate(cmd[:-1]):
+        if arg == '-threads' and cmd[index + 1].isdigit() and int(cmd[index + 1]) > 0:
+            return max(int(cmd[index + 1]), os.cpu_count() or 1)
+    return os.cpu_count() or 1
+
+def _positive_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
@@ -0,0 +1,607 @@
+import os
+import re
+import struct
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+SECTOR_SIZE = 2048
+DESCRIPTORS_START = 16
+
+# Joliet escape sequences (UCS-2 levels 1-3) of a supplementary volume descriptor
+JOLIET_ESCAPES = (b'%/@', b'%/C', b'%/E')
+
+# Largest extent of a multi-extent file: the biggest sector multiple that fits 32 bits
+MAX_EXTENT_SIZE = 0xFFFFF800
+
+FLAG_DIRECTORY = 0x02
+FLAG_MULTI_EXTENT = 0x80
+
+MAX_RECORD_SIZE = 255
+
+# SUSP indicator opening the root's system use, and the Rock Ridge extension reference
+SUSP_INDICATOR = b'SP\x07\x01\xbe\xef\x00'
+_RRIP_ID = b'RRIP_1991A'
+_RRIP_DESCRIPTOR = b'THE ROCK RIDGE INTERCHANGE PROTOCOL PROVIDES SUPPORT FOR POSIX FILE SYSTEM SEMANTICS'
+_RRIP_SOURCE = b'PLEASE CONTACT DISC PUBLISHER FOR SPECIFICATION SOURCE'
+ROCK_RIDGE_EXTENSION = (b'ER' + bytes([8 + len(_RRIP_ID) + len(_RRIP_DESCRIPTOR) + len(_RRIP_SOURCE), 1,
+                                       len(_RRIP_ID), len(_RRIP_DESCRIPTOR), len(_RRIP_SOURCE), 1])
+                        + _RRIP_ID + _RRIP_DESCRIPTOR + _RRIP_SOURCE)
+CONTINUATION_ENTRY_SIZE = 28
+NAME_CURRENT_OR_PARENT = 0x06
+
+_INVALID_D_CHARS = re.compile(r'[^A-Z0-9_]')
+_INVALID_JOLIET_CHARS = re.compile(r'[*/:;?\\\x00-\x1f]')
+
+class IsoEntry:
+    """A file or directory of an ISO image; extents are (byte offset, length) pairs"""
+    def __init__(self, path, is_dir, size, mtime, extents):
+        self.path = path
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.extents = extents
+
+class IsoReader:
+    """
+    Reads the directory tree and file data of an ISO 9660 image. Rock Ridge
+    names are used when the image has them, then Joliet names (which may be
+    shortened), then the plain ISO 9660 identifiers.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._susp_skip = 0
+        self._root, self._joliet = self._find_root()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def entries(self):
+        """All entries, directories first and files in on-disk order so the image is read sequentially"""
+        directories, files = [], []
+        pending = [('', self._root[0], self._root[1])]
+        visited = set()
+        while pending:
+            parent, location, size = pending.pop()
+            if location in visited:
+                continue
+            visited.add(location)
+            for entry in self._read_directory(parent, location, size):
+                if entry.is_dir:
+                    directories.append(entry)
+                    pending.append((entry.path, entry.extents[0][0] // SECTOR_SIZE, entry.extents[0][1]))
+                else:
+                    files.append(entry)
+        directories.sort(key=lambda entry: entry.path)
+        files.sort(key=lambda entry: entry.extents[0][0] if entry.extents else 0)
+        return directories + files
+
+    def read_chunks(self, entry, chunk_size):
+        """Yield the data of a file entry"""
+        for offset, length in entry.extents:
+            self._file.seek(offset)
+            while length > 0:
+                data = self._file.read(min(chunk_size, length))
+                if not data:
+                    raise Exception(f"ISO image ends inside {entry.path}")
+                length -= len(data)
+                yield data
+
+    def _find_root(self):
+        primary = joliet = None
+        for sector in range(DESCRIPTORS_START, DESCRIPTORS_START + 32):
+            self._file.seek(sector * SECTOR_SIZE)
+            descriptor = self._file.read(SECTOR_SIZE)
+            if len(descriptor) < SECTOR_SIZE or descriptor[1:6] != b'CD001':
+                break
+            descriptor_type = descriptor[0]
+            if descriptor_type == 255:
+                break
+            root = _parse_record(descriptor[156:190])
+            if descriptor_type == 2 and descriptor[88:91] in JOLIET_ESCAPES and joliet is None:
+                joliet = (root['location'], root['size'])
+            if descriptor_type == 1 and primary is None:
+                primary = (root['location'], root['size'])
+        if primary is None and joliet is None:
+            raise Exception("Not an ISO 9660 image")
+        if joliet is None or (primary is not None and self._find_rock_ridge(primary)):
+            return primary, False
+        return joliet, True
+
+    def _find_rock_ridge(self, root):
+        """Whether the hierarchy has Rock Ridge entries: the SUSP indicator opens its root's own record"""
+        self._file.seek(root[0] * SECTOR_SIZE)
+        data = self._file.read(SECTOR_SIZE)
+        if len(data) < 34 or data[0] < 34:
+            return False
+        system_use = _parse_record(data[:data[0]])['system_use']
+        if system_use[:2] != b'SP' or system_use[4:6] != b'\xbe\xef':
+            return False
+        # Bytes to skip at the start of every other record's system use
+        self._susp_skip = system_use[6]
+        return True
+
+    def _read_directory(self, parent, location, size):
+        self._file.seek(location * SECTOR_SIZE)
+        data = self._file.read(size)
+        position = 0
+        pending_extents = []
+        while position < len(data):
+            length = data[position]
+            if length == 0:
+                # Records don't cross sectors: continue in the next one
+                position = (position // SECTOR_SIZE + 1) * SECTOR_SIZE
+                continue
+            record = _parse_record(data[position:position + length])
+            position += length
+            if record['identifier'] in (b'\x00', b'\x01'):
+                continue
+
+            pending_extents.append((record['location'] * SECTOR_SIZE, record['size']))
+            if record['flags'] & FLAG_MULTI_EXTENT:
+                continue
+            extents, pending_extents = pending_extents, []
+
+            name = self._record_name(record)
+            path = f"{parent}/{name}" if parent else name
+            is_dir = bool(record['flags'] & FLAG_DIRECTORY)
+            yield IsoEntry(path, is_dir, sum(length for offset, length in extents), record['mtime'], extents)
+
+    def _record_name(self, record):
+        if self._joliet:
+            name = record['identifier'].decode('utf-16-be', errors='replace')
+        else:
+            name = (_rock_ridge_name(self._system_use_entries(record))
+                    or record['identifier'].decode('ascii', errors='replace'))
+        if not record['flags'] & FLAG_DIRECTORY:
+            name = name.split(';')[0]
+            if name.endswith('.'):
+                name = name[:-1]
+        return name.replace('/', '_') or '_'
+
+    def _system_use_entries(self, record):
+        """A record's SUSP entries as (signature, entry) pairs, following continuation areas"""
+        entries = []
+        data = record['system_use'][self._susp_skip:]
+        # Bounded, so a looping chain of continuation areas can't hang the reader
+        for _ in range(16):
+            continuation = None
+            for signature, entry in _susp_entries(data):
+                entries.append((signature, entry))
+                if signature == b'CE' and len(entry) >= CONTINUATION_ENTRY_SIZE:
+                    # Block, offset and length, each stored little- then big-endian
+                    continuation = struct.unpack_from('<I4xI4xI', entry, 4)
+            if continuation is None:
+                break
+            block, offset, length = continuation
+            self._file.seek(block * SECTOR_SIZE + offset)
+            data = self._file.read(length)
+        return entries
+
+class IsoWriter:
+    """
+    Writes an ISO 9660 image with Rock Ridge and Joliet names, streaming file
+    data as it is added. File data follows the volume descriptors; path
+    tables, directory records and Rock Ridge continuation areas, which need
+    every file's location, are written after the data, and the volume
+    descriptors are filled in last. Files over 4GB are stored as multi-extent
+    files.
+    """
+    def __init__(self, path, volume_id='GIGOVERT'):
+        self._file = open(path, 'wb')
+        self.volume_id = volume_id
+        self._root = _Directory('', None)
+        self._created = datetime.now(timezone.utc)
+        # System area, primary and Joliet descriptors and the terminator come first
+        self._file.write(b'\x00' * (DESCRIPTORS_START + 3) * SECTOR_SIZE)
+        self._next_sector = DESCRIPTORS_START + 3
+
+    def add_directory(self, path, mtime=None):
+        directory = self._directory(_split_path(path))
+        directory.mtime = mtime
+
+    def add_file(self, path, chunks, mtime=None):
+        """Append a file's data from an iterable of bytes"""
+        parts = _split_path(path)
+        if not parts:
+            raise Exception("Empty file name")
+        directory = self._directory(parts[:-1])
+
+        location = self._next_sector
+        size = 0
+        for data in chunks:
+            self._file.write(data)
+            size += len(data)
+        padding = -size % SECTOR_SIZE
+        if padding:
+            self._file.write(b'\x00' * padding)
+        self._next_sector += (size + padding) // SECTOR_SIZE
+
+        directory.files.append(_File(parts[-1], location if size else 0, size, mtime))
+
+    def close(self):
+        """Write the directory structures and volume descriptors"""
+        try:
+            primary = _Tree(self._root, joliet=False)
+            joliet = _Tree(self._root, joliet=True)
+
+            for tree in (primary, joliet):
+                tree.path_table_location = self._next_sector
+                self._next_sector += 2 * _sectors(tree.path_table_size)
+            for tree in (primary, joliet):
+                for directory in tree.directories:
+                    tree.locations[directory] = self._next_sector
+                    self._next_sector += tree.extent_sizes[directory] // SECTOR_SIZE
+                tree.continuation_location = self._next_sector
+                self._next_sector += _sectors(len(tree.continuation))
+
+            self._file.seek(0, os.SEEK_END)
+            for tree in (primary, joliet):
+                little, big = tree.path_tables()
+                self._file.write(_pad_sector(little))
+                self._file.write(_pad_sector(big))
+            for tree in (primary, joliet):
+                for directory in tree.directories:
+                    self._file.write(tree.directory_extent(directory))
+                self._file.write(_pad_sector(bytes(tree.continuation)))
+
+            self._file.seek(DESCRIPTORS_START * SECTOR_SIZE)
+            self._file.write(self._volume_descriptor(primary))
+            self._file.write(self._volume_descriptor(joliet))
+            self._file.write(_pad_sector(b'\xff' + b'CD001' + b'\x01'))
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _directory(self, parts):
+        directory = self._root
+        for part in parts:
+            child = directory.children.get(part)
+            if child is None:
+                child = directory.children[part] = _Directory(part, directory)
+            directory = child
+        return directory
+
+    def _volume_descriptor(self, tree):
+        identifier = _joliet_text if tree.joliet else _primary_text
+
+        descriptor = bytearray(SECTOR_SIZE)
+        descriptor[0] = 2 if tree.joliet else 1
+        descriptor[1:7] = b'CD001\x01'
+        descriptor[8:40] = identifier('LINUX', 32)
+        descriptor[40:72] = identifier(self.volume_id, 32)
+        descriptor[80:88] = _both32(self._next_sector)
+        if tree.joliet:
+            descriptor[88:91] = b'%/E'
+        descriptor[120:124] = _both16(1)
+        descriptor[124:128] = _both16(1)
+        descriptor[128:132] = _both16(SECTOR_SIZE)
+        descriptor[132:140] = _both32(tree.path_table_size)
+        descriptor[140:144] = struct.pack('<I', tree.path_table_location)
+        descriptor[148:152] = struct.pack('>I', tree.path_table_location + _sectors(tree.path_table_size))
+        descriptor[156:190] = tree.record(b'\x00', self._root, self._root.mtime)
+        for start, size in ((190, 128), (318, 128), (446, 128), (574, 128), (702, 37), (739, 37), (776, 37)):
+            descriptor[start:start + size] = identifier('', size)
+        created = self._created.strftime('%Y%m%d%H%M%S00').encode() + b'\x00'
+        descriptor[813:830] = created
+        descriptor[830:847] = created
+        descriptor[847:864] = b'0' * 16 + b'\x00'
+        descriptor[864:881] = b'0' * 16 + b'\x00'
+        descriptor[881] = 1
+        return bytes(descriptor)
+
+class _Directory:
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.files = []
+        self.mtime = None
+
+class _File:
+    def __init__(self, name, location, size, mtime):
+        self.name = name
+        self.location = location
+        self.size = size
+        self.mtime = mtime
+
+class _Tree:
+    """Identifiers, path table and directory records of the primary or the Joliet hierarchy"""
+    def __init__(self, root, joliet):
+        self.joliet = joliet
+        self.locations = {}
+        self.path_table_location = None
+        self.continuation_location = 0
+        self.identifiers = {}
+        self.directories = self._path_table_order(root)
+        # Rock Ridge entries (full names, POSIX modes) of the primary hierarchy's records; the
+        # root's extension reference doesn't fit its record and goes to the continuation area
+        self.system_use = {}
+        self.continuation = bytearray()
+        if not joliet:
+            for directory in self.directories:
+                self._lay_out_system_use(directory)
+        # Record lengths don't depend on extent sizes, so sizing can use records with placeholder sizes
+        self.extent_sizes = {}
+        self.extent_sizes = {directory: self._extent_size(directory) for directory in self.directories}
+        self.path_table_size = sum(8 + len(self._identifier(directory)) + len(self._identifier(directory)) % 2
+                                   for directory in self.directories)
+
+    def path_tables(self):
+        """Little- and big-endian path tables"""
+        numbers = {directory: number for number, directory in enumerate(self.directories, 1)}
+        little, big = bytearray(), bytearray()
+        for directory in self.directories:
+            identifier = self._identifier(directory)
+            parent = numbers[directory.parent or directory]
+            padding = b'\x00' * (len(identifier) % 2)
+            little += struct.pack('<BBIH', len(identifier), 0, self.locations[directory], parent) + identifier + padding
+            big += struct.pack('>BBIH', len(identifier), 0, self.locations[directory], parent) + identifier + padding
+        return bytes(little), bytes(big)
+
+    def directory_extent(self, directory):
+        data = bytearray()
+        for record in self._records(directory):
+            if len(data) % SECTOR_SIZE + len(record) > SECTOR_SIZE:
+                data += b'\x00' * (-len(data) % SECTOR_SIZE)
+            data += record
+        return _pad_sector(bytes(data))
+
+    def record(self, identifier, target, mtime, system_use=b''):
+        """Directory record for a directory, or for one extent of a file given as (location, size, flags)"""
+        if isinstance(target, _Directory):
+            location, size, flags = self.locations.get(target, 0), self.extent_sizes.get(target, 0), FLAG_DIRECTORY
+        else:
+            location, size, flags = target
+        # Records have an even length
+        system_use += b'\x00' * (len(system_use) % 2)
+        length = 33 + len(identifier) + (1 - len(identifier) % 2) + len(system_use)
+        return (struct.pack('<BB', length, 0) + _both32(location) + _both32(size) + _record_date(mtime)
+                + struct.pack('<BBB', flags, 0, 0) + _both16(1) + struct.pack('<B', len(identifier))
+                + identifier + b'\x00' * (1 - len(identifier) % 2) + system_use)
+
+    def _records(self, directory):
+        parent = directory.parent or directory
+        records = [self.record(b'\x00', directory, directory.mtime, self._system_use(directory, '.')),
+                   self.record(b'\x01', parent, parent.mtime, self._system_use(directory, '..'))]
+        children = [(self.identifiers[directory][child], child) for child in directory.children.values()]
+        children += [(self.identifiers[directory][file], file) for file in directory.files]
+        for identifier, child in sorted(children, key=lambda item: item[0]):
+            system_use = self._system_use(directory, child)
+            if isinstance(child, _Directory):
+                records.append(self.record(identifier, child, child.mtime, system_use))
+                continue
+            for offset in range(0, max(child.size, 1), MAX_EXTENT_SIZE):
+                size = min(MAX_EXTENT_SIZE, child.size - offset)
+                flags = FLAG_MULTI_EXTENT if offset + size < child.size else 0
+                location = child.location + offset // SECTOR_SIZE if child.size else 0
+                records.append(self.record(identifier, (location, size, flags), child.mtime, system_use))
+        return records
+
+    def _lay_out_system_use(self, directory):
+        """Rock Ridge entries of a directory's records: a mode for each, and the names of its children"""
+        own = [_rock_ridge_mode(directory)]
+        if directory.parent is None:
+            own = [SUSP_INDICATOR] + own + [ROCK_RIDGE_EXTENSION]
+        self.system_use[directory, '.'] = self._fit_system_use(1, own)
+        self.system_use[directory, '..'] = self._fit_system_use(1, [_rock_ridge_mode(directory.parent or directory)])
+        for child, identifier in self.identifiers[directory].items():
+            self.system_use[directory, child] = (self._child_system_use(len(identifier), child), None)
+
+    def _child_system_use(self, identifier_length, child):
+        """
+        Rock Ridge entries of a file or subdirectory, all kept in its record:
+        readers such as libarchive skip names in continuation areas, and only
+        follow them when they come before a file's data (written first here).
+        A long name takes the room of the mode
+        """
+        room = _system_use_room(identifier_length) - 5
+        mode = _rock_ridge_mode(child)
+        if len(child.name.encode('utf-8')) > room - len(mode):
+            mode = b''
+        return mode + _rock_ridge_name_entry(child.name, room - len(mode))
+
+    def _fit_system_use(self, identifier_length, entries):
+        """
+        Split entries into those kept in the record and those moved to the
+        continuation area, returned as (kept, (offset, length) or None)
+        """
+        room = _system_use_room(identifier_length)
+        if sum(len(entry) for entry in entries) <= room:
+            return b''.join(entries), None
+
+        kept = 0
+        used = CONTINUATION_ENTRY_SIZE
+        while used + len(entries[kept]) <= room:
+            used += len(entries[kept])
+            kept += 1
+        moved = b''.join(entries[kept:])
+        # A continuation area stays within one sector
+        if len(self.continuation) % SECTOR_SIZE + len(moved) > SECTOR_SIZE:
+            self.continuation += b'\x00' * (-len(self.continuation) % SECTOR_SIZE)
+        offset = len(self.continuation)
+        self.continuation += moved
+        return b''.join(entries[:kept]), (offset, len(moved))
+
+    def _system_use(self, directory, key):
+        kept, moved = self.system_use.get((directory, key), (b'', None))
+        if moved is None:
+            return kept
+        offset, length = moved
+        return (kept + b'CE' + bytes([CONTINUATION_ENTRY_SIZE, 1])
+                + _both32(self.continuation_location + offset // SECTOR_SIZE)
+                + _both32(offset % SECTOR_SIZE) + _both32(length))
+
+    def _extent_size(self, directory):
+        used = 0
+        for record in self._records(directory):
+            if used % SECTOR_SIZE + len(record) > SECTOR_SIZE:
+                used += -used % SECTOR_SIZE
+            used += len(record)
+        return _sectors(used) * SECTOR_SIZE
+
+    def _path_table_order(self, root):
+        """Directories breadth first, ordered by parent then identifier, assigning identifiers on the way"""
+        order = [root]
+        for directory in order:
+            self._assign_identifiers(directory)
+            children = sorted(directory.children.values(), key=lambda child: self.identifiers[directory][child])
+            order.extend(children)
+        return order
+
+    def _identifier(self, directory):
+        if directory.parent is None:
+            return b'\x00'
+        return self.identifiers[directory.parent][directory]
+
+    def _assign_identifiers(self, directory):
+        identifiers = {}
+        used = set()
+        for child in list(directory.children.values()) + directory.files:
+            is_dir = isinstance(child, _Directory)
+            identifier = _joliet_identifier(child.name, is_dir) if self.joliet else _primary_identifier(child.name, is_dir)
+            candidate, counter = identifier, 1
+            while candidate in used:
+                candidate = _unique_identifier(identifier, counter, is_dir, self.joliet)
+                counter += 1
+            used.add(candidate)
+            identifiers[child] = candidate
+        self.identifiers[directory] = identifiers
+
+def _primary_identifier(name, is_dir):
+    """ISO 9660 level 2 identifier: upper-case d-characters, at most 30 characters plus ';1' for files"""
+    if is_dir:
+        return (_INVALID_D_CHARS.sub('_', name.upper()) or '_')[:31].encode()
+    base, extension = os.path.splitext(name)
+    base = _INVALID_D_CHARS.sub('_', base.upper()) or '_'
+    extension = _INVALID_D_CHARS.sub('_', extension[1:].upper())[:8]
+    return f"{base[:29 - len(extension)]}.{extension};1".encode()
+
+def _joliet_identifier(name, is_dir):
+    """Joliet identifier: at most 64 characters, shortened before the extension (Rock Ridge keeps the full name)"""
+    name = _INVALID_JOLIET_CHARS.sub('_', name)
+    name = (name[:64] if is_dir else _shorten(name, 64, len)) or '_'
+    return (name if is_dir else f"{name};1").encode('utf-16-be')
+
+def _shorten(name, limit, length):
+    """Cut the end of a name's base until length(name) is within limit, keeping a short extension"""
+    if length(name) <= limit:
+        return name
+    base, extension = os.path.splitext(name)
+    if length(extension) > limit // 4:
+        base, extension = name, ''
+    while base and length(base + extension) > limit:
+        base = base[:-1]
+    return base + extension
+
+def _rock_ridge_mode(node):
+    """PX entry: POSIX mode and link count of a directory or file"""
+    if isinstance(node, _Directory):
+        mode, links = 0o40755, 2 + len(node.children)
+    else:
+        mode, links = 0o100644, 1
+    return b'PX' + bytes([36, 1]) + _both32(mode) + _both32(links) + _both32(0) + _both32(0)
+
+def _system_use_room(identifier_length):
+    """Bytes of system use a record with this identifier can hold (keeping its length even)"""
+    return MAX_RECORD_SIZE - 1 - (33 + identifier_length + (1 - identifier_length % 2))
+
+def _rock_ridge_name_entry(name, limit):
+    """NM entry holding a name, shortened to limit bytes if need be"""
+    shortened = _shorten(name, limit, lambda text: len(text.encode('utf-8')))
+    if shortened != name:
+        logger.warning(f"Name too long for the ISO image, stored as {shortened!r}: {name!r}")
+    data = shortened.encode('utf-8')
+    return b'NM' + bytes([5 + len(data), 1, 0]) + data
+
+def _unique_identifier(identifier, counter, is_dir, joliet):
+    """Replace the end of a clashing name's base with ~counter"""
+    encoding = 'utf-16-be' if joliet else 'ascii'
+    text = identifier.decode(encoding)
+    suffix = f"~{counter}"
+    if is_dir:
+        limit = 64 if joliet else 31
+        return (text[:limit - len(suffix)] + suffix).encode(encoding)
+    name = text[:-2]
+    base, dot, extension = name.rpartition('.')
+    if not dot:
+        base, extension = name, ''
+    base = base[:max(1, len(base) - len(suffix))] + suffix
+    return f"{base}.{extension};1".encode(encoding) if dot or not joliet else f"{base};1".encode(encoding)
+
+def _primary_text(text, size):
+    return text.upper().encode('ascii', 'replace')[:size].ljust(size, b' ')
+
+def _joliet_text(text, size):
+    return text[:size // 2].ljust(size // 2).encode('utf-16-be').ljust(size, b'\x00')
+
+def _susp_entries(system_use):
+    """(signature, entry) pairs of a system use area, up to its terminator"""
+    position = 0
+    while position + 4 <= len(system_use):
+        signature, length = system_use[position:position + 2], system_use[position + 2]
+        if length < 4 or signature == b'ST':
+            break
+        yield signature, system_use[position:position + length]
+        position += length
+
+def _rock_ridge_name(entries):
+    """Alternate name from the Rock Ridge NM entries of a record, if any"""
+    name = b''
+    for signature, entry in entries:
+        if signature == b'NM' and len(entry) > 5 and not entry[4] & NAME_CURRENT_OR_PARENT:
+            name += entry[5:]
+    return name.decode('utf-8', errors='replace') if name else None
+
+def _parse_record(record):
+    identifier_length = record[32]
+    identifier = record[33:33 + identifier_length]
+    system_use_start = 33 + identifier_length + (1 - identifier_length % 2)
+    return {
+        'location': struct.unpack_from('<I', record, 2)[0],
+        'size': struct.unpack_from('<I', record, 10)[0],
+        'mtime': _parse_record_date(record[18:25]),
+        'flags': record[25],
+        'identifier': identifier,
+        'system_use': record[system_use_start:record[0]]
+    }
+
+def _record_date(timestamp):
+    moment = datetime.fromtimestamp(timestamp or 0, timezone.utc)
+    return struct.pack('<BBBBBBb', max(moment.year - 1900, 0), moment.month, moment.day,
+                       moment.hour, moment.minute, moment.second, 0)
+
+def _parse_record_date(data):
+    year, month, day, hour, minute, second, offset = struct.unpack('<BBBBBBb', data)
+    try:
+        moment = datetime(1900 + year, month, day, hour, minute, second, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return moment.timestamp() - offset * 15 * 60
+
+def _split_path(path):
+    return [part for part in path.replace('\\', '/').split('/') if part and part not in ('.', '..')]
+
+def _both16(value):
+    return struct.pack('<H', value) + struct.pack('>H', value)
+
+def _both32(value):
+    return struct.pack('<I', value) + struct.pack('>I', value)
+
+def _sectors(size):
+    return (size + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+def _pad_sector(data):
+    return data + b'\x00' * (-len(data) % SECTOR_SIZE)
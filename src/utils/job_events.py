@@ -0,0 +1,117 @@
+import os
+import mmap
+import zlib
+import struct
+import threading
+import time
+from src.utils.large_files import JOB_VERSIONS_FILE, JOB_VERSION_SLOTS
+
+_SLOT = struct.Struct('<Q')
+
+class JobEventBus:
+    """
+    In-process publish/subscribe channel for job status changes.
+
+    Job.update_status publishes every change here so Server-Sent Event streams
+    in the same process are woken up immediately instead of polling. Changes
+    made by other processes show up in SharedJobVersions instead.
+    """
+    def __init__(self, max_jobs=10000):
+        self.max_jobs = max_jobs
+        self._condition = threading.Condition()
+        self._version = 0
+        self._latest = {}
+
+    def publish(self, job_id, status):
+        """Record the latest status of a job and wake up waiting streams"""
+        with self._condition:
+            self._version += 1
+            self._latest.pop(job_id, None)
+            self._latest[job_id] = (self._version, status)
+            # Forget the oldest jobs - streams fall back to the database for them
+            while len(self._latest) > self.max_jobs:
+                self._latest.pop(next(iter(self._latest)))
+            self._condition.notify_all()
+
+    def get_latest(self, job_id):
+        """Get (version, status) of the last published change for a job, or None"""
+        with self._condition:
+            return self._latest.get(job_id)
+
+    def wait(self, job_ids, since_version, timeout):
+        """
+        Block until one of job_ids changes after since_version or the timeout expires
+        Returns the current bus version
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if any(self._latest.get(job_id, (0,))[0] > since_version for job_id in job_ids):
+                    return self._version
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self._version
+                self._condition.wait(remaining)
+
+    @property
+    def version(self):
+        with self._condition:
+            return self._version
+
+class SharedJobVersions:
+    """
+    Change counters of jobs shared by all processes on the host.
+
+    A fixed table of uint64 slots in an mmap'd file. Every process that commits
+    a change to a job writes a new value into the job's slot; event streams
+    compare the slots of their jobs with what they saw last and re-read the
+    database only for jobs another process changed. Jobs share slots by hash,
+    so a collision only costs an extra database read.
+    """
+    def __init__(self, path=JOB_VERSIONS_FILE, slots=JOB_VERSION_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._map = None
+        self._written = {}
+
+    def bump(self, job_id):
+        """Mark a job as changed; call after the change is committed"""
+        slot = self._slot(job_id)
+        # Unique across processes: nanosecond clock in the high bits, pid in the low ones
+        value = (time.time_ns() & 0xffffffffffff) << 16 | os.getpid() & 0xffff
+        with self._lock:
+            _SLOT.pack_into(self._get_map(), slot * _SLOT.size, value)
+            self._written[slot] = value
+
+    def read(self, job_ids):
+        """Current slot values of jobs"""
+        shared = self._get_map()
+        return {job_id: _SLOT.unpack_from(shared, self._slot(job_id) * _SLOT.size)[0] for job_id in job_ids}
+
+    def changed_elsewhere(self, job_id, value):
+        """Whether a slot value was written by another process (this one publishes its own changes on the bus)"""
+        with self._lock:
+            return self._written.get(self._slot(job_id)) != value
+
+    def _slot(self, job_id):
+        # crc32 rather than hash(), which differs between processes
+        return zlib.crc32(job_id.encode()) % self.slots
+
+    def _get_map(self):
+        with self._open_lock:
+            if self._map is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a+b') as file:
+                    size = self.slots * _SLOT.size
+                    if os.fstat(file.fileno()).st_size < size:
+                        file.truncate(size)
+                    self._map = mmap.mmap(file.fileno(), size)
+            return self._map
+
+# Global job event bus instance
+job_event_bus = JobEventBus()
+
+# Global shared job versions instance
+shared_job_versions = SharedJobVersions()
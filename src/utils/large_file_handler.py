@@ -1,14 +1,47 @@
 import os
+import json
+import time
+import uuid
+import shutil
 import hashlib
 import tempfile
-from werkzeug.datastructures import FileStorage
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
 from flask import request, jsonify
 import logging
+from src.utils.validators import sanitize_filename
+from src.utils.large_files import (
+    MAX_FILE_SIZE,
+    CHUNK_SIZE,
+    UPLOAD_BUFFER_SIZE,
+    MIN_UPLOAD_CHUNK_SIZE,
+    MAX_UPLOAD_CHUNK_SIZE
+)
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on multipart parts accepted by the streaming parser
+MAX_FORM_PARTS = 32
+
+# Suffix of the sidecar file holding the MD5 computed while a file was uploaded
+HASH_SUFFIX = '.md5'
+
+def link_or_copy(src, dest):
+    """
+    Hard link src to dest (replacing dest), falling back to a copy when the
+    paths are on different filesystems
+    """
+    if os.path.exists(dest):
+        os.unlink(dest)
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if not os.path.exists(src):
+            raise FileNotFoundError(src) from e
+        shutil.copyfile(src, dest)
+
 class LargeFileHandler:
-    def __init__(self, upload_dir, chunk_size=8192):
+    def __init__(self, upload_dir, chunk_size=CHUNK_SIZE):
         self.upload_dir = upload_dir
         self.chunk_size = chunk_size
         os.makedirs(upload_dir, exist_ok=True)
@@ -25,20 +58,23 @@ class LargeFileHandler:
             with tempfile.NamedTemporaryFile(delete=False, dir=self.upload_dir) as temp_file:
                 temp_path = temp_file.name
                 
-                # Stream the file in chunks to avoid memory issues
+                # Stream the file in chunks to avoid memory issues, hashing on the way
+                hash_md5 = hashlib.md5()
                 total_size = 0
                 while True:
                     chunk = file_storage.read(self.chunk_size)
                     if not chunk:
                         break
                     temp_file.write(chunk)
+                    hash_md5.update(chunk)
                     total_size += len(chunk)
                 
-                # Move temp file to final location
-                os.rename(temp_path, file_path)
-                
-                logger.info(f"Successfully saved large file: {filename} ({total_size} bytes)")
-                return file_path
+            # Move temp file to final location
+            os.rename(temp_path, file_path)
+            self._store_file_hash(file_path, hash_md5.hexdigest())
+            
+            logger.info(f"Successfully saved large file: {filename} ({total_size} bytes)")
+            return file_path
                 
         except Exception as e:
             logger.error(f"Failed to save large file {filename}: {str(e)}")
@@ -47,6 +83,103 @@ class LargeFileHandler:
                 os.unlink(temp_path)
             raise
     
+    def save_streamed_upload(self, stream, boundary, max_size=MAX_FILE_SIZE):
+        """
+        Parse a multipart/form-data body straight from the request stream,
+        writing the first file part to the upload directory in a single pass and
+        hashing it on the way. This skips Werkzeug's spooled temp file copy.
+        Returns (form fields, file info dict or None)
+        """
+        fields, uploads = self.save_streamed_uploads(stream, boundary, max_size)
+        return fields, uploads[0] if uploads else None
+    
+    def save_streamed_uploads(self, stream, boundary, max_size=MAX_FILE_SIZE, max_files=1):
+        """
+        Like save_streamed_upload, for up to max_files file parts of at most
+        max_size bytes each; further file parts are drained and ignored.
+        Returns (form fields, list of file info dicts)
+        """
+        decoder = MultipartDecoder(boundary.encode(), max_parts=MAX_FORM_PARTS + max_files)
+        fields = MultiDict()
+        uploads = []
+        upload = None
+        current_field = None
+        field_data = []
+        temp_path = None
+        temp_file = None
+        hash_md5 = None
+        total_size = 0
+        
+        try:
+            while True:
+                event = decoder.next_event()
+                
+                if isinstance(event, NeedData):
+                    decoder.receive_data(stream.read(self.chunk_size) or None)
+                
+                elif isinstance(event, File) and len(uploads) < max_files and event.filename:
+                    upload = {'field': event.name, 'filename': sanitize_filename(event.filename) or 'upload'}
+                    temp_file = tempfile.NamedTemporaryFile(delete=False, dir=self.upload_dir,
+                                                            buffering=self.chunk_size)
+                    temp_path = temp_file.name
+                    hash_md5 = hashlib.md5()
+                    total_size = 0
+                    current_field = None
+                
+                elif isinstance(event, (Field, File)):
+                    # Extra file parts are drained and ignored
+                    upload = None
+                    current_field = event.name if isinstance(event, Field) else None
+                    field_data = []
+                
+                elif isinstance(event, Data):
+                    if upload is not None:
+                        total_size += len(event.data)
+                        if total_size > max_size:
+                            raise ValueError(f"File too large. Maximum size is {max_size} bytes.")
+                        temp_file.write(event.data)
+                        hash_md5.update(event.data)
+                        if not event.more_data:
+                            temp_file.close()
+                            uploads.append(self._finish_streamed_upload(upload, temp_path, total_size, hash_md5))
+                            upload = None
+                            temp_path = None
+                    elif current_field is not None:
+                        field_data.append(event.data)
+                        if sum(len(part) for part in field_data) > UPLOAD_BUFFER_SIZE:
+                            raise ValueError(f"Form field {current_field} is too large")
+                        if not event.more_data:
+                            fields.add(current_field, b''.join(field_data).decode('utf-8', 'replace'))
+                            current_field = None
+                
+                elif isinstance(event, Epilogue):
+                    break
+            
+            if upload is not None:
+                raise ValueError('Upload ended before the file was complete')
+            
+            return fields, uploads
+        
+        except Exception as e:
+            logger.error(f"Failed to stream upload: {str(e)}")
+            if temp_file is not None and not temp_file.closed:
+                temp_file.close()
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+            for saved in uploads:
+                self.cleanup_file(saved['path'])
+            raise
+    
+    def _finish_streamed_upload(self, upload, temp_path, total_size, hash_md5):
+        """Move a completely received file part to its final name"""
+        file_path = os.path.join(self.upload_dir, f"{uuid.uuid4()}_{upload['filename']}")
+        os.rename(temp_path, file_path)
+        upload.update({'path': file_path, 'size': total_size, 'md5': hash_md5.hexdigest()})
+        self._store_file_hash(file_path, upload['md5'])
+        
+        logger.info(f"Successfully streamed upload: {upload['filename']} ({total_size} bytes)")
+        return upload
+    
     def validate_large_file(self, file_storage: FileStorage, max_size: int) -> bool:
         """
         Validate file size without loading entire file into memory
@@ -74,8 +207,13 @@ class LargeFileHandler:
     
     def get_file_hash(self, file_path: str) -> str:
         """
-        Calculate MD5 hash of a large file efficiently
+        Calculate MD5 hash of a large file efficiently, reusing the hash recorded
+        when the file was uploaded if there is one
         """
+        cached_hash = self._load_file_hash(file_path)
+        if cached_hash:
+            return cached_hash
+        
         hash_md5 = hashlib.md5()
         try:
             with open(file_path, "rb") as f:
@@ -94,87 +232,219 @@ class LargeFileHandler:
             if os.path.exists(file_path):
                 os.unlink(file_path)
                 logger.info(f"Cleaned up file: {file_path}")
+            if os.path.exists(file_path + HASH_SUFFIX):
+                os.unlink(file_path + HASH_SUFFIX)
         except Exception as e:
             logger.error(f"Failed to cleanup file {file_path}: {str(e)}")
+    
+    def _store_file_hash(self, file_path, file_hash):
+        """Record a hash computed during upload next to the file"""
+        try:
+            with open(file_path + HASH_SUFFIX, 'w') as f:
+                f.write(file_hash)
+        except OSError as e:
+            logger.error(f"Failed to store file hash for {file_path}: {str(e)}")
+    
+    def _load_file_hash(self, file_path):
+        """Get the recorded hash if it is newer than the file itself"""
+        hash_path = file_path + HASH_SUFFIX
+        try:
+            if os.path.getmtime(hash_path) < os.path.getmtime(file_path):
+                return None
+            with open(hash_path) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
 
 class ChunkedUploadManager:
     """
-    Manages chunked uploads for very large files
+    Manages resumable chunked uploads for very large files.
+
+    The target file is preallocated when the upload starts and every chunk is
+    written straight to its offset, so chunks can arrive out of order and in
+    parallel and no assembly pass is needed. Received chunks are tracked in a
+    one-byte-per-chunk bitmap file, which lets any gunicorn worker accept any
+    chunk and report which chunks are still missing.
     """
-    def __init__(self, upload_dir):
+    def __init__(self, upload_dir, buffer_size=UPLOAD_BUFFER_SIZE):
         self.upload_dir = upload_dir
         self.chunks_dir = os.path.join(upload_dir, 'chunks')
+        self.buffer_size = buffer_size
         os.makedirs(self.chunks_dir, exist_ok=True)
     
-    def handle_chunk(self, chunk_data, chunk_number, total_chunks, upload_id):
+    def init_upload(self, filename, total_size, chunk_size=CHUNK_SIZE):
         """
-        Handle a single chunk of a large file upload
+        Start a new chunked upload and preallocate its target file
+        Returns the upload manifest
         """
+        if total_size <= 0 or total_size > MAX_FILE_SIZE:
+            raise ValueError(f"Upload size must be between 1 byte and {MAX_FILE_SIZE} bytes")
+        if chunk_size < MIN_UPLOAD_CHUNK_SIZE or chunk_size > MAX_UPLOAD_CHUNK_SIZE:
+            raise ValueError(f"Chunk size must be between {MIN_UPLOAD_CHUNK_SIZE} and {MAX_UPLOAD_CHUNK_SIZE} bytes")
+        
+        upload_id = str(uuid.uuid4())
+        manifest = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'total_size': total_size,
+            'chunk_size': chunk_size,
+            'total_chunks': (total_size + chunk_size - 1) // chunk_size,
+            'created_at': time.time()
+        }
+        
+        upload_dir = self._upload_state_dir(upload_id)
+        os.makedirs(upload_dir)
         try:
-            chunk_filename = f"{upload_id}_chunk_{chunk_number}"
-            chunk_path = os.path.join(self.chunks_dir, chunk_filename)
-            
-            with open(chunk_path, 'wb') as f:
-                f.write(chunk_data)
-            
-            # Check if all chunks are uploaded
-            if self._all_chunks_uploaded(upload_id, total_chunks):
-                return self._assemble_chunks(upload_id, total_chunks)
-            
-            return None
+            # Reserve the disk space up front so the upload can't fail half way on a full disk
+            fd = os.open(self._part_path(upload_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                try:
+                    os.posix_fallocate(fd, 0, total_size)
+                except (AttributeError, OSError):
+                    os.ftruncate(fd, total_size)
+            finally:
+                os.close(fd)
             
-        except Exception as e:
-            logger.error(f"Failed to handle chunk {chunk_number}: {str(e)}")
+            with open(os.path.join(upload_dir, 'received'), 'wb') as f:
+                f.truncate(manifest['total_chunks'])
+            self._write_manifest(upload_id, manifest)
+        except Exception:
+            self.abort_upload(upload_id)
             raise
+        
+        logger.info(f"Started chunked upload {upload_id}: {filename} ({total_size} bytes, {manifest['total_chunks']} chunks)")
+        return manifest
     
-    def _all_chunks_uploaded(self, upload_id, total_chunks):
+    def write_chunk(self, upload_id, chunk_number, stream, checksum=None):
         """
-        Check if all chunks for an upload are present
-        """
-        for i in range(total_chunks):
-            chunk_filename = f"{upload_id}_chunk_{i}"
-            chunk_path = os.path.join(self.chunks_dir, chunk_filename)
-            if not os.path.exists(chunk_path):
-                return False
-        return True
-    
-    def _assemble_chunks(self, upload_id, total_chunks):
-        """
-        Assemble all chunks into a single file
+        Stream one chunk from a file-like object to its offset in the target file,
+        verifying its SHA-256 checksum if one is given
+        Returns the list of chunks that are still missing
         """
+        manifest = self.get_manifest(upload_id)
+        if manifest.get('completed_path'):
+            raise ValueError(f"Upload {upload_id} is already complete")
+        if chunk_number < 0 or chunk_number >= manifest['total_chunks']:
+            raise ValueError(f"Chunk number must be between 0 and {manifest['total_chunks'] - 1}")
+        
+        offset = chunk_number * manifest['chunk_size']
+        expected_size = min(manifest['chunk_size'], manifest['total_size'] - offset)
+        
+        # A re-sent chunk overwrites data that was already accepted: mark it missing
+        # (durably) first, so a bad re-send leaves it to be sent again instead of
+        # counting as received with the bad bytes in place
+        self._mark_received(upload_id, chunk_number, False)
+        
+        chunk_hash = hashlib.sha256()
+        written = 0
+        fd = os.open(self._part_path(upload_id), os.O_WRONLY)
         try:
-            final_filename = f"{upload_id}_assembled"
-            final_path = os.path.join(self.upload_dir, final_filename)
+            while written < expected_size:
+                data = stream.read(min(self.buffer_size, expected_size - written))
+                if not data:
+                    break
+                chunk_hash.update(data)
+                os.pwrite(fd, data, offset + written)
+                written += len(data)
             
-            with open(final_path, 'wb') as final_file:
-                for i in range(total_chunks):
-                    chunk_filename = f"{upload_id}_chunk_{i}"
-                    chunk_path = os.path.join(self.chunks_dir, chunk_filename)
-                    
-                    with open(chunk_path, 'rb') as chunk_file:
-                        final_file.write(chunk_file.read())
-                    
-                    # Clean up chunk file
-                    os.unlink(chunk_path)
+            if written != expected_size or stream.read(1):
+                raise ValueError(f"Chunk {chunk_number} must be exactly {expected_size} bytes")
+            if checksum and checksum.lower() != chunk_hash.hexdigest():
+                raise ValueError(f"Checksum mismatch for chunk {chunk_number}")
             
-            logger.info(f"Successfully assembled file: {final_filename}")
-            return final_path
-            
-        except Exception as e:
-            logger.error(f"Failed to assemble chunks for {upload_id}: {str(e)}")
-            # Clean up partial chunks
-            self._cleanup_chunks(upload_id, total_chunks)
-            raise
+            os.fdatasync(fd)
+        finally:
+            os.close(fd)
+        
+        # Mark the chunk as received only once its data is verified and safely on disk
+        self._mark_received(upload_id, chunk_number, True)
+        
+        return self.missing_chunks(upload_id)
+    
+    def _mark_received(self, upload_id, chunk_number, received):
+        """Set or clear a chunk's flag in the received bitmap and flush it to disk"""
+        received_fd = os.open(os.path.join(self._upload_state_dir(upload_id), 'received'), os.O_WRONLY)
+        try:
+            os.pwrite(received_fd, b'\x01' if received else b'\x00', chunk_number)
+            os.fdatasync(received_fd)
+        finally:
+            os.close(received_fd)
     
-    def _cleanup_chunks(self, upload_id, total_chunks):
+    def missing_chunks(self, upload_id):
+        """List the chunk numbers that have not been received yet"""
+        with open(os.path.join(self._upload_state_dir(upload_id), 'received'), 'rb') as f:
+            received = f.read()
+        return [i for i, flag in enumerate(received) if not flag]
+    
+    def get_manifest(self, upload_id):
+        """Load the manifest of an upload, raising KeyError if it doesn't exist"""
+        if not self._is_valid_upload_id(upload_id):
+            raise KeyError(upload_id)
+        try:
+            with open(os.path.join(self._upload_state_dir(upload_id), 'manifest.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+    
+    def complete_upload(self, upload_id):
         """
-        Clean up chunk files
+        Finish an upload once every chunk has arrived. Safe to call repeatedly
+        Returns the path to the uploaded file
         """
-        for i in range(total_chunks):
-            chunk_filename = f"{upload_id}_chunk_{i}"
-            chunk_path = os.path.join(self.chunks_dir, chunk_filename)
-            if os.path.exists(chunk_path):
-                try:
-                    os.unlink(chunk_path)
-                except Exception as e:
-                    logger.error(f"Failed to cleanup chunk {chunk_path}: {str(e)}")
+        manifest = self.get_manifest(upload_id)
+        if manifest.get('completed_path'):
+            return manifest['completed_path']
+        
+        missing = self.missing_chunks(upload_id)
+        if missing:
+            raise ValueError(f"Upload {upload_id} is missing {len(missing)} chunk(s)")
+        
+        final_path = os.path.join(self.upload_dir, f"{upload_id}_{manifest['filename']}")
+        os.rename(self._part_path(upload_id), final_path)
+        
+        manifest['completed_path'] = final_path
+        self._write_manifest(upload_id, manifest)
+        
+        logger.info(f"Completed chunked upload {upload_id}: {final_path}")
+        return final_path
+    
+    def release_upload(self, upload_id):
+        """Forget a completed upload once its file has been handed to a conversion job"""
+        self._cleanup_upload_state(upload_id)
+    
+    def abort_upload(self, upload_id):
+        """Remove a partial upload and its state"""
+        if not self._is_valid_upload_id(upload_id):
+            return
+        part_path = self._part_path(upload_id)
+        if os.path.exists(part_path):
+            try:
+                os.unlink(part_path)
+            except Exception as e:
+                logger.error(f"Failed to cleanup partial upload {part_path}: {str(e)}")
+        self._cleanup_upload_state(upload_id)
+    
+    def _cleanup_upload_state(self, upload_id):
+        """
+        Clean up the manifest and chunk bitmap
+        """
+        shutil.rmtree(self._upload_state_dir(upload_id), ignore_errors=True)
+    
+    def _write_manifest(self, upload_id, manifest):
+        manifest_path = os.path.join(self._upload_state_dir(upload_id), 'manifest.json')
+        temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, manifest_path)
+    
+    def _upload_state_dir(self, upload_id):
+        return os.path.join(self.chunks_dir, upload_id)
+    
+    def _part_path(self, upload_id):
+        return os.path.join(self.upload_dir, f"{upload_id}.part")
+    
+    def _is_valid_upload_id(self, upload_id):
+        try:
+            return str(uuid.UUID(upload_id)) == upload_id
+        except (ValueError, TypeError):
+            return False
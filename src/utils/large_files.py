@@ -1,41 +1,166 @@
 """
 Configuration for handling large files (up to 40GB)
 """
+import os
 
 # File size limits
 MAX_FILE_SIZE = 40 * 1024 * 1024 * 1024  # 40GB
 CHUNK_SIZE = 8 * 1024 * 1024  # 8MB chunks for streaming
 UPLOAD_BUFFER_SIZE = 1024 * 1024  # 1MB buffer
+STREAMING_UPLOADS = True  # Parse /convert uploads straight from the request stream
+MIN_UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB smallest chunk for chunked uploads
+MAX_UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024  # 64MB largest chunk for chunked uploads
 
 # Timeout settings for large file operations
 LARGE_FILE_UPLOAD_TIMEOUT = 3600  # 1 hour
 LARGE_FILE_CONVERSION_TIMEOUT = 7200  # 2 hours
 YOUTUBE_DOWNLOAD_TIMEOUT = 3600  # 1 hour
+YOUTUBE_INFO_TIMEOUT = 60  # Looking up the size and duration of a video before converting it
+YOUTUBE_CACHE_TTL = 6 * 3600  # Reuse YouTube conversions for 6 hours
 
 # Storage settings
 TEMP_DIR_SIZE_LIMIT = 100 * 1024 * 1024 * 1024  # 100GB temp space
 CLEANUP_INTERVAL = 3600  # Clean up temp files every hour
 
+# Conversion result cache
+ENABLE_RESULT_CACHE = True
+RESULT_CACHE_SIZE_LIMIT = TEMP_DIR_SIZE_LIMIT  # Evict least recently used results beyond this
+RESULT_CACHE_VERSION = 1  # Bump to invalidate cached results after changing conversion code
+
+# Downloads
+# When enabled, /api/download hands the file to nginx with X-Accel-Redirect.
+# nginx needs an internal location for the prefix that aliases the outputs directory.
+X_ACCEL_REDIRECT_ENABLED = os.environ.get('USE_X_ACCEL_REDIRECT', '').lower() in ('1', 'true', 'yes')
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected-outputs/')
+
 # FFmpeg settings for large files
 FFMPEG_THREAD_COUNT = 0  # Use all available cores
 FFMPEG_PRESET = 'medium'  # Balance between speed and quality
 FFMPEG_CRF = 23  # Constant Rate Factor for video quality
 
+# Segmented video encoding (long mp4/mov encodes split at keyframes)
+SEGMENTED_ENCODING = True
+SEGMENT_MIN_FILE_SIZE = 2 * 1024 * 1024 * 1024  # Only videos of 2GB and more are split
+SEGMENT_DURATION = 120  # Aim for 2 minute segments (cut at the next keyframe)
+SEGMENT_FFMPEG_THREADS = 2  # Threads per segment encoder; x264 scales best on few threads
+SEGMENT_PARALLELISM = 0  # Segments encoded at once per job (0 = the job's share of cores / SEGMENT_FFMPEG_THREADS)
+SEGMENT_MAX_ATTEMPTS = 2  # Tries per segment before the job fails (finished segments are kept for a retry)
+
 # Progress reporting
 PROGRESS_UPDATE_INTERVAL = 5  # Update progress every 5 seconds
+STATUS_CACHE_ACTIVE_TTL = 2  # Trust database reads of running jobs for 2 seconds
+STATUS_CACHE_FINISHED_TTL = 300  # Keep finished job statuses cached for 5 minutes
+STATUS_CACHE_MAX_ENTRIES = 50000  # Upper bound on cached job statuses per process
+SSE_HEARTBEAT_INTERVAL = 15  # Keep-alive comment on idle event streams every 15 seconds
+SSE_CHANGE_CHECK_INTERVAL = 1  # Event streams look for jobs changed by other processes every second (a shared memory read)
+# Change counters of jobs, shared by the processes of one host so streams re-read only changed jobs
+JOB_VERSIONS_FILE = os.environ.get('JOB_VERSIONS_FILE', os.path.join(os.path.dirname(__file__), '..', 'logs', 'job-versions'))
+JOB_VERSION_SLOTS = 65536  # Jobs share slots by hash; a collision only costs an extra database read
+SSE_MAX_STREAM_DURATION = 240  # Close event streams after 4 minutes; browsers reconnect automatically
+SSE_MAX_JOBS_PER_STREAM = 500  # Most jobs a single event stream can follow
 
 # Memory management
 MAX_MEMORY_USAGE = 2 * 1024 * 1024 * 1024  # 2GB max memory per process
 ENABLE_MEMORY_MONITORING = True
 
+# Conversion subprocess limits (ffmpeg, ffprobe, yt-dlp, rar/unrar)
+# Address space runs well above resident memory (thread stacks, malloc arenas), hence the margin
+SUBPROCESS_MEMORY_LIMIT = 2 * MAX_MEMORY_USAGE  # RLIMIT_AS per process, applied with ENABLE_MEMORY_MONITORING
+SUBPROCESS_MEMORY_PER_THREAD = 128 * 1024 * 1024  # Added to the limit per thread of multi-threaded tools (malloc arena, stack, frame buffers)
+SUBPROCESS_CPU_SHARE = 0.5  # RLIMIT_CPU: a process may average this share of all cores over its timeout (at least one)
+SUBPROCESS_NICE = 10  # Niceness added to conversion processes so requests stay responsive (0 = unchanged)
+SUBPROCESS_IONICE_CLASS = 2  # I/O scheduling class: 1 realtime, 2 best-effort, 3 idle (None = unchanged)
+SUBPROCESS_IONICE_LEVEL = 7  # Priority within the class, 0 (highest) to 7
+SUBPROCESS_KILL_GRACE = 10  # Seconds between SIGTERM and SIGKILL for a process that overran
+FFPROBE_TIMEOUT = 60  # Quick ffprobe calls; keyframe scans read every packet and get the conversion timeout
+
 # Disk space monitoring
-MIN_FREE_DISK_SPACE = 50 * 1024 * 1024 * 1024  # 50GB minimum free space
+MIN_FREE_DISK_SPACE = int(os.environ.get('MIN_FREE_DISK_SPACE', 50 * 1024 * 1024 * 1024))  # 50GB minimum free space
+MIN_FREE_DISK_SHARE = float(os.environ.get('MIN_FREE_DISK_SHARE', '0.1'))  # ...or this share of the disk, if that is less
 DISK_SPACE_CHECK_INTERVAL = 300  # Check every 5 minutes
+UPLOAD_RETENTION = 3600  # Sources no queued or running job needs are removed an hour after their last write
+OUTPUT_RETENTION = 24 * 3600  # Converted files are removed a day after their last download (or completion)
+OUTPUT_EVICTION_GRACE = 3600  # Low on space, only outputs downloaded and then unused for an hour are evicted early
+DISK_OUTPUT_FACTOR = 1.0  # Output bytes expected per source byte when projecting free space
+DISK_ADMISSION_RETRY_AFTER = 60  # Retry-After (seconds) for uploads deferred until space is freed
 
 # Rate limiting for large files
 LARGE_FILE_RATE_LIMIT = 1  # 1 large file upload per minute per IP
+LARGE_FILE_THRESHOLD = 1024 * 1024 * 1024  # Files of 1GB and more count as large
 CONCURRENT_CONVERSIONS_LIMIT = 3  # Max 3 concurrent large file conversions
 
+# Request rate limiting (token bucket per client IP, shared by all workers)
+# Backends: redis (REDIS_URL), sqlite (one host) or memory (per process, for tests)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'sqlite')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Proxies in front of the app that append to X-Forwarded-For; the client is the hop the
+# outermost one saw (0 = no proxy, use the socket address). Hops before it are client supplied
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+RATE_LIMIT_WINDOW = 60  # Buckets refill over one minute
+CONVERSION_RATE_LIMIT = 10  # Conversion requests per minute per IP (a large file costs more, see upload_cost)
+STATUS_RATE_LIMIT = 600  # Status polls, event streams and downloads per minute per IP
+RATE_LIMIT_SWEEP_INTERVAL = 300  # Forget clients whose bucket has refilled every 5 minutes
+
+# Image conversions (process pool, separate from the CONCURRENT_CONVERSIONS_LIMIT slots)
+IMAGE_CONVERSION_WORKERS = 16  # Job threads per process feeding the image process pool
+IMAGE_CONCURRENT_CONVERSIONS_LIMIT = 32  # Image jobs processing at once across all processes
+IMAGE_POOL_PROCESSES = 0  # Encoder processes per app process (0 = CPU cores / WEB_CONCURRENCY)
+IMAGE_BATCH_MAX_BYTES = 4 * 1024 * 1024  # Images up to 4MB are grouped into batches
+IMAGE_BATCH_SIZE = 16  # Most images converted by one pool task
+IMAGE_BATCH_WINDOW = 0.02  # Wait up to 20ms for more small images before sending a batch
+IMAGE_CONVERSION_TIMEOUT = 600  # Give up on one image after 10 minutes
+IMAGE_MAX_PIXELS = 4 * 1000 * 1000 * 1000  # Refuse images over 4 gigapixels
+IMAGE_STRIP_PIXEL_THRESHOLD = 50 * 1000 * 1000  # Convert images over 50 megapixels strip by strip
+IMAGE_MEMORY_LIMIT = MAX_MEMORY_USAGE // 4  # Memory one image conversion may use (pool processes run several)
+IMAGE_STRIP_MAX_ROWS = 1024  # Tallest strip, even when the memory limit would allow more
+# Pillow save() options per output format
+IMAGE_ENCODER_SETTINGS = {
+    'jpeg': {'quality': 90, 'progressive': True, 'optimize': True},
+    'png': {'compress_level': 6, 'optimize': False}
+}
+
+# Conversion worker pool
+JOB_POLL_INTERVAL = 2  # Idle workers check the jobs table every 2 seconds
+JOB_HEARTBEAT_INTERVAL = 30  # Active jobs are touched every 30 seconds
+JOB_STALE_TIMEOUT = 300  # Requeue 'processing' jobs with no heartbeat for 5 minutes
+
+# Batch conversions (/api/batch)
+BATCH_MAX_FILES = 500  # Most files in one batch
+BATCH_MAX_LANE_SHARE = 0.5  # One batch may use at most half of a lane's conversion slots
+ZIP_STREAM_BUFFER_SIZE = 1024 * 1024  # Batch zips are streamed in 1MB pieces
+
+# Archive conversions
+ARCHIVE_RAR_STAGING_LIMIT = 256 * 1024 * 1024  # Small members are added to RAR archives in batches of up to 256MB
+ZIP_COMPRESSION_LEVEL = int(os.environ.get('ZIP_COMPRESSION_LEVEL', '6'))  # Deflate level for zip output (0 stores everything)
+ZIP_COMPRESSION_WORKERS = 0  # Deflate threads per zip being written; 0 uses all cores
+ZIP_DEFLATE_BLOCK_SIZE = 1024 * 1024  # Members are deflated in parallel 1MB blocks
+ZIP_STORE_EXTENSIONS = [  # Already compressed: stored as they are
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'mp3', 'aac', 'm4a', 'ogg', 'flac', 'wma',
+    'mp4', 'mov', 'mkv', 'avi', 'webm', 'wmv', 'flv', 'zip', 'rar', '7z', 'gz', 'bz2', 'xz'
+]
+
+# Job database
+DB_POOL_SIZE = 10  # Pooled connections per process
+DB_MAX_OVERFLOW = 20  # Extra connections allowed under bursts
+DB_BUSY_TIMEOUT_MS = 30000  # SQLite waits up to 30 seconds for a write lock
+PROGRESS_FLUSH_INTERVAL = 2  # Batched job progress is written every 2 seconds
+
+# Event log writer
+LOG_QUEUE_MAX_SIZE = 10000  # Log lines buffered per process before new ones are dropped
+LOG_BATCH_SIZE = 500  # Write a batch once this many lines are queued
+LOG_FLUSH_INTERVAL = 1  # ...or at least every second
+LOG_MAX_FILE_SIZE = 50 * 1024 * 1024  # Rotate event logs at 50MB
+LOG_BACKUP_COUNT = 5  # Compressed rotated logs kept per file
+LOG_INDEX_INTERVAL = 256 * 1024  # One time -> offset index record per 256KB of JSON log
+
+# Metrics shared by the worker processes (one mmap file per process)
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(os.path.dirname(__file__), '..', 'logs', 'metrics'))
+
+# Log queries (/api/logs)
+LOG_READ_BLOCK_SIZE = 64 * 1024  # Logs are read backwards in 64KB blocks
+LOG_QUERY_MAX_LINES = 1000  # Most lines returned by one query
+LOG_QUERY_MAX_SCAN_BYTES = 32 * 1024 * 1024  # A query reads at most 32MB, then returns a cursor
+
 # Supported formats for large files
 LARGE_FILE_FORMATS = {
     'video': ['mp4', 'mov', 'avi', 'mkv', 'wmv', 'flv', 'webm'],
@@ -63,6 +188,15 @@ QUALITY_PRESETS = {
     }
 }
 
+# Encoding profile planner
+ENCODING_MODES = ['speed', 'balanced', 'quality']  # Client choice on /api/convert and /api/batch
+DEFAULT_ENCODING_MODE = 'balanced'
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower']
+AUDIO_BITRATES = ['128k', '192k', '256k', '320k']
+PROFILE_QUEUE_STEP = CONCURRENT_CONVERSIONS_LIMIT  # Every 3 queued jobs move speed/balanced encodes one preset faster
+PROFILE_MAX_QUEUE_STEPS = 3  # ...by at most 3 presets
+PROFILE_LONG_DURATION = 2 * 3600  # Videos over 2 hours use one preset faster (except in quality mode)
+
 def get_quality_preset(file_size_bytes):
     """Get appropriate quality preset based on file size"""
     if file_size_bytes < 1024 * 1024 * 1024:  # < 1GB
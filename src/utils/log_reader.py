@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import bisect
+import itertools
+import struct
+from datetime import datetime, timezone
+from src.utils.large_files import LOG_READ_BLOCK_SIZE, LOG_QUERY_MAX_SCAN_BYTES
+
+# Sparse index written next to each JSON log by the log writer: fixed-size
+# (entry time as epoch seconds, byte offset of a batch) records
+INDEX_SUFFIX = '.idx'
+INDEX_RECORD = struct.Struct('<dQ')
+
+# Batches from different processes may be written slightly out of time order
+TIME_SLACK = 60
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+# '%(asctime)s - %(name)s - %(levelname)s - %(message)s' lines of app.log
+APP_LOG_PATTERN = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - \S+ - ([A-Z]+) - ')
+JSON_TIMESTAMP_PATTERN = re.compile(rb'"timestamp": "([^"]+)"')
+
+def parse_log_time(value):
+    """Parse an ISO 8601 timestamp into epoch seconds; naive times are UTC like the JSON logs"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def entry_time(entry):
+    """Epoch seconds of a JSON log entry, or None"""
+    try:
+        return parse_log_time(entry['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def tail_log(path, lines=50, before=None, level=None, contains=None, since=None, until=None,
+             json_lines=False, event=None, max_scan_bytes=LOG_QUERY_MAX_SCAN_BYTES):
+    """
+    Return the newest log lines matching the filters, reading the file backwards
+    block by block instead of loading it.
+
+    since/until are epoch seconds; for JSON logs the sparse offset index narrows
+    the byte range to read. Lines are returned oldest first together with a
+    'next_before' cursor that continues with older lines, or None once there
+    are no more. A query stops after max_scan_bytes and returns a cursor, so
+    a selective filter on a huge log never reads it in one request.
+    """
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        start, end = 0, stat.st_size
+        if before:
+            end = min(_parse_cursor(before, stat.st_ino), end)
+
+        if json_lines and (since is not None or until is not None):
+            index_start, index_end = _index_range(path + INDEX_SUFFIX, since, until, stat.st_size)
+            start = _align_to_line(f, index_start)
+            if index_end is not None:
+                end = min(end, _align_to_line(f, index_end))
+            start = min(start, end)
+
+        min_level = LOG_LEVELS[level] if level else None
+        needle = contains.lower().encode() if contains else None
+
+        matches = []
+        cursor = end
+        exhausted = True
+        for offset, raw in _iter_lines_reverse(f, start, end):
+            cursor = offset
+            timestamp = None
+            if since is not None or until is not None:
+                timestamp = _line_time(raw, json_lines)
+                if timestamp is not None and since is not None and timestamp < since - TIME_SLACK:
+                    break
+
+            entry = _match_line(raw, json_lines, min_level, needle, event, timestamp, since, until)
+            if entry is not None:
+                matches.append(entry)
+                if len(matches) >= lines:
+                    exhausted = offset <= start
+                    break
+            if end - offset >= max_scan_bytes:
+                exhausted = offset <= start
+                break
+
+        matches.reverse()
+        return {
+            'lines': matches,
+            'next_before': None if exhausted else f"{stat.st_ino}:{cursor}",
+            'scanned_bytes': end - cursor
+        }
+
+def _match_line(raw, json_lines, min_level, needle, event, timestamp, since, until):
+    if needle is not None and needle not in raw.lower():
+        return None
+    if since is not None and (timestamp is None or timestamp < since):
+        return None
+    if until is not None and (timestamp is None or timestamp > until):
+        return None
+
+    if json_lines:
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            return None
+        if event and (not isinstance(entry, dict) or entry.get('event') != event):
+            return None
+        return entry
+
+    text = raw.decode('utf-8', errors='replace').rstrip('\r')
+    if min_level is not None:
+        match = APP_LOG_PATTERN.match(text)
+        if not match or LOG_LEVELS.get(match.group(2), 0) < min_level:
+            return None
+    return text
+
+def _line_time(raw, json_lines):
+    """Epoch seconds of a log line, or None when it has no timestamp (e.g. traceback lines)"""
+    try:
+        if json_lines:
+            match = JSON_TIMESTAMP_PATTERN.search(raw)
+            return parse_log_time(match.group(1).decode()) if match else None
+        # app.log asctime is local time
+        return datetime.strptime(raw[:23].decode(), '%Y-%m-%d %H:%M:%S,%f').timestamp()
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def _iter_lines_reverse(f, start, end, block_size=LOG_READ_BLOCK_SIZE):
+    """Yield (offset, line) for the complete lines between start and end, newest first"""
+    position = end
+    buffer = b''
+    terminated = False
+    while position > start:
+        read_size = min(block_size, position - start)
+        position -= read_size
+        f.seek(position)
+        buffer = f.read(read_size) + buffer
+
+        if not terminated:
+            # A line still being written has no newline yet; skip it
+            newline = buffer.rfind(b'\n')
+            if newline < 0:
+                continue
+            buffer = buffer[:newline]
+            terminated = True
+
+        # The first piece may continue before this block unless we reached start
+        pieces = buffer.split(b'\n')
+        buffer = pieces.pop(0) if position > start else b''
+        offset = position + len(buffer) + 1 if position > start else position
+
+        offsets = []
+        for line in pieces:
+            offsets.append(offset)
+            offset += len(line) + 1
+        for line_offset, line in zip(reversed(offsets), reversed(pieces)):
+            if line:
+                yield line_offset, line
+
+def _align_to_line(f, offset):
+    """Move offset forward to the start of the next line (unless it already is one)"""
+    if offset <= 0:
+        return 0
+    f.seek(offset - 1)
+    if f.read(1) == b'\n':
+        return offset
+    f.readline()
+    return f.tell()
+
+def _index_range(index_path, since, until, file_size):
+    """Byte range (start, end or None) of a JSON log that can hold entries between since and until"""
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return 0, None
+
+    # Processes append a batch and then its index record, so records of
+    # concurrent batches can land out of offset order
+    records = [record for record in INDEX_RECORD.iter_unpack(data[:len(data) - len(data) % INDEX_RECORD.size])
+               if record[1] <= file_size]
+    records.sort(key=lambda record: record[1])
+
+    start, end = 0, None
+    if since is not None:
+        # Newest time up to each record: everything before position is older than since
+        latest = list(itertools.accumulate((record[0] for record in records), max))
+        position = bisect.bisect_left(latest, since - TIME_SLACK)
+        if position > 0:
+            start = records[position - 1][1]
+    if until is not None:
+        # Oldest time from each record on: everything from position on is newer than until
+        earliest = list(itertools.accumulate((record[0] for record in reversed(records)), min))[::-1]
+        position = bisect.bisect_right(earliest, until + TIME_SLACK)
+        if position < len(records):
+            end = records[position][1]
+    return start, end
+
+def _parse_cursor(cursor, inode):
+    try:
+        cursor_inode, offset = (int(part) for part in cursor.split(':'))
+    except ValueError:
+        raise ValueError('Invalid before cursor')
+    if cursor_inode != inode:
+        raise ValueError('The log file has been rotated since this cursor was issued')
+    return offset
@@ -0,0 +1,264 @@
+import os
+import json
+import gzip
+import glob
+import time
+import fcntl
+import queue
+import shutil
+import atexit
+import logging
+import threading
+from datetime import datetime
+from src.utils.large_files import (
+    LOG_QUEUE_MAX_SIZE,
+    LOG_BATCH_SIZE,
+    LOG_FLUSH_INTERVAL,
+    LOG_MAX_FILE_SIZE,
+    LOG_BACKUP_COUNT,
+    LOG_INDEX_INTERVAL
+)
+from src.utils.log_reader import INDEX_SUFFIX, INDEX_RECORD, entry_time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class AsyncLogWriter:
+    """
+    Background writer for the JSON event logs.
+
+    Callers only put entries on a bounded in-memory queue; a writer thread
+    serializes them and appends each batch to its file with a single O_APPEND
+    write, so request threads never touch the disk and lines from different
+    gunicorn processes never interleave. A batch is written once LOG_BATCH_SIZE
+    lines are queued or LOG_FLUSH_INTERVAL seconds after its first line.
+
+    Files are rotated once they reach LOG_MAX_FILE_SIZE: the file is renamed
+    while holding an exclusive flock (writers in every process hold a shared
+    one), then gzipped, and only the newest LOG_BACKUP_COUNT archives are kept.
+    When the queue is full new entries are dropped and counted rather than
+    blocking the request.
+
+    Every LOG_INDEX_INTERVAL bytes a (time, offset) record is appended to a
+    sparse index next to the log, which /api/logs uses to seek by time.
+    """
+    def __init__(self, max_queue_size=LOG_QUEUE_MAX_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, max_bytes=LOG_MAX_FILE_SIZE,
+                 backup_count=LOG_BACKUP_COUNT, index_interval=LOG_INDEX_INTERVAL):
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.index_interval = index_interval
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock_files = {}
+        self._indexed_offsets = {}
+        self._reported_drops = 0
+        self._last_drop_report = float("-inf")
+        self.stats = {
+            'written_lines': 0,
+            'written_bytes': 0,
+            'batches': 0,
+            'rotations': 0,
+            'dropped': 0,
+            'write_errors': 0
+        }
+
+    def write(self, path, entry):
+        """Queue a JSON log entry for path. Never blocks; drops the entry if the queue is full"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((path, entry))
+        except queue.Full:
+            with self._lock:
+                self.stats['dropped'] += 1
+
+    def close(self, timeout=5):
+        """Write everything still queued and stop the writer thread"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def get_stats(self):
+        """Get writer statistics"""
+        return {
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'max_queue_size': self.max_queue_size,
+            **self.stats
+        }
+
+    def _ensure_started(self):
+        # Started lazily so each gunicorn worker gets its own thread after the fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._lock_files = {}
+            self._indexed_offsets = {}
+            self._thread = threading.Thread(target=self._run, name="log-writer")
+            self._thread.daemon = True
+            self._thread.start()
+            if self._pid is None:
+                atexit.register(self.close)
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+            self._report_drops()
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        lines_by_path = {}
+        first_times = {}
+        for path, entry in batch:
+            try:
+                line = json.dumps(entry, default=str) + '\n'
+            except (TypeError, ValueError) as e:
+                logger.error(f"Unserializable log entry for {path}: {str(e)}")
+                continue
+            lines_by_path.setdefault(path, []).append(line)
+            if path not in first_times:
+                first_times[path] = entry_time(entry) or time.time()
+
+        for path, lines in lines_by_path.items():
+            data = ''.join(lines).encode()
+            try:
+                size = self._append(path, data, first_times[path])
+            except OSError as e:
+                self.stats['write_errors'] += 1
+                logger.error(f"Failed to write {len(lines)} log lines to {path}: {str(e)}")
+                continue
+
+            self.stats['written_lines'] += len(lines)
+            self.stats['written_bytes'] += len(data)
+            self.stats['batches'] += 1
+
+            if size >= self.max_bytes:
+                try:
+                    self._rotate(path)
+                except OSError as e:
+                    logger.error(f"Failed to rotate {path}: {str(e)}")
+
+    def _append(self, path, data, first_time):
+        """Append data with one O_APPEND write and return the resulting file size"""
+        lock_file = self._lock_file(path)
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            try:
+                self._index_batch(path, size - len(data), first_time)
+            except OSError as e:
+                logger.error(f"Failed to index {path}: {str(e)}")
+            return size
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _index_batch(self, path, offset, first_time):
+        # Another process may have appended in between, so offset can land mid-line;
+        # readers align it to the next line start
+        last_offset = self._indexed_offsets.get(path)
+        if last_offset is not None and last_offset <= offset < last_offset + self.index_interval:
+            return
+        fd = os.open(path + INDEX_SUFFIX, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, INDEX_RECORD.pack(first_time, max(offset, 0)))
+        finally:
+            os.close(fd)
+        self._indexed_offsets[path] = offset
+
+    def _rotate(self, path):
+        lock_file = self._lock_file(path)
+        rotated_path = f"{path}.{datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}"
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another process may have rotated the file while we waited for the lock
+            try:
+                if os.path.getsize(path) < self.max_bytes:
+                    return
+            except FileNotFoundError:
+                return
+            os.rename(path, rotated_path)
+            # The index only covers the live file
+            try:
+                os.unlink(path + INDEX_SUFFIX)
+            except FileNotFoundError:
+                pass
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        # No writer can still hold the old file, so compress it outside the lock
+        with open(rotated_path, 'rb') as source, gzip.open(f"{rotated_path}.gz.tmp", 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(f"{rotated_path}.gz.tmp", f"{rotated_path}.gz")
+        os.unlink(rotated_path)
+        self.stats['rotations'] += 1
+        logger.info(f"Rotated {path} to {rotated_path}.gz")
+
+        archives = sorted(glob.glob(f"{glob.escape(path)}.*.gz"))
+        for old_archive in archives[:-self.backup_count] if self.backup_count else archives:
+            try:
+                os.unlink(old_archive)
+            except FileNotFoundError:
+                pass
+
+    def _lock_file(self, path):
+        lock_file = self._lock_files.get(path)
+        if lock_file is None:
+            lock_file = open(f"{path}.lock", 'a')
+            self._lock_files[path] = lock_file
+        return lock_file
+
+    def _report_drops(self):
+        # At most one warning every 10 seconds while the queue is overflowing
+        dropped = self.stats['dropped']
+        now = time.monotonic()
+        if dropped > self._reported_drops and now - self._last_drop_report >= 10:
+            self._last_drop_report = now
+            logger.warning(f"Log queue full: dropped {dropped - self._reported_drops} entries "
+                           f"({dropped} in total)")
+            self._reported_drops = dropped
+
+# Global event log writer instance
+log_writer = AsyncLogWriter()
@@ -1,9 +1,11 @@
 import logging
 import os
-import json
+import time
 from datetime import datetime
 from flask import request, g
 import traceback
+from src.utils.log_writer import log_writer
+from src.utils.metrics import metrics, REQUEST_LATENCY_BUCKETS, CONVERSION_DURATION_BUCKETS
 
 # Create logs directory
 log_dir = os.path.join(os.path.dirname(__file__), '..', 'logs')
@@ -22,6 +24,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class ConversionLogger:
+    """Structured JSON event logs, written in batches by the background log writer"""
     def __init__(self):
         self.conversion_log_file = os.path.join(log_dir, 'conversions.log')
         self.error_log_file = os.path.join(log_dir, 'errors.log')
@@ -40,8 +43,7 @@ class ConversionLogger:
             'user_agent': request.headers.get('User-Agent', 'Unknown')
         }
         
-        with open(self.conversion_log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
+        log_writer.write(self.conversion_log_file, log_entry)
         
         logger.info(f"Conversion started: {job_id} ({from_format} -> {to_format})")
     
@@ -55,8 +57,7 @@ class ConversionLogger:
             'output_file_size': file_size
         }
         
-        with open(self.conversion_log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
+        log_writer.write(self.conversion_log_file, log_entry)
         
         logger.info(f"Conversion completed: {job_id} in {duration:.2f}s")
     
@@ -71,8 +72,7 @@ class ConversionLogger:
             'traceback': traceback.format_exc()
         }
         
-        with open(self.error_log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
+        log_writer.write(self.error_log_file, log_entry)
         
         logger.error(f"Conversion failed: {job_id} - {error_message}")
     
@@ -87,8 +87,7 @@ class ConversionLogger:
             'details': details or {}
         }
         
-        with open(self.security_log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
+        log_writer.write(self.security_log_file, log_entry)
         
         logger.warning(f"Security event: {event_type} from {ip_address}")
     
@@ -101,70 +100,102 @@ class ConversionLogger:
             'method': method,
             'status_code': status_code,
             'response_time_ms': response_time,
-            'ip_address': request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr),
+            'ip_address': request.remote_addr,
             'user_agent': request.headers.get('User-Agent', 'Unknown')
         }
         
-        with open(self.conversion_log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
+        log_writer.write(self.conversion_log_file, log_entry)
 
 # Global logger instance
 conversion_logger = ConversionLogger()
 
 def log_request():
     """Middleware to log all requests"""
-    g.start_time = datetime.utcnow()
+    g.start_time = time.perf_counter()
 
 def log_response(response):
     """Middleware to log response details"""
     if hasattr(g, 'start_time'):
-        duration = (datetime.utcnow() - g.start_time).total_seconds() * 1000
+        duration = time.perf_counter() - g.start_time
         conversion_logger.log_api_request(
             endpoint=request.endpoint or request.path,
             method=request.method,
             status_code=response.status_code,
-            response_time=duration
+            response_time=duration * 1000
         )
+        health_monitor.record_request(request.endpoint, request.method, response.status_code, duration)
     return response
 
+# Metrics recorded by the health monitor (aggregated across worker processes)
+metrics.counter('gigovert_requests_total', 'HTTP requests received')
+metrics.counter('gigovert_responses_total', 'HTTP responses by endpoint, method and status code')
+metrics.histogram('gigovert_request_duration_seconds', 'HTTP request latency by endpoint and method',
+                  REQUEST_LATENCY_BUCKETS)
+metrics.counter('gigovert_conversions_total', 'Finished conversions by result')
+metrics.histogram('gigovert_conversion_duration_seconds', 'Conversion job duration by conversion type and result',
+                  CONVERSION_DURATION_BUCKETS)
+
 class HealthMonitor:
+    """
+    Request and conversion counters plus latency histograms, kept in the shared
+    metrics files so every gunicorn worker reports the totals of all of them
+    """
     def __init__(self):
-        self.stats = {
-            'total_conversions': 0,
-            'successful_conversions': 0,
-            'failed_conversions': 0,
-            'total_requests': 0,
-            'start_time': datetime.utcnow()
-        }
+        self.start_time = datetime.utcnow()
     
     def increment_conversion(self, success=True):
         """Increment conversion counters"""
-        self.stats['total_conversions'] += 1
-        if success:
-            self.stats['successful_conversions'] += 1
-        else:
-            self.stats['failed_conversions'] += 1
+        metrics.inc('gigovert_conversions_total', {'result': 'success' if success else 'failure'})
+    
+    def record_conversion(self, from_format, to_format, duration, success=True):
+        """Count a finished conversion and record how long it took"""
+        self.increment_conversion(success)
+        metrics.observe('gigovert_conversion_duration_seconds', duration, {
+            'conversion': f"{from_format}->{to_format}",
+            'result': 'success' if success else 'failure'
+        })
     
     def increment_requests(self):
         """Increment request counter"""
-        self.stats['total_requests'] += 1
+        metrics.inc('gigovert_requests_total')
+    
+    def record_request(self, endpoint, method, status_code, duration):
+        """Record the latency of a finished request"""
+        # Unmatched URLs share one label so random paths can't blow up the metric count
+        endpoint = endpoint or 'unmatched'
+        metrics.inc('gigovert_responses_total', {'endpoint': endpoint, 'method': method, 'status': str(status_code)})
+        metrics.observe('gigovert_request_duration_seconds', duration, {'endpoint': endpoint, 'method': method})
     
     def get_health_status(self):
         """Get current health status"""
-        uptime = (datetime.utcnow() - self.stats['start_time']).total_seconds()
-        success_rate = 0
-        
-        if self.stats['total_conversions'] > 0:
-            success_rate = (self.stats['successful_conversions'] / self.stats['total_conversions']) * 100
+        uptime = (datetime.utcnow() - self.start_time).total_seconds()
+        totals = metrics.collect()
+        conversions = {dict(labels)['result']: int(value)
+                       for labels, value in metrics.get_counter('gigovert_conversions_total', totals).items()}
+        successful = conversions.get('success', 0)
+        failed = conversions.get('failure', 0)
+        total = successful + failed
         
         return {
             'status': 'healthy',
             'uptime_seconds': uptime,
-            'total_conversions': self.stats['total_conversions'],
-            'successful_conversions': self.stats['successful_conversions'],
-            'failed_conversions': self.stats['failed_conversions'],
-            'success_rate_percent': round(success_rate, 2),
-            'total_requests': self.stats['total_requests']
+            'total_conversions': total,
+            'successful_conversions': successful,
+            'failed_conversions': failed,
+            'success_rate_percent': round((successful / total * 100) if total else 0, 2),
+            'total_requests': int(sum(metrics.get_counter('gigovert_requests_total', totals).values()))
+        }
+    
+    def get_latency_percentiles(self):
+        """p50/p95/p99 latency in seconds per endpoint and per conversion type"""
+        totals = metrics.collect()
+        requests = metrics.get_percentiles('gigovert_request_duration_seconds', totals=totals)
+        conversions = metrics.get_percentiles('gigovert_conversion_duration_seconds', totals=totals)
+        return {
+            'requests': {f"{dict(labels)['method']} {dict(labels)['endpoint']}": summary
+                         for labels, summary in sorted(requests.items())},
+            'conversions': {f"{dict(labels)['conversion']} ({dict(labels)['result']})": summary
+                            for labels, summary in sorted(conversions.items())}
         }
 
 # Global health monitor instance
@@ -0,0 +1,276 @@
+import os
+import json
+import math
+import mmap
+import struct
+import threading
+from src.utils.large_files import METRICS_DIR
+
+# Request latencies, image codec timings and conversion durations, in seconds
+REQUEST_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+IMAGE_TIMING_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONVERSION_DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+
+_HEADER = struct.Struct('<Q')  # bytes in use
+_KEY_LENGTH = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+_INITIAL_FILE_SIZE = 64 * 1024
+
+class _MetricsFile:
+    """
+    Append-only mmap'd file of (key, float64) entries owned by one process.
+
+    Only the owning process writes to it, so updates need no cross-process
+    locking; other processes just read it. A new entry is written completely
+    before the header is advanced, so readers never see a half-written one.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < _INITIAL_FILE_SIZE:
+            self._file.truncate(_INITIAL_FILE_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        self._positions = {key: position for key, value, position in _iter_entries(self._map, self._used)}
+
+    def add(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._append(key)
+        value = _VALUE.unpack_from(self._map, position)[0]
+        _VALUE.pack_into(self._map, position, value + amount)
+
+    def _append(self, key):
+        encoded = key.encode()
+        padded_length = (_KEY_LENGTH.size + len(encoded) + 7) // 8 * 8
+        entry_size = padded_length + _VALUE.size
+        if self._used + entry_size > len(self._map):
+            self._grow(self._used + entry_size)
+
+        _KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _KEY_LENGTH.size:self._used + _KEY_LENGTH.size + len(encoded)] = encoded
+        position = self._used + padded_length
+        _VALUE.pack_into(self._map, position, 0.0)
+        self._used += entry_size
+        _HEADER.pack_into(self._map, 0, self._used)
+
+        self._positions[key] = position
+        return position
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+def _iter_entries(buffer, used):
+    """Yield (key, value, value position) for the entries of a metrics file"""
+    position = _HEADER.size
+    while position + _KEY_LENGTH.size <= used:
+        key_length = _KEY_LENGTH.unpack_from(buffer, position)[0]
+        key_start = position + _KEY_LENGTH.size
+        value_position = position + (_KEY_LENGTH.size + key_length + 7) // 8 * 8
+        if value_position + _VALUE.size > used:
+            return
+        key = bytes(buffer[key_start:key_start + key_length]).decode()
+        yield key, _VALUE.unpack_from(buffer, value_position)[0], value_position
+        position = value_position + _VALUE.size
+
+class SharedMetrics:
+    """
+    Counters and histograms aggregated across gunicorn worker processes.
+
+    Each process adds to its own mmap file in METRICS_DIR (thread-safe within
+    the process); readers sum the files of all processes, including workers
+    that have since exited, so counters never go backwards. Files are cleared
+    when no process that wrote them is still running, i.e. on a fresh start.
+    Histograms use fixed buckets like Prometheus, and percentiles are
+    estimated from them the way histogram_quantile() does.
+    """
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self._definitions = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def counter(self, name, help_text):
+        """Declare a counter"""
+        self._definitions[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        """Declare a histogram with the given upper bucket bounds"""
+        self._definitions[name] = ('histogram', help_text, tuple(sorted(buckets)))
+
+    def inc(self, name, labels=None, amount=1):
+        """Increment a counter"""
+        with self._lock:
+            self._get_file().add(_make_key(name, labels), amount)
+
+    def observe(self, name, value, labels=None):
+        """Record one observation in a histogram"""
+        buckets = self._definitions[name][2]
+        bound = next((bucket for bucket in buckets if value <= bucket), math.inf)
+        with self._lock:
+            metrics_file = self._get_file()
+            metrics_file.add(_make_key(name, labels, bound), 1)
+            metrics_file.add(_make_key(name, labels, 'sum'), value)
+            metrics_file.add(_make_key(name, labels, 'count'), 1)
+
+    def collect(self):
+        """Sum the values of every process. Returns {(name, labels, suffix): value}"""
+        totals = {}
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return totals
+
+        for filename in filenames:
+            if not filename.endswith('.db'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            if len(data) < _HEADER.size:
+                continue
+            used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+            for key, value, position in _iter_entries(data, used):
+                name, labels, suffix = json.loads(key)
+                metric_key = (name, tuple(tuple(label) for label in labels), suffix)
+                totals[metric_key] = totals.get(metric_key, 0) + value
+        return totals
+
+    def get_counter(self, name, totals=None):
+        """Total of a counter across processes, grouped by label set"""
+        totals = self.collect() if totals is None else totals
+        return {labels: value for (metric, labels, suffix), value in totals.items() if metric == name}
+
+    def get_percentiles(self, name, quantiles=(0.5, 0.95, 0.99), totals=None):
+        """Estimated percentiles and count of a histogram per label set"""
+        totals = self.collect() if totals is None else totals
+        result = {}
+        for labels, histogram in self._histograms(name, totals).items():
+            count = histogram['count']
+            summary = {'count': int(count), 'avg': round(histogram['sum'] / count, 4) if count else 0}
+            for quantile in quantiles:
+                summary[f"p{int(quantile * 100)}"] = _estimate_quantile(quantile, histogram['buckets'], count)
+            result[labels] = summary
+        return result
+
+    def render_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        totals = self.collect()
+        lines = []
+        for name, (metric_type, help_text, buckets) in sorted(self._definitions.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == 'counter':
+                for labels, value in sorted(self.get_counter(name, totals).items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+
+            for labels, histogram in sorted(self._histograms(name, totals).items()):
+                for bound, cumulative in histogram['buckets']:
+                    le = '+Inf' if bound == math.inf else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(histogram['count'])}")
+        return '\n'.join(lines) + '\n'
+
+    def _histograms(self, name, totals):
+        """{labels: {'buckets': [(bound, cumulative count)], 'sum', 'count'}} of a histogram"""
+        bounds = self._definitions[name][2] + (math.inf,)
+        per_labels = {}
+        for (metric, labels, suffix), value in totals.items():
+            if metric == name:
+                per_labels.setdefault(labels, {})[suffix] = value
+
+        histograms = {}
+        for labels, values in per_labels.items():
+            cumulative = 0
+            buckets = []
+            for bound in bounds:
+                cumulative += values.get('+Inf' if bound == math.inf else bound, 0)
+                buckets.append((bound, cumulative))
+            histograms[labels] = {'buckets': buckets, 'sum': values.get('sum', 0), 'count': values.get('count', 0)}
+        return histograms
+
+    def _get_file(self):
+        # One file per process, opened lazily so it belongs to the forked worker
+        if self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._clear_if_stale()
+            self._file = _MetricsFile(os.path.join(self.directory, f"metrics_{os.getpid()}.db"))
+            self._pid = os.getpid()
+        return self._file
+
+    def _clear_if_stale(self):
+        """Remove files left by a previous run when none of their processes is alive"""
+        pids = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith('metrics_') and filename.endswith('.db'):
+                try:
+                    pids.append(int(filename[len('metrics_'):-len('.db')]))
+                except ValueError:
+                    continue
+        if any(_process_alive(pid) for pid in pids if pid != os.getpid()):
+            return
+        for pid in pids:
+            try:
+                os.unlink(os.path.join(self.directory, f"metrics_{pid}.db"))
+            except FileNotFoundError:
+                pass
+
+def _make_key(name, labels, suffix=None):
+    if suffix == math.inf:
+        suffix = '+Inf'
+    return json.dumps([name, sorted((labels or {}).items()), suffix])
+
+def _estimate_quantile(quantile, buckets, count):
+    """Linear interpolation within the bucket holding the quantile, like histogram_quantile()"""
+    if not count:
+        return None
+    rank = quantile * count
+    lower_bound, lower_count = 0, 0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if bound == math.inf:
+                # Beyond the largest bucket: report its bound
+                return lower_bound
+            if cumulative == lower_count:
+                return bound
+            return round(lower_bound + (bound - lower_bound) * (rank - lower_count) / (cumulative - lower_count), 4)
+        lower_bound, lower_count = bound, cumulative
+    return lower_bound
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# Global metrics registry shared by all worker processes
+metrics = SharedMetrics()
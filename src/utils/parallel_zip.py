@@ -0,0 +1,202 @@
+import os
+import time
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.large_files import (
+    ZIP_COMPRESSION_LEVEL,
+    ZIP_COMPRESSION_WORKERS,
+    ZIP_DEFLATE_BLOCK_SIZE,
+    ZIP_STORE_EXTENSIONS
+)
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+# Deflate can refer back 32KB, so each block is primed with the end of the previous one
+DEFLATE_WINDOW = 32 * 1024
+
+def _deflate_block(data, level, dictionary, last):
+    """Raw deflate of one block; every block but the last ends on a byte boundary so blocks can be concatenated"""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class _Member:
+    def __init__(self, name, method, mtime, is_dir, zip64):
+        self.name = name
+        self.method = method
+        self.mtime = mtime
+        self.is_dir = is_dir
+        self.zip64 = zip64
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.header_offset = 0
+
+class ParallelZipWriter:
+    """
+    Writes a standard zip file, deflating members on a thread pool (zlib
+    releases the GIL) and writing them in order. Members are cut into
+    ZIP_DEFLATE_BLOCK_SIZE blocks that are compressed independently, each
+    primed with the end of the previous block, so one large member uses every
+    core as well as many small ones. Members whose extension is in
+    ZIP_STORE_EXTENSIONS (already compressed media and archives) are stored,
+    as is everything at compression level 0.
+    """
+    def __init__(self, path, level=ZIP_COMPRESSION_LEVEL, workers=ZIP_COMPRESSION_WORKERS,
+                 block_size=ZIP_DEFLATE_BLOCK_SIZE, store_extensions=ZIP_STORE_EXTENSIONS):
+        self.path = path
+        self.level = level
+        self.block_size = block_size
+        self.store_extensions = set(store_extensions)
+        self.workers = workers or os.cpu_count() or 1
+        # Blocks read ahead of the writer, bounding memory to a few blocks per worker
+        self.max_pending_blocks = self.workers * 4
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='zip-deflate')
+        self._file = open(path, 'wb')
+        self._pending = deque()
+        self._pending_blocks = 0
+        self._members = []
+
+    def add_directory(self, name, mtime=None):
+        member = _Member(f"{name.rstrip('/')}/", ZIP_STORED, mtime, True, False)
+        self._pending.append(('start', member))
+        self._pending.append(('end', member))
+        self._write_ready()
+
+    def add_file(self, name, size, mtime, chunks):
+        """Queue a member's data (an iterable of bytes) for compression; size is its expected uncompressed size"""
+        method = ZIP_STORED if self._store(name) else ZIP_DEFLATED
+        # Same margin as zipfile for deflate output growing past the input
+        member = _Member(name, method, mtime, False, size * 1.05 > ZIP64_LIMIT)
+        self._pending.append(('start', member))
+
+        buffer = bytearray()
+        dictionary = b''
+        for data in chunks:
+            member.crc = zlib.crc32(data, member.crc)
+            member.file_size += len(data)
+            buffer += data
+            while len(buffer) > self.block_size:
+                block = bytes(buffer[:self.block_size])
+                del buffer[:self.block_size]
+                self._queue_block(member, block, dictionary, last=False)
+                dictionary = block[-DEFLATE_WINDOW:]
+        self._queue_block(member, bytes(buffer), dictionary, last=True)
+
+        if member.file_size > ZIP64_LIMIT and not member.zip64:
+            raise Exception(f"{name} is larger than its expected size of {size} bytes")
+        self._pending.append(('end', member))
+        self._write_ready()
+
+    def close(self):
+        """Write the remaining members and the central directory"""
+        try:
+            self._write_ready(wait=True)
+            self._write_central_directory()
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._file.close()
+
+    def abort(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._file.close()
+        os.remove(self.path)
+
+    def _store(self, name):
+        extension = os.path.splitext(name)[1].lstrip('.').lower()
+        return self.level == 0 or extension in self.store_extensions
+
+    def _queue_block(self, member, block, dictionary, last):
+        if member.method == ZIP_STORED:
+            self._pending.append(('data', member, block))
+        else:
+            future = self._executor.submit(_deflate_block, block, self.level, dictionary, last)
+            self._pending.append(('block', member, future))
+            self._pending_blocks += 1
+        self._write_ready(wait=self._pending_blocks > self.max_pending_blocks)
+
+    def _write_ready(self, wait=False):
+        """Write queued items in order, as long as they are compressed (waiting for them if asked to)"""
+        while self._pending:
+            item = self._pending[0]
+            if item[0] == 'block':
+                if not item[2].done() and not (wait or self._pending_blocks > self.max_pending_blocks):
+                    return
+                data = item[2].result()
+                self._pending_blocks -= 1
+                self._write_data(item[1], data)
+            elif item[0] == 'data':
+                self._write_data(item[1], item[2])
+            elif item[0] == 'start':
+                item[1].header_offset = self._file.tell()
+                self._file.write(self._local_header(item[1]))
+            else:
+                self._finish_member(item[1])
+            self._pending.popleft()
+
+    def _write_data(self, member, data):
+        self._file.write(data)
+        member.compress_size += len(data)
+
+    def _finish_member(self, member):
+        if member.compress_size > ZIP64_LIMIT and not member.zip64:
+            raise Exception(f"{member.name} compressed past the zip64 threshold")
+        # Sizes and CRC are only known now: fill them into the local header
+        end = self._file.tell()
+        self._file.seek(member.header_offset)
+        self._file.write(self._local_header(member))
+        self._file.seek(end)
+        self._members.append(member)
+
+    def _local_header(self, member):
+        name = member.name.encode('utf-8')
+        extra = b''
+        compress_size, file_size = member.compress_size, member.file_size
+        if member.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+            compress_size = file_size = ZIP64_LIMIT
+        date, time_of_day = _dos_date_time(member.mtime)
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if member.zip64 else 20, _flags(member.name),
+                           member.method, time_of_day, date, member.crc, compress_size, file_size,
+                           len(name), len(extra)) + name + extra
+
+    def _write_central_directory(self):
+        start = self._file.tell()
+        for member in self._members:
+            name = member.name.encode('utf-8')
+            sizes = [member.file_size, member.compress_size, member.header_offset]
+            overflow = [value for value in sizes if value >= ZIP64_LIMIT]
+            extra = struct.pack(f'<HH{len(overflow)}Q', 1, 8 * len(overflow), *overflow) if overflow else b''
+            file_size, compress_size, header_offset = [min(value, ZIP64_LIMIT) for value in sizes]
+            version = 45 if overflow or member.zip64 else 20
+            attributes = (0o40755 << 16) | 0x10 if member.is_dir else 0o100644 << 16
+            date, time_of_day = _dos_date_time(member.mtime)
+            self._file.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version,
+                                         _flags(member.name), member.method, time_of_day, date, member.crc,
+                                         compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                                         attributes, header_offset) + name + extra)
+        end = self._file.tell()
+
+        count, size, offset = len(self._members), end - start, start
+        if count >= ZIP_MAX_ENTRIES or size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT:
+            self._file.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, size, offset))
+            self._file.write(struct.pack('<IIQI', 0x07064b50, 0, end, 1))
+            count, size, offset = min(count, ZIP_MAX_ENTRIES), min(size, ZIP64_LIMIT), min(offset, ZIP64_LIMIT)
+        self._file.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size, offset, 0))
+
+def _flags(name):
+    # Bit 11: the name is UTF-8
+    return 0x800 if not name.isascii() else 0
+
+def _dos_date_time(mtime):
+    moment = time.localtime(mtime) if mtime else time.localtime()
+    # DOS dates start in 1980
+    year, month, day, hour, minute, second = max(moment[:6], (1980, 1, 1, 0, 0, 0))
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
@@ -0,0 +1,201 @@
+import os
+import signal
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from src.utils.metrics import metrics
+from src.utils.large_files import (
+    LARGE_FILE_CONVERSION_TIMEOUT,
+    ENABLE_MEMORY_MONITORING,
+    SUBPROCESS_MEMORY_LIMIT,
+    SUBPROCESS_MEMORY_PER_THREAD,
+    SUBPROCESS_CPU_SHARE,
+    SUBPROCESS_NICE,
+    SUBPROCESS_IONICE_CLASS,
+    SUBPROCESS_IONICE_LEVEL,
+    SUBPROCESS_KILL_GRACE
+)
+
+logger = logging.getLogger(__name__)
+
+# What tools print when an allocation fails under the address space limit
+MEMORY_ERRORS = ('cannot allocate memory', 'out of memory', 'memoryerror', 'std::bad_alloc')
+
+metrics.counter('gigovert_subprocess_overruns_total',
+                'Conversion subprocesses stopped for overrunning a limit, by tool and limit (time, cpu, memory)')
+
+_missing_tools = set()
+
+def _find_tool(name):
+    """Path of a limit tool (prlimit, nice, ionice), warning once if it isn't installed"""
+    path = shutil.which(name)
+    if path is None and name not in _missing_tools:
+        _missing_tools.add(name)
+        logger.warning(f"{name} not found: conversion subprocesses run without the limit it sets")
+    return path
+
+def cpu_time_limit(timeout):
+    """CPU seconds a process with this wall-clock timeout may use"""
+    return int(timeout * max(1, (os.cpu_count() or 1) * SUBPROCESS_CPU_SHARE))
+
+def memory_limit(threads=None):
+    """
+    Address space a process running this many threads may use; glibc gives
+    every thread its own malloc arena, so a fixed limit would stop a tool
+    started with more threads long before it runs out of real memory
+    """
+    if not SUBPROCESS_MEMORY_LIMIT:
+        return None
+    return SUBPROCESS_MEMORY_LIMIT + max(0, (threads or 1) - 1) * SUBPROCESS_MEMORY_PER_THREAD
+
+def limited_command(cmd, cpu_seconds=None, threads=None):
+    """
+    cmd prefixed with prlimit, nice and ionice, which set its limits and
+    priorities and exec it in turn, so they hold from the first instruction
+    (and for every process it starts) without code running between fork and exec.
+    threads is how many threads the tool will run, which raises its memory limit
+    """
+    if shutil.which(cmd[0]) is None:
+        # Fail like Popen would instead of inside the wrappers
+        raise FileNotFoundError(f"{cmd[0]} not found")
+
+    prefix = []
+    limits = []
+    if ENABLE_MEMORY_MONITORING and SUBPROCESS_MEMORY_LIMIT:
+        limits.append(f'--as={memory_limit(threads)}')
+    if cpu_seconds:
+        # SIGXCPU at the soft limit, SIGKILL at the hard one for a process that ignores it
+        limits.append(f'--cpu={cpu_seconds}:{cpu_seconds + SUBPROCESS_KILL_GRACE}')
+    if limits and _find_tool('prlimit'):
+        # No core dumps of 2GB processes stopped by a limit
+        prefix.extend([_find_tool('prlimit'), '--core=0', *limits, '--'])
+    if SUBPROCESS_NICE and _find_tool('nice'):
+        prefix.extend([_find_tool('nice'), '-n', str(SUBPROCESS_NICE)])
+    if SUBPROCESS_IONICE_CLASS is not None and _find_tool('ionice'):
+        # -t: containers may not allow changing the I/O priority; run anyway
+        prefix.extend([_find_tool('ionice'), '-t', '-c', str(SUBPROCESS_IONICE_CLASS)])
+        if SUBPROCESS_IONICE_CLASS in (1, 2):
+            prefix.extend(['-n', str(SUBPROCESS_IONICE_LEVEL)])
+    return prefix + list(cmd)
+
+class LimitedProcess:
+    """
+    A subprocess run under the conversion limits: lower CPU and I/O priority,
+    an address space and CPU time ceiling, and a wall-clock timeout after
+    which its whole process group (it gets its own, so helpers it started
+    go too) is sent SIGTERM, then SIGKILL SUBPROCESS_KILL_GRACE seconds later.
+
+    Use it like Popen; after wait(), check() raises if the process was
+    stopped by a limit and counts it in gigovert_subprocess_overruns_total.
+    """
+    def __init__(self, cmd, timeout=LARGE_FILE_CONVERSION_TIMEOUT, cpu_seconds=None, threads=None, **popen_kwargs):
+        self.tool = os.path.basename(cmd[0])
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else cpu_time_limit(timeout)
+        self.memory_limit = memory_limit(threads)
+        self.cpu_time = None
+        self.overrun = None
+        self._lock = threading.Lock()
+        self._reaped = False
+
+        self.process = subprocess.Popen(limited_command(cmd, self.cpu_seconds, threads), start_new_session=True,
+                                        **popen_kwargs)
+        self.pid = self.process.pid
+        self.stdin = self.process.stdin
+        self.stdout = self.process.stdout
+        self.stderr = self.process.stderr
+
+        self._timer = threading.Timer(timeout, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def wait(self):
+        """Wait for the process to exit and return its exit code"""
+        try:
+            # wait4 reports the CPU time the process used, which tells a CPU limit kill from a crash
+            _, status, usage = os.wait4(self.pid, 0)
+        except ChildProcessError:
+            # Already reaped
+            status, usage = None, None
+        with self._lock:
+            self._reaped = True
+            self._timer.cancel()
+            if status is not None:
+                self.process.returncode = os.waitstatus_to_exitcode(status)
+                self.cpu_time = usage.ru_utime + usage.ru_stime
+        return self.process.wait()
+
+    def kill(self):
+        """Stop the process group now (on errors in the caller)"""
+        self._signal(signal.SIGKILL)
+
+    def check(self, error_output=''):
+        """Raise if a limit stopped the process; error_output is what it printed on stderr"""
+        overrun = self.overrun
+        if overrun is None and self.returncode:
+            # ffmpeg catches SIGXCPU and exits on its own, so the CPU time used tells as well
+            if self.returncode == -signal.SIGXCPU or (self.cpu_seconds and self.cpu_time is not None
+                                                      and self.cpu_time >= self.cpu_seconds):
+                overrun = 'cpu'
+            elif (ENABLE_MEMORY_MONITORING and SUBPROCESS_MEMORY_LIMIT
+                    and any(error in (error_output or '').lower() for error in MEMORY_ERRORS)):
+                overrun = 'memory'
+        if overrun is None:
+            return
+
+        metrics.inc('gigovert_subprocess_overruns_total', {'tool': self.tool, 'limit': overrun})
+        message = {
+            'time': f"{self.tool} ran longer than {self.timeout} seconds and was stopped",
+            'cpu': f"{self.tool} used more than {self.cpu_seconds} seconds of CPU time and was stopped",
+            'memory': f"{self.tool} ran out of its {self.memory_limit // (1024 * 1024)}MB memory limit"
+        }[overrun]
+        logger.warning(message)
+        raise Exception(message)
+
+    def _expire(self):
+        with self._lock:
+            if self._reaped:
+                return
+            self.overrun = 'time'
+        logger.warning(f"{self.tool} (pid {self.pid}) overran its {self.timeout} second timeout, stopping it")
+        self._signal(signal.SIGTERM)
+        kill_timer = threading.Timer(SUBPROCESS_KILL_GRACE, self._signal, args=(signal.SIGKILL,))
+        kill_timer.daemon = True
+        kill_timer.start()
+
+    def _signal(self, signum):
+        with self._lock:
+            if self._reaped:
+                return
+            try:
+                os.killpg(self.pid, signum)
+            except ProcessLookupError:
+                pass
+
+def run_limited(cmd, timeout=LARGE_FILE_CONVERSION_TIMEOUT, cpu_seconds=None, cwd=None, threads=None):
+    """
+    Like subprocess.run(cmd, capture_output=True, text=True) under the
+    conversion limits; raises if a limit stopped the process
+    """
+    # Output goes to temp files so wait() can reap the process itself
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        process = LimitedProcess(cmd, timeout, cpu_seconds, threads, stdout=stdout_file, stderr=stderr_file, cwd=cwd)
+        try:
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        stdout = stdout_file.read().decode(errors='replace')
+        stderr = stderr_file.read().decode(errors='replace')
+
+    process.check(stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
@@ -0,0 +1,163 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from src.utils.large_files import RATE_LIMIT_BACKEND, REDIS_URL, RATE_LIMIT_SWEEP_INTERVAL
+
+try:
+    import redis
+except ImportError:  # Optional: only needed for the redis backend
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+def _refill(tokens, updated, now, capacity, refill_rate):
+    return min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+
+def _take(tokens, capacity, refill_rate, cost):
+    """
+    Token bucket decision shared by the backends. Returns (allowed, tokens left, retry_after)
+
+    A request costing more than the whole bucket is let through once the bucket
+    is full and leaves it in debt, so expensive requests still pay their full cost.
+    """
+    needed = min(cost, capacity)
+    if tokens < needed:
+        return False, tokens, (needed - tokens) / refill_rate
+    return True, tokens - cost, 0.0
+
+class MemoryRateLimitBackend:
+    """Token buckets in a process-local dict; for tests and single-process runs"""
+    def __init__(self, sweep_interval=RATE_LIMIT_SWEEP_INTERVAL):
+        self.sweep_interval = sweep_interval
+        self._buckets = {}  # key -> (tokens, updated, full_at)
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def consume(self, key, capacity, refill_rate, cost):
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = capacity if bucket is None else _refill(bucket[0], bucket[1], now, capacity, refill_rate)
+            allowed, tokens, retry_after = _take(tokens, capacity, refill_rate, cost)
+            if allowed:
+                self._buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            return allowed, retry_after
+
+    def _sweep(self, now):
+        # A bucket that has refilled completely is the same as no bucket at all
+        self._last_sweep = now
+        for key in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+            del self._buckets[key]
+
+    def get_stats(self):
+        return {'backend': 'memory', 'tracked_keys': len(self._buckets)}
+
+class SQLiteRateLimitBackend:
+    """Token buckets in a small SQLite database shared by the worker processes of one host"""
+    def __init__(self, db_path, sweep_interval=RATE_LIMIT_SWEEP_INTERVAL):
+        self.db_path = db_path
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._last_sweep = time.time()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        connection = self._connection()
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_buckets ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_rate_limit_buckets_full_at ON rate_limit_buckets (full_at)')
+
+    def consume(self, key, capacity, refill_rate, cost):
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, refill_rate)
+            allowed, tokens, retry_after = _take(tokens, capacity, refill_rate, cost)
+            if allowed:
+                connection.execute(
+                    'INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                    (key, tokens, now, now + (capacity - tokens) / refill_rate)
+                )
+            if now - self._last_sweep >= self.sweep_interval:
+                self._last_sweep = now
+                connection.execute('DELETE FROM rate_limit_buckets WHERE full_at <= ?', (now,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+    def get_stats(self):
+        count = self._connection().execute('SELECT COUNT(*) FROM rate_limit_buckets').fetchone()[0]
+        return {'backend': 'sqlite', 'tracked_keys': count}
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+# Atomic token bucket in Redis. Uses the server clock so every app instance agrees
+# on time, and expires the key once the bucket would be full again.
+_REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(state[2])) * refill_rate)
+end
+local needed = math.min(cost, capacity)
+if tokens < needed then
+    return {0, tostring((needed - tokens) / refill_rate)}
+end
+tokens = tokens - cost
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill_rate * 1000) + 1000)
+return {1, '0'}
+"""
+
+class RedisRateLimitBackend:
+    """Token buckets in Redis, shared by every app instance; idle keys expire on their own"""
+    def __init__(self, url, key_prefix='ratelimit:'):
+        if redis is None:
+            raise Exception("The redis package is required for the redis rate limit backend")
+        self.key_prefix = key_prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET)
+
+    def consume(self, key, capacity, refill_rate, cost):
+        allowed, retry_after = self._script(keys=[self.key_prefix + key], args=[capacity, refill_rate, cost])
+        return bool(allowed), float(retry_after)
+
+    def get_stats(self):
+        return {'backend': 'redis'}
+
+def create_rate_limit_backend(name=RATE_LIMIT_BACKEND):
+    """Build the configured backend, falling back to SQLite when Redis isn't available"""
+    if name == 'redis':
+        try:
+            return RedisRateLimitBackend(REDIS_URL)
+        except Exception as e:
+            logger.error(f"Redis rate limit backend unavailable, using SQLite: {str(e)}")
+            name = 'sqlite'
+    if name == 'sqlite':
+        db_path = os.path.join(os.path.dirname(__file__), '..', 'database', 'rate_limits.db')
+        return SQLiteRateLimitBackend(os.path.abspath(db_path))
+    if name == 'memory':
+        return MemoryRateLimitBackend()
+    raise Exception(f"Unknown rate limit backend: {name}")
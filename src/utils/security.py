@@ -1,50 +1,102 @@
 from functools import wraps
 from flask import request, jsonify, g
-import time
+import math
 import hashlib
 import os
-from collections import defaultdict, deque
+import logging
+import threading
+from src.utils.logging import conversion_logger
+from src.utils.rate_limit_backends import create_rate_limit_backend
+from src.utils.large_files import LARGE_FILE_RATE_LIMIT, LARGE_FILE_THRESHOLD, CONVERSION_RATE_LIMIT
+
+logger = logging.getLogger(__name__)
 
 class RateLimiter:
-    def __init__(self):
-        self.requests = defaultdict(deque)
-        self.blocked_ips = {}
+    """
+    Cost-weighted token bucket per client, kept in a shared backend so all
+    gunicorn workers (and, with Redis, all instances) enforce one limit.
+
+    A bucket holds `limit` tokens and refills completely over `window` seconds;
+    each request takes `cost` tokens. State is two numbers per key, and keys of
+    clients whose bucket has refilled are evicted by the backend.
+    """
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.stats = {'allowed': 0, 'limited': 0, 'backend_errors': 0}
     
-    def is_rate_limited(self, ip, limit=10, window=60):
-        """Check if IP is rate limited (default: 10 requests per minute)"""
-        now = time.time()
-        
-        # Check if IP is temporarily blocked
-        if ip in self.blocked_ips:
-            if now < self.blocked_ips[ip]:
-                return True
-            else:
-                del self.blocked_ips[ip]
+    def is_rate_limited(self, ip, limit=10, window=60, cost=1, scope='default'):
+        """Check if IP is rate limited (default: 10 requests per minute). Returns (limited, retry_after)"""
+        if self.backend is None:
+            with self._lock:
+                if self.backend is None:
+                    self.backend = create_rate_limit_backend()
         
-        # Clean old requests
-        while self.requests[ip] and self.requests[ip][0] < now - window:
-            self.requests[ip].popleft()
+        try:
+            allowed, retry_after = self.backend.consume(f"{scope}:{ip}", limit, limit / window, cost)
+        except Exception as e:
+            # Fail open: an unavailable backend must not take the API down
+            self.stats['backend_errors'] += 1
+            logger.error(f"Rate limit backend error: {str(e)}")
+            return False, 0
         
-        # Check rate limit
-        if len(self.requests[ip]) >= limit:
-            # Block IP for 5 minutes
-            self.blocked_ips[ip] = now + 300
-            return True
-        
-        # Add current request
-        self.requests[ip].append(now)
-        return False
+        self.stats['allowed' if allowed else 'limited'] += 1
+        return not allowed, retry_after
+    
+    def get_stats(self):
+        """Get rate limiter statistics"""
+        stats = dict(self.stats)
+        if self.backend is not None:
+            try:
+                stats.update(self.backend.get_stats())
+            except Exception as e:
+                stats['backend_error'] = str(e)
+        return stats
 
 rate_limiter = RateLimiter()
 
-def rate_limit(limit=10, window=60):
-    """Rate limiting decorator"""
+def client_ip():
+    """
+    Client address. Behind proxies, ProxyFix (see main.py) has already set it
+    from the X-Forwarded-For hop appended by the TRUSTED_PROXY_HOPS-th proxy;
+    the header's other values come from the client and can't be trusted
+    """
+    return request.remote_addr
+
+def upload_cost(size):
+    """
+    Rate limit cost of converting a file of `size` bytes: 1 for small files, while
+    a large file uses the whole per-minute conversion budget per LARGE_FILE_RATE_LIMIT
+    files, scaled by how many LARGE_FILE_THRESHOLDs it spans
+    """
+    if not size or size < LARGE_FILE_THRESHOLD:
+        return 1
+    return CONVERSION_RATE_LIMIT / LARGE_FILE_RATE_LIMIT * size / LARGE_FILE_THRESHOLD
+
+def rate_limit(limit=10, window=60, cost=1, scope=None):
+    """
+    Rate limiting decorator
+
+    cost is a number or a function of the request returning one; endpoints that
+    share a scope draw from the same bucket
+    """
     def decorator(f):
+        bucket_scope = scope or f.__name__
+        
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            if rate_limiter.is_rate_limited(ip, limit, window):
-                return jsonify({'error': 'Rate limit exceeded. Please try again later.'}), 429
+            ip = client_ip()
+            request_cost = cost(request) if callable(cost) else cost
+            limited, retry_after = rate_limiter.is_rate_limited(ip, limit, window, request_cost, bucket_scope)
+            if limited:
+                conversion_logger.log_security_event('rate_limited', ip, {
+                    'scope': bucket_scope,
+                    'cost': request_cost,
+                    'endpoint': request.endpoint
+                })
+                response = jsonify({'error': 'Rate limit exceeded. Please try again later.'})
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response, 429
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from src.utils.large_files import (
+    STATUS_CACHE_ACTIVE_TTL,
+    STATUS_CACHE_FINISHED_TTL,
+    STATUS_CACHE_MAX_ENTRIES
+)
+
+FINISHED_STATUSES = ('completed', 'failed')
+
+class JobStatusCache:
+    """
+    Process-local cache of job status dicts so /status reads don't hit SQLite.
+
+    Statuses written by this process (Job.update_status and the worker pool)
+    are authoritative and served until the job finishes. Statuses read from the
+    database may be stale when another process is running the job, so active
+    ones are only trusted for STATUS_CACHE_ACTIVE_TTL seconds. Finished jobs
+    never change and are evicted STATUS_CACHE_FINISHED_TTL seconds after they
+    were cached.
+    """
+    def __init__(self, active_ttl=STATUS_CACHE_ACTIVE_TTL, finished_ttl=STATUS_CACHE_FINISHED_TTL,
+                 max_entries=STATUS_CACHE_MAX_ENTRIES):
+        self.active_ttl = active_ttl
+        self.finished_ttl = finished_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    def get(self, job_id):
+        """Get the cached status of a job, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            status, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[job_id]
+                self.stats['evictions'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self.stats['hits'] += 1
+            return dict(status)
+
+    def put(self, job_id, status, authoritative=False):
+        """
+        Cache a job status. authoritative=True means this process made the change
+        itself, so an active status stays valid until the job finishes.
+        """
+        now = time.monotonic()
+        if status['status'] in FINISHED_STATUSES:
+            expires_at = now + self.finished_ttl
+        elif authoritative:
+            expires_at = None
+        else:
+            expires_at = now + self.active_ttl
+
+        with self._lock:
+            self._entries.pop(job_id, None)
+            self._entries[job_id] = (dict(status), expires_at)
+            self.stats['writes'] += 1
+            self._evict_expired(now)
+
+    def invalidate(self, job_id):
+        """Drop a job from the cache"""
+        with self._lock:
+            self._entries.pop(job_id, None)
+
+    def get_stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'entries': len(self._entries),
+                'hit_rate_percent': round(self.stats['hits'] / lookups * 100, 2) if lookups else 0,
+                **self.stats
+            }
+
+    def _evict_expired(self, now):
+        # Entries are kept in write order: drop expired ones from the front, and the
+        # oldest ones while the cache is over its size limit. Others expire lazily in get()
+        while self._entries:
+            job_id, (status, expires_at) = next(iter(self._entries.items()))
+            expired = expires_at is not None and expires_at <= now
+            if not expired and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[job_id]
+            self.stats['evictions'] += 1
+
+# Global job status cache instance
+job_status_cache = JobStatusCache()
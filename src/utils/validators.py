@@ -27,6 +27,21 @@ def validate_youtube_url(url):
             return True
     return False
 
+def extract_youtube_video_id(url):
+    """Extract the video ID from a YouTube URL, or None if it isn't one"""
+    youtube_patterns = [
+        r'https?://(?:www\.)?youtube\.com/watch\?(?:.*&)?v=([\w-]+)',
+        r'https?://(?:www\.)?youtu\.be/([\w-]+)',
+        r'https?://(?:www\.)?youtube\.com/embed/([\w-]+)',
+        r'https?://(?:www\.)?youtube\.com/v/([\w-]+)'
+    ]
+    
+    for pattern in youtube_patterns:
+        match = re.match(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
 def sanitize_filename(filename):
     """Sanitize filename to prevent path traversal attacks"""
     # Remove any path components
@@ -0,0 +1,44 @@
+import io
+import zipfile
+from src.utils.large_files import ZIP_STREAM_BUFFER_SIZE
+
+class _StreamBuffer(io.RawIOBase):
+    """Write-only, unseekable file object that holds what ZipFile writes until it is drained"""
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries, buffer_size=ZIP_STREAM_BUFFER_SIZE):
+    """
+    Yield a zip archive of (file path, name in archive) entries piece by piece
+    while it is being built, so it never exists as a whole in memory or on disk.
+
+    The output can't seek, so ZipFile writes each file's CRC and sizes in a data
+    descriptor after its data; Zip64 is used for files over 4GB. Files are
+    stored uncompressed since converted media is already compressed.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, name in entries:
+            info = zipfile.ZipInfo.from_file(path, name)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                for data in iter(lambda: source.read(buffer_size), b''):
+                    target.write(data)
+                    yield buffer.drain()
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
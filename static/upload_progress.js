@@ -129,6 +129,153 @@ class LargeFileUploader {
     }
 }
 
+/**
+ * Resumable chunked uploader: sends chunks in parallel with a SHA-256 checksum
+ * each, and after an interruption only re-sends the chunks the server is missing
+ */
+class ChunkedFileUploader extends LargeFileUploader {
+    constructor(options = {}) {
+        super();
+        this.chunkSize = options.chunkSize || 8 * 1024 * 1024; // 8MB chunks
+        this.parallel = options.parallel || 4;
+        this.aborted = false;
+    }
+
+    async upload(file, fields = {}) {
+        this.uploadStartTime = Date.now();
+        this.aborted = false;
+
+        try {
+            const upload = await this.resumeOrInit(file);
+            const pending = upload.missing_chunks;
+            let loaded = (upload.total_chunks - pending.length) * upload.chunk_size;
+
+            // Send the missing chunks with a fixed number of requests in flight
+            const worker = async () => {
+                while (pending.length && !this.aborted) {
+                    const chunkNumber = pending.shift();
+                    const start = chunkNumber * upload.chunk_size;
+                    const chunk = file.slice(start, Math.min(start + upload.chunk_size, file.size));
+                    await this.sendChunk(upload.upload_id, chunkNumber, chunk);
+
+                    loaded += chunk.size;
+                    this.reportProgress(Math.min(loaded, file.size), file.size);
+                }
+            };
+            await Promise.all(Array.from({ length: this.parallel }, worker));
+
+            if (this.aborted) {
+                throw new Error('Upload cancelled');
+            }
+
+            const completeResponse = await fetch(`/api/uploads/${upload.upload_id}/complete`, { method: 'POST' });
+            if (!completeResponse.ok) {
+                const result = await completeResponse.json();
+                throw new Error(result.error || 'Failed to complete upload');
+            }
+
+            // Start the conversion from the assembled upload
+            const formData = new FormData();
+            Object.entries(fields).forEach(([key, value]) => formData.append(key, value));
+            formData.append('source', 'chunked');
+            formData.append('upload_id', upload.upload_id);
+
+            const response = await fetch('/api/convert', { method: 'POST', body: formData });
+            const result = await response.json();
+            if (!response.ok) {
+                throw new Error(result.error || 'Conversion failed');
+            }
+
+            localStorage.removeItem(this.storageKey(file));
+            if (this.onComplete) {
+                this.onComplete(result);
+            }
+            return result;
+
+        } catch (error) {
+            if (this.onError) {
+                this.onError(error);
+            }
+            throw error;
+        }
+    }
+
+    async resumeOrInit(file) {
+        // Resume a previous upload of the same file if the server still has it
+        const savedId = localStorage.getItem(this.storageKey(file));
+        if (savedId) {
+            const response = await fetch(`/api/uploads/${savedId}`);
+            if (response.ok) {
+                return await response.json();
+            }
+            localStorage.removeItem(this.storageKey(file));
+        }
+
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, chunk_size: this.chunkSize })
+        });
+        const upload = await response.json();
+        if (!response.ok) {
+            throw new Error(upload.error || 'Failed to start upload');
+        }
+
+        localStorage.setItem(this.storageKey(file), upload.upload_id);
+        upload.missing_chunks = Array.from({ length: upload.total_chunks }, (_, i) => i);
+        return upload;
+    }
+
+    async sendChunk(uploadId, chunkNumber, chunk, attempt = 1) {
+        const headers = {};
+        if (window.crypto && crypto.subtle) {
+            const digest = await crypto.subtle.digest('SHA-256', await chunk.arrayBuffer());
+            headers['X-Chunk-SHA256'] = Array.from(new Uint8Array(digest))
+                .map(b => b.toString(16).padStart(2, '0')).join('');
+        }
+
+        try {
+            const response = await fetch(`/api/uploads/${uploadId}/chunks/${chunkNumber}`, {
+                method: 'PUT',
+                headers: headers,
+                body: chunk
+            });
+            if (!response.ok) {
+                const result = await response.json();
+                throw new Error(result.error || `Chunk ${chunkNumber} failed`);
+            }
+        } catch (error) {
+            if (attempt >= 3 || this.aborted) {
+                throw error;
+            }
+            return this.sendChunk(uploadId, chunkNumber, chunk, attempt + 1);
+        }
+    }
+
+    reportProgress(loaded, total) {
+        const elapsed = Date.now() - this.uploadStartTime;
+        const speed = loaded / (elapsed / 1000);
+
+        if (this.onProgress) {
+            this.onProgress({
+                percent: Math.round((loaded / total) * 100),
+                loaded: loaded,
+                total: total,
+                speed: this.formatSpeed(speed),
+                remaining: this.formatTime((total - loaded) / speed)
+            });
+        }
+    }
+
+    storageKey(file) {
+        return `gigovert-upload:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    cancel() {
+        this.aborted = true;
+    }
+}
+
 // Enhanced progress display for large files
 function showUploadProgress(progressInfo) {
     const progressContainer = document.getElementById('progress-container');
@@ -163,4 +310,5 @@ function showUploadProgress(progressInfo) {
 
 // Export for use in main application
 window.LargeFileUploader = LargeFileUploader;
+window.ChunkedFileUploader = ChunkedFileUploader;
 window.showUploadProgress = showUploadProgress;
@@ -0,0 +1,46 @@
+import io
+import hashlib
+import pytest
+from src.utils.large_file_handler import ChunkedUploadManager
+from src.utils.large_files import MIN_UPLOAD_CHUNK_SIZE
+
+CHUNK = MIN_UPLOAD_CHUNK_SIZE
+
+def _chunks(count):
+    return [bytes([i + 1]) * CHUNK for i in range(count)]
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+@pytest.fixture
+def manager(tmp_path):
+    return ChunkedUploadManager(str(tmp_path))
+
+def test_bad_resend_marks_chunk_missing(manager):
+    chunks = _chunks(3)
+    upload_id = manager.init_upload('video.mp4', CHUNK * 3, CHUNK)['upload_id']
+    for number, data in enumerate(chunks):
+        manager.write_chunk(upload_id, number, io.BytesIO(data), _sha256(data))
+
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        manager.write_chunk(upload_id, 1, io.BytesIO(b'\0' * CHUNK), _sha256(chunks[1]))
+
+    assert manager.missing_chunks(upload_id) == [1]
+    with pytest.raises(ValueError, match='missing 1 chunk'):
+        manager.complete_upload(upload_id)
+
+    # Sending the chunk again repairs the upload
+    assert manager.write_chunk(upload_id, 1, io.BytesIO(chunks[1]), _sha256(chunks[1])) == []
+    with open(manager.complete_upload(upload_id), 'rb') as f:
+        assert f.read() == b''.join(chunks)
+
+def test_short_resend_marks_chunk_missing(manager):
+    chunks = _chunks(2)
+    upload_id = manager.init_upload('video.mp4', CHUNK * 2, CHUNK)['upload_id']
+    for number, data in enumerate(chunks):
+        manager.write_chunk(upload_id, number, io.BytesIO(data))
+
+    with pytest.raises(ValueError, match='must be exactly'):
+        manager.write_chunk(upload_id, 0, io.BytesIO(b'\0' * (CHUNK // 2)))
+
+    assert manager.missing_chunks(upload_id) == [0]
@@ -0,0 +1,43 @@
+import json
+from datetime import datetime, timezone
+from src.utils.log_reader import tail_log, INDEX_SUFFIX, INDEX_RECORD
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+
+def _line(seconds, message):
+    timestamp = datetime.fromtimestamp(BASE + seconds, timezone.utc).replace(tzinfo=None).isoformat()
+    return json.dumps({'timestamp': timestamp, 'message': message}) + '\n'
+
+def _write_log(path, batches, index_order):
+    """Write batches of (first second, message) as two lines each, 30 seconds apart, and index them in index_order"""
+    offsets = []
+    with open(path, 'w') as f:
+        for seconds, message in batches:
+            offsets.append(f.tell())
+            f.write(_line(seconds, f'{message} first'))
+            f.write(_line(seconds + 30, f'{message} last'))
+    with open(path + INDEX_SUFFIX, 'wb') as f:
+        for position in index_order:
+            f.write(INDEX_RECORD.pack(BASE + batches[position][0], offsets[position]))
+
+def test_out_of_order_index_keeps_matching_batches(tmp_path):
+    path = str(tmp_path / 'access.log')
+    # Concurrent writers append a batch and its index record separately, so
+    # records land out of offset order, and batch times only roughly follow offsets
+    batches = [(0, 'a'), (100, 'b'), (200, 'c'), (340, 'd'), (300, 'e')]
+    _write_log(path, batches, index_order=[2, 1, 0, 4, 3])
+
+    result = tail_log(path, lines=10, since=BASE + 320, json_lines=True)
+
+    assert [entry['message'] for entry in result['lines']] == ['d first', 'd last', 'e last']
+
+def test_out_of_order_index_narrows_until(tmp_path):
+    path = str(tmp_path / 'access.log')
+    batches = [(0, 'a'), (600, 'b'), (1200, 'c'), (1800, 'd')]
+    _write_log(path, batches, index_order=[3, 2, 1, 0])
+
+    result = tail_log(path, lines=10, until=BASE + 1128, json_lines=True)
+
+    assert [entry['message'] for entry in result['lines']] == ['a first', 'a last', 'b first', 'b last']
+    # Only the first two batches are read, not the whole log
+    assert result['scanned_bytes'] == len(_line(0, 'a first') + _line(30, 'a last')) * 2